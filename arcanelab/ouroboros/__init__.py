@@ -1 +1 @@
-
+default_app_config = 'arcanelab.ouroboros.apps.OuroborosConfig'
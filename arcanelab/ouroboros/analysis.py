@@ -0,0 +1,344 @@
+###################################################################################
+#                                                                                 #
+# Static analysis of compiled workflow specs: enumeration of the paths (by        #
+#   transitions) from the ENTER node to the EXIT nodes of each course, bounding   #
+#   the cycles, dominators of each node, strongly connected components and the    #
+#   condensed DAG (used to count paths without enumerating them), the possible    #
+#   outcomes of each split, and a coverage matrix of transitions which can be     #
+#   merged with the execution logs (or simulated runs).                           #
+#                                                                                 #
+###################################################################################
+
+from __future__ import unicode_literals
+from itertools import groupby
+from operator import itemgetter
+from . import models
+
+
+AUTOMATIC_TYPES = (models.NodeSpec.ENTER, models.NodeSpec.STEP, models.NodeSpec.MULTIPLEXER)
+
+
+def _course_nodes(compiled_spec, course):
+    return [node for node, node_course in enumerate(compiled_spec.node_courses) if node_course == course]
+
+
+def _successors(compiled_spec, node):
+    return [compiled_spec.transition_destinations[transition] for transition in compiled_spec.outbounds(node)]
+
+
+def _enter(compiled_spec, course):
+    return compiled_spec.nodes_of_type(course, models.NodeSpec.ENTER)[0]
+
+
+def enumerate_paths(compiled_spec, course, max_visits=1, limit=None):
+    """
+    Enumerates the paths from the ENTER node of a course to its EXIT nodes.
+    :param compiled_spec: The compiled spec.
+    :param course: The course index.
+    :param max_visits: How many times a path may visit the same node. 1 [default] enumerates simple
+      paths only, while greater values unroll the cycles up to that bound.
+    :param limit: The maximum number of paths to yield, or None [default] to yield all of them.
+    :return: A generator of tuples of transition indices.
+    """
+
+    visits = {}
+    path = []
+    count = 0
+    enter = _enter(compiled_spec, course)
+    stack = [(enter, iter(compiled_spec.outbounds(enter)))]
+    visits[enter] = 1
+    while stack:
+        node, outbounds = stack[-1]
+        transition = next(outbounds, None)
+        if transition is None:
+            stack.pop()
+            visits[node] -= 1
+            if path:
+                path.pop()
+            continue
+        destination = compiled_spec.transition_destinations[transition]
+        if visits.get(destination, 0) >= max_visits:
+            continue
+        if compiled_spec.node_type(destination) == models.NodeSpec.EXIT:
+            yield tuple(path) + (transition,)
+            count += 1
+            if limit is not None and count >= limit:
+                return
+            continue
+        path.append(transition)
+        visits[destination] = visits.get(destination, 0) + 1
+        stack.append((destination, iter(compiled_spec.outbounds(destination))))
+
+
+def dominators(compiled_spec, course):
+    """
+    Computes the immediate dominator of each node reachable from the ENTER node of a course (i.e. the
+      last node every path from ENTER must go through before reaching it), by the iterative algorithm
+      of Cooper, Harvey and Kennedy.
+    :param compiled_spec: The compiled spec.
+    :param course: The course index.
+    :return: A dictionary of node index => immediate dominator index (ENTER dominates itself).
+    """
+
+    enter = _enter(compiled_spec, course)
+    # Reverse post-order of the reachable nodes.
+    order, seen, stack = [], {enter}, [(enter, iter(_successors(compiled_spec, enter)))]
+    while stack:
+        node, successors = stack[-1]
+        successor = next(successors, None)
+        if successor is None:
+            stack.pop()
+            order.append(node)
+        elif successor not in seen:
+            seen.add(successor)
+            stack.append((successor, iter(_successors(compiled_spec, successor))))
+    order.reverse()
+    position = {node: index for index, node in enumerate(order)}
+    predecessors = {node: [] for node in order}
+    for node in order:
+        for successor in _successors(compiled_spec, node):
+            predecessors[successor].append(node)
+
+    def intersect(first, second):
+        while first != second:
+            while position[first] > position[second]:
+                first = idom[first]
+            while position[second] > position[first]:
+                second = idom[second]
+        return first
+
+    idom = {enter: enter}
+    changed = True
+    while changed:
+        changed = False
+        for node in order[1:]:
+            processed = [predecessor for predecessor in predecessors[node] if predecessor in idom]
+            new_idom = processed[0]
+            for predecessor in processed[1:]:
+                new_idom = intersect(predecessor, new_idom)
+            if idom.get(node) != new_idom:
+                idom[node] = new_idom
+                changed = True
+    return idom
+
+
+def condensation(compiled_spec, course):
+    """
+    Computes the strongly connected components of the graph of a course (by Tarjan's algorithm)
+      and the DAG between them.
+    :param compiled_spec: The compiled spec.
+    :param course: The course index.
+    :return: A tuple (component by node index, DAG edges) where the edges are a dictionary of
+      component => list of (transition index, target component), excluding the transitions inside
+      the same component.
+    """
+
+    index, lowlink, on_stack, stack, component = {}, {}, set(), [], {}
+    counter = [0, 0]
+    for root in _course_nodes(compiled_spec, course):
+        if root in index:
+            continue
+        work = [(root, iter(_successors(compiled_spec, root)))]
+        index[root] = lowlink[root] = counter[0]
+        counter[0] += 1
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            node, successors = work[-1]
+            successor = next(successors, None)
+            if successor is not None:
+                if successor not in index:
+                    index[successor] = lowlink[successor] = counter[0]
+                    counter[0] += 1
+                    stack.append(successor)
+                    on_stack.add(successor)
+                    work.append((successor, iter(_successors(compiled_spec, successor))))
+                elif successor in on_stack:
+                    lowlink[node] = min(lowlink[node], index[successor])
+                continue
+            work.pop()
+            if work:
+                lowlink[work[-1][0]] = min(lowlink[work[-1][0]], lowlink[node])
+            if lowlink[node] == index[node]:
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component[member] = counter[1]
+                    if member == node:
+                        break
+                counter[1] += 1
+
+    edges = {}
+    for node in component:
+        for transition in compiled_spec.outbounds(node):
+            target = component[compiled_spec.transition_destinations[transition]]
+            if target != component[node]:
+                edges.setdefault(component[node], []).append((transition, target))
+    return component, edges
+
+
+def count_paths(compiled_spec, course):
+    """
+    Counts the paths from the ENTER node of a course to its EXIT nodes in the condensed DAG (i.e.
+      each cycle counts as a single step), memoizing the count of each component. This scales to
+      large specs, where enumerating the paths is not feasible.
+    :param compiled_spec: The compiled spec.
+    :param course: The course index.
+    :return: The count of condensed paths.
+    """
+
+    component, edges = condensation(compiled_spec, course)
+    exits = set(component[node] for node in compiled_spec.nodes_of_type(course, models.NodeSpec.EXIT))
+    counts = {}
+    # Tarjan's algorithm numbers the components in reverse topological order.
+    for current in sorted(set(component.values())):
+        counts[current] = (1 if current in exits else 0) + sum(counts[target]
+                                                               for transition, target in edges.get(current, ()))
+    return counts[component[_enter(compiled_spec, course)]]
+
+
+def split_outcomes(compiled_spec, node):
+    """
+    Describes how the branches of a split node combine: the exit values each branch can end with
+      (-1 stands for the branches being joined or cancelled).
+    :param compiled_spec: The compiled spec.
+    :param node: The index of the split node.
+    :return: A tuple (dictionary of branch code => sorted exit values, count of combinations).
+    """
+
+    outcomes = {}
+    combinations = 1
+    for branch in compiled_spec.branches(node):
+        values = set(compiled_spec.node_exit_values[exit_node]
+                     for exit_node in compiled_spec.nodes_of_type(branch, models.NodeSpec.EXIT))
+        if compiled_spec.nodes_of_type(branch, models.NodeSpec.CANCEL) or \
+                compiled_spec.nodes_of_type(branch, models.NodeSpec.JOINED):
+            values.add(-1)
+        outcomes[compiled_spec.string(compiled_spec.course_codes[branch])] = sorted(values)
+        combinations *= len(values)
+    return outcomes, combinations
+
+
+def segments(compiled_spec, course):
+    """
+    Maps each pair of consecutive persistent nodes (the ones being logged, plus ENTER) of a course to
+      the sequences of transitions which may lead from the first to the second one through automatic
+      nodes only. This is what allows merging the execution logs with the enumerated paths.
+    :param compiled_spec: The compiled spec.
+    :param course: The course index.
+    :return: A dictionary of (origin node, destination node) => list of tuples of transition indices.
+    """
+
+    result = {}
+    for origin in _course_nodes(compiled_spec, course):
+        if compiled_spec.node_type(origin) in (models.NodeSpec.STEP, models.NodeSpec.MULTIPLEXER):
+            continue
+        stack = [(transition,) for transition in compiled_spec.outbounds(origin)]
+        while stack:
+            segment = stack.pop()
+            destination = compiled_spec.transition_destinations[segment[-1]]
+            if compiled_spec.node_type(destination) in AUTOMATIC_TYPES:
+                stack.extend(segment + (transition,) for transition in compiled_spec.outbounds(destination)
+                             if transition not in segment)
+            else:
+                result.setdefault((origin, destination), []).append(segment)
+    return result
+
+
+def log_traces(workflow_spec):
+    """
+    Retrieves the traces (sequences of landed node ids, along with the ids of the transitions taken to
+      land there and of the nodes they were taken from, by course instance) of a workflow spec from the
+      course instance logs, in a single query. Logs are selected by the spec of their nodes: instances
+      migrated from (or to) another version only contribute their landings in this version.
+    :param workflow_spec: The workflow spec.
+    :return: A generator of lists of (node spec id, transition spec id or None, previous node spec id
+      or None) triples.
+    """
+
+    rows = models.CourseInstanceLog.objects.filter(
+        node_spec__course_spec__workflow_spec=workflow_spec
+    ).order_by('course_instance_id', 'id').values_list(
+        'course_instance_id', 'node_spec_id', 'transition_spec_id', 'previous_node_spec_id'
+    ).iterator()
+    for course_instance_id, group in groupby(rows, itemgetter(0)):
+        yield [row[1:] for row in group]
+
+
+def _taken(compiled_spec, candidates, transition_spec_id):
+    # Only the candidate segments ending in the logged transition (if any) are kept, and only the
+    #   transitions they all share are surely taken.
+    if transition_spec_id is not None:
+        transition = compiled_spec.transition_index(transition_spec_id)
+        candidates = [segment for segment in candidates if segment[-1] == transition]
+    if not candidates:
+        return set()
+    return set(candidates[0]).intersection(*candidates[1:])
+
+
+def report(compiled_spec, traces=(), max_visits=1, limit=1000):
+    """
+    Builds a machine-readable (json-serializable) analysis report of a compiled spec.
+    :param compiled_spec: The compiled spec.
+    :param traces: An iterable of traces (lists of (node spec id, transition spec id, previous node
+      spec id) triples, by course instance, as returned by log_traces) to merge into the coverage
+      matrix. Transitions are counted as hits only when the logs tell they were taken (an ambiguous
+      segment only counts the transitions shared by all its candidates).
+    :param max_visits: The cycle bound used to enumerate the paths.
+    :param limit: The maximum number of paths to enumerate by course.
+    :return: A dictionary with the 'courses' analysis and the 'coverage' matrix (one row by transition).
+    """
+
+    def code(node):
+        return compiled_spec.string(compiled_spec.node_codes[node])
+
+    courses = {}
+    path_counts = [0] * len(compiled_spec.transition_ids)
+    hits = [0] * len(compiled_spec.transition_ids)
+    course_segments = {}
+    for course in range(len(compiled_spec.course_ids)):
+        paths = list(enumerate_paths(compiled_spec, course, max_visits, limit))
+        for path in paths:
+            for transition in set(path):
+                path_counts[transition] += 1
+        course_segments.update(segments(compiled_spec, course))
+        idom = dominators(compiled_spec, course)
+        component, edges = condensation(compiled_spec, course)
+        courses[compiled_spec.string(compiled_spec.course_codes[course])] = {
+            'paths': [[compiled_spec.transition_ids[transition] for transition in path] for path in paths],
+            'truncated': limit is not None and len(paths) >= limit,
+            'condensed_path_count': count_paths(compiled_spec, course),
+            'cyclic': len(set(component.values())) < len(component),
+            'dominators': {code(node): code(dominator) for node, dominator in idom.items()},
+            'splits': {code(node): dict(zip(('branches', 'combinations'), split_outcomes(compiled_spec, node)))
+                       for node in compiled_spec.nodes_of_type(course, models.NodeSpec.SPLIT)},
+        }
+
+    for trace in traces:
+        if not trace:
+            continue
+        origin = _enter(compiled_spec, compiled_spec.node_courses[compiled_spec.node_index(trace[0][0])])
+        for node_spec_id, transition_spec_id, previous_node_spec_id in trace:
+            # The logged previous node, if any, is the origin: for an instance migrated to this version,
+            #   its first landing here was not reached from the ENTER node.
+            if previous_node_spec_id is not None:
+                origin = compiled_spec.node_index(previous_node_spec_id)
+            destination = compiled_spec.node_index(node_spec_id)
+            for transition in _taken(compiled_spec, course_segments.get((origin, destination), ()),
+                                     transition_spec_id):
+                hits[transition] += 1
+            origin = destination
+
+    coverage = []
+    for transition, transition_id in enumerate(compiled_spec.transition_ids):
+        origin = compiled_spec.transition_origins[transition]
+        coverage.append({
+            'transition': transition_id,
+            'course': compiled_spec.string(compiled_spec.course_codes[compiled_spec.node_courses[origin]]),
+            'origin': code(origin),
+            'destination': code(compiled_spec.transition_destinations[transition]),
+            'action_name': compiled_spec.string(compiled_spec.transition_action_names[transition]),
+            'paths': path_counts[transition],
+            'hits': hits[transition],
+        })
+    return {'code': compiled_spec.code, 'version': compiled_spec.version, 'courses': courses, 'coverage': coverage}
@@ -0,0 +1,14 @@
+from __future__ import unicode_literals
+from django.apps import AppConfig
+from django.utils.translation import ugettext_lazy as _
+
+
+class OuroborosConfig(AppConfig):
+    name = 'arcanelab.ouroboros'
+    label = 'ouroboros'
+    verbose_name = _('Ouroboros')
+
+    def ready(self):
+        # The compiled specs are warmed up on the first request, not here: no query runs at startup.
+        from . import signals
+        signals.connect()
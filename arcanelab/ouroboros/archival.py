@@ -0,0 +1,158 @@
+###################################################################################
+#                                                                                 #
+# Archival of course instance logs. The logs of the workflow instances which      #
+#   terminated (their main course reached an exit or cancel node) before a given  #
+#   date are moved, in batches of workflow instances, either into the compact     #
+#   CourseInstanceLogArchive table or into a gzipped json-lines file (one log per #
+#   line), and deleted from the CourseInstanceLog table.                          #
+#                                                                                 #
+# Batches are processed in order of workflow instance, so the progress can be     #
+#   checkpointed as the last processed workflow instance id.                      #
+#                                                                                 #
+###################################################################################
+
+from __future__ import unicode_literals
+from datetime import timedelta
+from django.db.transaction import atomic
+from django.utils.dateparse import parse_datetime
+from django.utils.six import text_type
+from django.utils.timezone import now
+from . import models
+import gzip
+import io
+import json
+import os
+
+
+FIELDS = ('id', 'created_on', 'user_id', 'course_instance__workflow_instance_id', 'course_instance_id',
+          'node_spec_id', 'previous_node_spec_id', 'transition_spec_id', 'elapsed', 'shard_key')
+# The names of the FIELDS in the archive table, and in the archive files.
+COLUMNS = ('log_id', 'created_on', 'user_id', 'workflow_instance_id', 'course_instance_id', 'node_spec_id',
+           'previous_node_spec_id', 'transition_spec_id', 'elapsed', 'shard_key')
+KEYS = ('id', 'created_on', 'user', 'workflow_instance', 'course_instance', 'node_spec', 'previous_node_spec',
+        'transition_spec', 'elapsed', 'shard_key')
+
+
+def terminated_instances(before, after=0, limit=500):
+    """
+    Gets the ids of the workflow instances which terminated before a given date.
+    :param before: The date.
+    :param after: Only workflow instances with a greater id are considered.
+    :param limit: The maximum number of ids to get.
+    :return: A list of workflow instance ids, in ascending order.
+    """
+
+    return list(models.WorkflowInstance.objects.filter(
+        pk__gt=after, courses__parent__isnull=True,
+        courses__node_instance__node_spec__type__in=(models.NodeSpec.EXIT, models.NodeSpec.CANCEL),
+        courses__node_instance__created_on__lt=before
+    ).order_by('pk').values_list('pk', flat=True)[:limit])
+
+
+def archive_batch(workflow_instance_ids, stream=None):
+    """
+    Moves the logs of the given workflow instances into the archive table or, if a stream is given,
+      into it as json lines. Then, the logs are deleted.
+    :param workflow_instance_ids: The ids of the workflow instances.
+    :param stream: An optional file-like text object to write the logs into.
+    :return: The number of moved logs.
+    """
+
+    with atomic():
+        logs = models.CourseInstanceLog.objects.filter(course_instance__workflow_instance_id__in=workflow_instance_ids)
+        rows = list(logs.order_by('id').values_list(*FIELDS))
+        if not rows:
+            return 0
+        if stream is None:
+            models.CourseInstanceLogArchive.objects.bulk_create([
+                models.CourseInstanceLogArchive(**dict(zip(COLUMNS, row))) for row in rows
+            ])
+        else:
+            for row in rows:
+                record = dict(zip(KEYS, row))
+                record['created_on'] = record['created_on'].isoformat()
+                # Elapsed times are written in seconds.
+                if record['elapsed'] is not None:
+                    record['elapsed'] = record['elapsed'].total_seconds()
+                stream.write(text_type(json.dumps(record, sort_keys=True)) + '\n')
+            stream.flush()
+        models.CourseInstanceLog.objects.filter(id__in=[row[0] for row in rows]).delete()
+        return len(rows)
+
+
+def _read_checkpoint(checkpoint):
+    if not checkpoint or not os.path.exists(checkpoint):
+        return 0
+    with open(checkpoint) as stream:
+        return json.load(stream)['last_workflow_instance']
+
+
+def _write_checkpoint(checkpoint, last):
+    if checkpoint:
+        with open(checkpoint + '.tmp', 'w') as stream:
+            json.dump({'last_workflow_instance': last}, stream)
+        os.rename(checkpoint + '.tmp', checkpoint)
+
+
+def archive(days, batch_size=500, path=None, checkpoint=None):
+    """
+    Archives the logs of the workflow instances terminated more than `days` days ago, batch by batch.
+      Only one batch is kept in memory at a time, and each batch is moved in its own transaction.
+    :param days: The minimum age (in days) of the termination of the workflow instances.
+    :param batch_size: The number of workflow instances by batch.
+    :param path: An optional path of a gzipped json-lines file to append the logs to, instead of using
+      the archive table.
+    :param checkpoint: An optional path of a checkpoint file: an interrupted run is resumed after the
+      last workflow instance it processed. The checkpoint is updated after each batch, and removed
+      when the run completes.
+    :return: A generator of (last workflow instance id, moved logs) tuples, one by batch.
+    """
+
+    before = now() - timedelta(days=days)
+    last = _read_checkpoint(checkpoint)
+    while True:
+        ids = terminated_instances(before, last, batch_size)
+        if not ids:
+            # The run is complete: the next one starts over, since older workflow instances
+            #   may have terminated meanwhile.
+            if checkpoint and os.path.exists(checkpoint):
+                os.remove(checkpoint)
+            return
+        if path:
+            # Each batch is appended as a gzip member: readers see a single stream.
+            with io.TextIOWrapper(gzip.open(path, 'ab')) as stream:
+                count = archive_batch(ids, stream)
+        else:
+            count = archive_batch(ids)
+        last = ids[-1]
+        _write_checkpoint(checkpoint, last)
+        yield last, count
+
+
+def read_archive(path, workflow_instance_id=None):
+    """
+    Reads the logs from an archive file. If a batch was written but the run was interrupted before
+      deleting its logs, they were archived again by the next run: duplicated logs are skipped.
+    :param path: The path of the gzipped json-lines file.
+    :param workflow_instance_id: If given, only the logs of this workflow instance are read.
+    :return: A generator of dictionaries (with the created_on and elapsed fields parsed). Files written
+      before the archives had the previous_node_spec, transition_spec, elapsed and shard_key fields
+      are read with None (or '') in them.
+    """
+
+    seen = set()
+    with io.TextIOWrapper(gzip.open(path, 'rb')) as stream:
+        for line in stream:
+            record = json.loads(line)
+            if workflow_instance_id is not None and record['workflow_instance'] != workflow_instance_id:
+                continue
+            if record['id'] in seen:
+                continue
+            seen.add(record['id'])
+            record['created_on'] = parse_datetime(record['created_on'])
+            elapsed = record.get('elapsed')
+            record['elapsed'] = None if elapsed is None else timedelta(seconds=elapsed)
+            for key in ('previous_node_spec', 'transition_spec'):
+                record.setdefault(key, None)
+            record.setdefault('shard_key', '')
+            yield record
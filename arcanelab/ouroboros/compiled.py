@@ -0,0 +1,453 @@
+###################################################################################
+#                                                                                 #
+# Compiled workflow specs: an ORM-free, immutable representation of a workflow    #
+#   spec. The graph is kept in flat integer arrays (CSR-like adjacency lists) and #
+#   every string (codes, names, permissions) or condition / callable reference is #
+#   kept as an index into a string table or a callable path table (declarative    #
+#   conditions are kept there as their json text).                                #
+#                                                                                 #
+# Compiled specs can be dumped to a compact binary file which starts with a magic #
+#   and a format version, and be loaded back by reading such file. The arrays are #
+#   copied into the compiled spec (files are small, so they are read at once      #
+#   instead of memory-mapped). Loading them does not need to query the spec       #
+#   tables.                                                                       #
+#                                                                                 #
+###################################################################################
+
+from __future__ import unicode_literals
+from array import array
+from contextlib import contextmanager
+from threading import local
+from django.conf import settings
+from django.core.cache import caches, DEFAULT_CACHE_ALIAS
+from django.utils.translation import ugettext_lazy as _
+from . import exceptions, expressions, models
+from .support import CallableReference
+import struct
+
+
+FORMAT_MAGIC = b'OUROSPEC'
+FORMAT_VERSION = 2
+NODE_TYPES = tuple(code for code, name in models.NodeSpec.TYPES)
+NONE = -1
+_UNKNOWN = object()
+
+
+class CompiledSpec(object):
+    """
+    A compiled workflow spec. Courses, nodes and transitions are referenced by their index
+      in the corresponding arrays, and not by their ids (although ids are kept, and there
+      are index lookups by id).
+
+    Outbound transitions of each node are sorted by priority (transitions without priority
+      go last), so multiplexer nodes can evaluate them in order.
+    """
+
+    HEADER = ('id', 'version', 'document_type_id', 'code', 'digest', 'create_permission', 'cancel_permission')
+    ARRAYS = ('course_ids', 'course_codes', 'course_names', 'course_translated', 'course_cancel_permissions',
+              'node_ids', 'node_courses', 'node_types', 'node_codes', 'node_names', 'node_translated',
+              'node_exit_values', 'node_landing_handlers', 'node_joiners', 'node_execute_permissions',
+              'branch_offsets', 'branch_courses',
+              'transition_ids', 'transition_origins', 'transition_destinations', 'transition_action_names',
+              'transition_names', 'transition_translated', 'transition_permissions', 'transition_conditions',
+              'transition_priorities', 'transition_timeouts',
+              'outbound_offsets', 'outbound_transitions')
+
+    def __init__(self, header, strings, paths, arrays):
+        """
+        Builds a compiled spec from its raw data. Prefer using .compile() or .load() instead.
+        :param header: A sequence of integers, as described by HEADER.
+        :param strings: The string table.
+        :param paths: The callable path table.
+        :param arrays: A dictionary of integer arrays, as described by ARRAYS.
+        """
+
+        self.header = array('i', header)
+        self.strings = tuple(strings)
+        self.paths = tuple(paths)
+        for name in self.ARRAYS:
+            setattr(self, name, array('i', arrays[name]))
+        self.id, self.version, self.document_type_id = self.header[0:3]
+        self.code, self.digest, self.create_permission, self.cancel_permission = [
+            self.string(index) for index in self.header[3:7]
+        ]
+        # Indices for fast lookups.
+        self._courses_by_id = {id_: index for index, id_ in enumerate(self.course_ids)}
+        self._courses_by_code = {self.strings[code]: index for index, code in enumerate(self.course_codes)}
+        self._nodes_by_id = {id_: index for index, id_ in enumerate(self.node_ids)}
+        self._nodes_by_code = {}
+        self._nodes_by_type = {}
+        for index, (course, code, type_) in enumerate(zip(self.node_courses, self.node_codes, self.node_types)):
+            self._nodes_by_code[(course, self.strings[code])] = index
+            self._nodes_by_type.setdefault((course, NODE_TYPES[type_]), []).append(index)
+        self._transitions_by_id = {id_: index for index, id_ in enumerate(self.transition_ids)}
+        self._decision_tables = {}
+
+    def string(self, index):
+        return None if index == NONE else self.strings[index]
+
+    def path(self, index):
+        return None if index == NONE else CallableReference(self.paths[index])
+
+    def condition(self, index):
+        return None if index == NONE else expressions.parse(self.paths[index])
+
+    # Lookups by id.
+
+    def course_index(self, course_spec_id):
+        return self._courses_by_id[course_spec_id]
+
+    def node_index(self, node_spec_id):
+        return self._nodes_by_id[node_spec_id]
+
+    def transition_index(self, transition_spec_id):
+        return self._transitions_by_id[transition_spec_id]
+
+    # Lookups by code or type.
+
+    def find_course(self, code):
+        return self._courses_by_code.get(code)
+
+    def find_node(self, course, code):
+        return self._nodes_by_code.get((course, code))
+
+    def nodes_of_type(self, course, type_):
+        return self._nodes_by_type.get((course, type_), [])
+
+    # Graph traversal.
+
+    def node_type(self, node):
+        return NODE_TYPES[self.node_types[node]]
+
+    def branches(self, node):
+        return self.branch_courses[self.branch_offsets[node]:self.branch_offsets[node + 1]]
+
+    def outbounds(self, node):
+        return self.outbound_transitions[self.outbound_offsets[node]:self.outbound_offsets[node + 1]]
+
+    def timers(self, node):
+        """
+        Gets the timer transitions of a node (only INPUT nodes may have them).
+        :param node: The index of the node.
+        :return: A list of (transition index, timeout in seconds) pairs.
+        """
+
+        return [(transition, self.transition_timeouts[transition]) for transition in self.outbounds(node)
+                if self.transition_timeouts[transition] != NONE]
+
+    def decision_table(self, node):
+        """
+        Gets the decision table of a multiplexer node: its outbound transitions, by priority, along
+          with their conditions. Tables are built on first use and then kept.
+        :param node: The index of the multiplexer node.
+        :return: A tuple of (transition index, condition) pairs.
+        """
+
+        table = self._decision_tables.get(node)
+        if table is None:
+            table = self._decision_tables[node] = tuple(
+                (transition, self.condition(self.transition_conditions[transition]))
+                for transition in self.outbounds(node)
+            )
+        return table
+
+    @classmethod
+    def compile(cls, workflow_spec):
+        """
+        Compiles a workflow spec from the database, using one query per spec table.
+        :param workflow_spec: The workflow spec to compile.
+        :return: The compiled spec.
+        """
+
+        strings, paths = {}, {}
+
+        def string(value):
+            return NONE if value is None else strings.setdefault(value, len(strings))
+
+        def path(value):
+            return NONE if not value else paths.setdefault(expressions.dumps(value), len(paths))
+
+        arrays = {name: [] for name in cls.ARRAYS}
+        header = [workflow_spec.pk, workflow_spec.version, workflow_spec.document_type_id,
+                  string(workflow_spec.code), string(workflow_spec.digest), string(workflow_spec.create_permission),
+                  string(workflow_spec.cancel_permission)]
+
+        courses = {}
+        for course_spec in models.CourseSpec.objects.filter(workflow_spec=workflow_spec).order_by('id'):
+            courses[course_spec.id] = len(courses)
+            arrays['course_ids'].append(course_spec.id)
+            arrays['course_codes'].append(string(course_spec.code))
+            arrays['course_names'].append(string(course_spec.name))
+            arrays['course_translated'].append(int(course_spec.translated))
+            arrays['course_cancel_permissions'].append(string(course_spec.cancel_permission))
+
+        branches = {}
+        for node_spec_id, course_spec_id in models.NodeSpec.branches.through.objects.filter(
+            nodespec__course_spec__workflow_spec=workflow_spec
+        ).order_by('id').values_list('nodespec_id', 'coursespec_id'):
+            branches.setdefault(node_spec_id, []).append(courses[course_spec_id])
+
+        nodes = {}
+        for node_spec in models.NodeSpec.objects.filter(course_spec__workflow_spec=workflow_spec).order_by('id'):
+            nodes[node_spec.id] = len(nodes)
+            arrays['node_ids'].append(node_spec.id)
+            arrays['node_courses'].append(courses[node_spec.course_spec_id])
+            arrays['node_types'].append(NODE_TYPES.index(node_spec.type))
+            arrays['node_codes'].append(string(node_spec.code))
+            arrays['node_names'].append(string(node_spec.name))
+            arrays['node_translated'].append(int(node_spec.translated))
+            arrays['node_exit_values'].append(NONE if node_spec.exit_value is None else node_spec.exit_value)
+            arrays['node_landing_handlers'].append(path(node_spec.landing_handler))
+            arrays['node_joiners'].append(path(node_spec.joiner))
+            arrays['node_execute_permissions'].append(string(node_spec.execute_permission))
+            arrays['branch_offsets'].append(len(arrays['branch_courses']))
+            arrays['branch_courses'].extend(branches.get(node_spec.id, []))
+        arrays['branch_offsets'].append(len(arrays['branch_courses']))
+
+        outbounds = {}
+        for transition_spec in models.TransitionSpec.objects.filter(
+            origin__course_spec__workflow_spec=workflow_spec
+        ).order_by('id'):
+            index = len(arrays['transition_ids'])
+            arrays['transition_ids'].append(transition_spec.id)
+            arrays['transition_origins'].append(nodes[transition_spec.origin_id])
+            arrays['transition_destinations'].append(nodes[transition_spec.destination_id])
+            arrays['transition_action_names'].append(string(transition_spec.action_name))
+            arrays['transition_names'].append(string(transition_spec.name))
+            arrays['transition_translated'].append(int(transition_spec.translated))
+            arrays['transition_permissions'].append(string(transition_spec.permission))
+            arrays['transition_conditions'].append(path(transition_spec.condition))
+            arrays['transition_priorities'].append(NONE if transition_spec.priority is None
+                                                   else transition_spec.priority)
+            arrays['transition_timeouts'].append(NONE if transition_spec.timeout is None
+                                                 else int(transition_spec.timeout.total_seconds()))
+            outbounds.setdefault(nodes[transition_spec.origin_id], []).append(index)
+
+        def priority_order(transition):
+            priority = arrays['transition_priorities'][transition]
+            return priority == NONE, priority, transition
+
+        for node in range(len(nodes)):
+            arrays['outbound_offsets'].append(len(arrays['outbound_transitions']))
+            arrays['outbound_transitions'].extend(sorted(outbounds.get(node, []), key=priority_order))
+        arrays['outbound_offsets'].append(len(arrays['outbound_transitions']))
+
+        return cls(header, sorted(strings, key=strings.get), sorted(paths, key=paths.get), arrays)
+
+    def dump(self, stream):
+        """
+        Writes this compiled spec into a binary stream. The format is: the magic, the format
+          version, and then the header, the string table, the callable path table and each
+          of the arrays (in ARRAYS order). Integers are little-endian.
+        :param stream: A file-like binary object to write into.
+        """
+
+        def write_integers(values):
+            stream.write(struct.pack('<I', len(values)))
+            stream.write(struct.pack('<%di' % len(values), *values))
+
+        def write_strings(values):
+            encoded = [value.encode('utf-8') for value in values]
+            stream.write(struct.pack('<I', len(encoded)))
+            stream.write(struct.pack('<%dI' % len(encoded), *[len(value) for value in encoded]))
+            stream.write(b''.join(encoded))
+
+        stream.write(FORMAT_MAGIC)
+        stream.write(struct.pack('<H', FORMAT_VERSION))
+        write_integers(self.header)
+        write_strings(self.strings)
+        write_strings(self.paths)
+        for name in self.ARRAYS:
+            write_integers(getattr(self, name))
+
+    @classmethod
+    def loads(cls, buffer):
+        """
+        Reads a compiled spec from a buffer (e.g. bytes).
+        :param buffer: The buffer to read from.
+        :return: The compiled spec.
+        """
+
+        if buffer[:len(FORMAT_MAGIC)] != FORMAT_MAGIC:
+            raise ValueError('Not a compiled workflow spec')
+        offset = len(FORMAT_MAGIC)
+        version, = struct.unpack_from('<H', buffer, offset)
+        if version != FORMAT_VERSION:
+            raise ValueError('Unsupported compiled workflow spec format version: %d' % version)
+        offset += 2
+
+        def read(fmt):
+            values = struct.unpack_from(fmt, buffer, offset)
+            return values, offset + struct.calcsize(fmt)
+
+        def read_integers():
+            (count,), position = read('<I')
+            return struct.unpack_from('<%di' % count, buffer, position), position + count * 4
+
+        def read_strings():
+            (count,), position = read('<I')
+            lengths = struct.unpack_from('<%dI' % count, buffer, position)
+            position += count * 4
+            values = []
+            for length in lengths:
+                values.append(buffer[position:position + length].decode('utf-8'))
+                position += length
+            return values, position
+
+        header, offset = read_integers()
+        strings, offset = read_strings()
+        paths, offset = read_strings()
+        arrays = {}
+        for name in cls.ARRAYS:
+            arrays[name], offset = read_integers()
+        return cls(header, strings, paths, arrays)
+
+    @classmethod
+    def load(cls, path, validate=True):
+        """
+        Reads a compiled spec from a file.
+        :param path: The path of the file.
+        :param validate: If True [default], the digest of the loaded spec is checked against the
+          digest stored in the database (this costs one query).
+        :return: The compiled spec.
+        """
+
+        with open(path, 'rb') as f:
+            compiled = cls.loads(f.read())
+        if validate:
+            compiled.validate()
+        return compiled
+
+    def validate(self, digest=_UNKNOWN):
+        """
+        Checks this compiled spec against the database.
+        :param digest: The digest stored in the database for this spec. If not given, it is queried.
+        """
+
+        if digest is _UNKNOWN:
+            digest = models.WorkflowSpec.objects.filter(pk=self.id).values_list('digest', flat=True).first()
+        if not self.digest or digest != self.digest:
+            raise exceptions.WorkflowCompiledSpecMismatch(
+                self, _('The compiled workflow spec does not match the published workflow spec in the database'),
+                self.code, self.version
+            )
+
+
+# Process cache: (workflow spec id, digest) => (generation, compiled spec).
+_cache = {}
+
+
+def _shared_cache():
+    return caches[getattr(settings, 'OUROBOROS_SPEC_CACHE', DEFAULT_CACHE_ALIAS)]
+
+
+def _generation_key(workflow_spec_id):
+    return 'ouroboros:spec-generation:%s' % workflow_spec_id
+
+
+# Generations already looked up by the current operation (see memoizing_generations).
+_operation = local()
+
+
+def _generation(workflow_spec_id):
+    generations = getattr(_operation, 'generations', None)
+    if generations is None:
+        return _shared_cache().get(_generation_key(workflow_spec_id), 0)
+    if workflow_spec_id not in generations:
+        generations[workflow_spec_id] = _shared_cache().get(_generation_key(workflow_spec_id), 0)
+    return generations[workflow_spec_id]
+
+
+@contextmanager
+def memoizing_generations():
+    """
+    Looks up the generation counter of each workflow spec in the shared cache only once inside
+      this block (e.g. a whole runner operation), instead of once per get(). Nested blocks share
+      the outermost memo.
+    """
+
+    if getattr(_operation, 'generations', None) is not None:
+        yield
+        return
+    _operation.generations = {}
+    try:
+        yield
+    finally:
+        _operation.generations = None
+
+
+def invalidate(workflow_spec_id):
+    """
+    Invalidates the compiled versions of a workflow spec, in this process and (by bumping
+      its generation counter in the shared cache) in every other process.
+    :param workflow_spec_id: The id of the workflow spec being changed or deleted.
+    """
+
+    for key in [key for key in _cache if key[0] == workflow_spec_id]:
+        _cache.pop(key, None)
+    generations = getattr(_operation, 'generations', None)
+    if generations:
+        generations.pop(workflow_spec_id, None)
+    shared, key = _shared_cache(), _generation_key(workflow_spec_id)
+    if not shared.add(key, 1, None):
+        try:
+            shared.incr(key)
+        except ValueError:
+            # The key was evicted right after we tried to add it.
+            shared.set(key, 1, None)
+
+
+def get(workflow_spec):
+    """
+    Gets the compiled version of a workflow spec, compiling it on first use. Compiled specs are
+      kept in the process cache, keyed by their id and digest, and they are dropped when the
+      generation counter of the workflow spec changes in the shared cache (this costs one
+      lookup in the shared cache, but no query; or one per operation, see memoizing_generations).
+    :param workflow_spec: The workflow spec to get the compiled version of.
+    :return: The compiled spec.
+    """
+
+    key = (workflow_spec.pk, workflow_spec.digest)
+    generation = _generation(workflow_spec.pk)
+    entry = _cache.get(key)
+    if entry is None or entry[0] != generation:
+        entry = (generation, CompiledSpec.compile(workflow_spec))
+        _cache[key] = entry
+    return entry[1]
+
+
+def preload(paths, validate=True):
+    """
+    Loads compiled spec files into the process cache, typically at startup.
+    :param paths: The paths of the compiled spec files.
+    :param validate: If True [default], the loaded specs are checked against the database using
+      a single query for all of them.
+    :return: The list of loaded compiled specs.
+    """
+
+    loaded = [CompiledSpec.load(path, False) for path in paths]
+    if validate:
+        digests = dict(models.WorkflowSpec.objects.filter(pk__in=[compiled.id for compiled in loaded]).values_list(
+            'id', 'digest'
+        ))
+        for compiled in loaded:
+            compiled.validate(digests.get(compiled.id))
+    for compiled in loaded:
+        _cache[(compiled.id, compiled.digest)] = (_generation(compiled.id), compiled)
+    return loaded
+
+
+def warm_up():
+    """
+    Preloads the compiled specs listed in the settings (this queries the database, so it runs on
+      the first request, see signals.warm_up_compiled_specs, or when the workers start):
+    - OUROBOROS_PRELOAD_COMPILED_SPECS: paths of compiled spec files.
+    - OUROBOROS_PRELOAD_SPECS: codes of workflow specs. Their latest published versions are
+      compiled from the database.
+    :return: The list of preloaded compiled specs.
+    """
+
+    loaded = preload(getattr(settings, 'OUROBOROS_PRELOAD_COMPILED_SPECS', ()))
+    for code in getattr(settings, 'OUROBOROS_PRELOAD_SPECS', ()):
+        loaded.append(get(models.WorkflowSpec.objects.get_latest_version(code)))
+    return loaded
@@ -0,0 +1,100 @@
+###################################################################################
+#                                                                                 #
+# Decisions of the workflow runner, taken over a compiled spec: which outbound a  #
+#   multiplexer node takes, which node a terminated course lands in, and how a    #
+#   split node resolves its joiner. They are shared by the runner (executors) and #
+#   the in-memory simulations, so both follow the same semantics.                 #
+#                                                                                 #
+# Each function takes the object to report as the raiser of its exceptions.       #
+#                                                                                 #
+###################################################################################
+
+from __future__ import unicode_literals
+from django.utils.translation import ugettext_lazy as _
+from django.utils.six import string_types
+from . import exceptions, models
+
+
+def pick_outbound(compiled_spec, node, evaluate, raiser):
+    """
+    Picks the outbound transition of a multiplexer node: the first one, by priority, whose condition
+      is satisfied.
+    :param compiled_spec: The compiled spec.
+    :param node: The index of the multiplexer node.
+    :param evaluate: A callable evaluating a condition (it takes the condition).
+    :param raiser: The raiser of the exception when no condition is satisfied.
+    :return: The index of the picked transition.
+    """
+
+    for transition, condition in compiled_spec.decision_table(node):
+        if evaluate(condition):
+            return transition
+    raise exceptions.WorkflowCourseNodeMultiplexerDidNotSatisfyAnyCondition(
+        raiser, _('No condition was satisfied when traversing a multiplexer node')
+    )
+
+
+def terminal_node(compiled_spec, course, node_type, raiser):
+    """
+    Gets the node a course lands in when it is terminated.
+    :param compiled_spec: The compiled spec.
+    :param course: The index of the course.
+    :param node_type: The type of the node (CANCEL or JOINED).
+    :param raiser: The raiser of the exception when the course has no such node (or many).
+    :return: The index of the node.
+    """
+
+    nodes = compiled_spec.nodes_of_type(course, node_type)
+    if not nodes and node_type == models.NodeSpec.JOINED:
+        raise exceptions.WorkflowCourseInstanceNotJoinable(raiser, _('This course is not joinable'))
+    elif not nodes:
+        raise exceptions.WorkflowCourseSpecHasNoRequiredNode(raiser, _('A workflow course is expected to have '
+                                                                       'exactly one cancel node'))
+    elif len(nodes) > 1:
+        raise exceptions.WorkflowCourseSpecMultipleRequiredNodes(raiser, _('A workflow course is expected to have '
+                                                                           'exactly one node of this type'))
+    return nodes[0]
+
+
+def join_outbound(compiled_spec, node, returned, branch_statuses, raiser):
+    """
+    Resolves the value returned by the joiner of a split node into an outbound transition.
+    :param compiled_spec: The compiled spec.
+    :param node: The index of the split node.
+    :param returned: The value returned by the joiner.
+    :param branch_statuses: The exit codes of the branches (None for the pending ones), by code.
+    :param raiser: The raiser of the exceptions when the value cannot be resolved.
+    :return: The index of the transition to take (after joining the pending branches), or None
+      to keep waiting for the branches.
+    """
+
+    outbounds = compiled_spec.outbounds(node)
+    one_transition = len(outbounds) == 1
+    if (one_transition and not returned) or returned is None:
+        # If all the branches have ended (i.e. they have non-None values), this is an error.
+        #   Otherwise, we do nothing.
+        if all(bool(status) for status in branch_statuses.values()):
+            raise exceptions.WorkflowCourseNodeNoTransitionResolvedAfterCompleteSplitJoin(
+                raiser, _('The joiner callable returned None -not deciding any action- but all the branches '
+                          'have terminated')
+            )
+        return None
+    elif not one_transition and isinstance(returned, string_types):
+        # The transitions must have unique and present action names.
+        action_names = [compiled_spec.string(compiled_spec.transition_action_names[transition])
+                        for transition in outbounds]
+        if len(set(action_name for action_name in action_names if action_name)) != len(outbounds):
+            raise exceptions.WorkflowCourseNodeBadTransitionActionNamesAfterSplitNode(
+                raiser, _('Split node transitions must all have a unique action name')
+            )
+        if returned not in action_names:
+            raise exceptions.WorkflowCourseNodeTransitionDoesNotExist(
+                raiser, _('No transition has the specified action name'), returned
+            )
+        return outbounds[action_names.index(returned)]
+    elif not one_transition:
+        raise exceptions.WorkflowCourseNodeInvalidSplitResolutionCode(
+            raiser, _('Invalid joiner resolution code type. Expected string or None'), returned
+        )
+    # We know we have one transition, and the returned joiner value was bool(x) == True.
+    return outbounds[0]
@@ -0,0 +1,194 @@
+###################################################################################
+#                                                                                 #
+# Event sourcing: when the OUROBOROS_EVENT_SOURCING setting is True, the runner   #
+#   appends a typed event (course created, node entered, course terminated) for   #
+#   each change in the course tree of a workflow instance, and a snapshot of the  #
+#   tree is saved every OUROBOROS_SNAPSHOT_INTERVAL events (100 by default).      #
+#                                                                                 #
+# The tree, as of any date or event, is rebuilt from the latest snapshot before   #
+#   it plus the events after the snapshot: two queries, and at most an interval   #
+#   of events to apply.                                                           #
+#                                                                                 #
+# Events and snapshots are never rewritten: after an instance is migrated to      #
+#   another spec version, the older ones still reference the previous version,    #
+#   and they are rendered through it.                                             #
+#                                                                                 #
+###################################################################################
+
+from __future__ import unicode_literals
+from django.conf import settings
+from django.db.models import Max
+from cantrips.iteration import items
+from . import compiled, models
+import json
+
+
+# The state of a course instance: (parent course instance id, course spec id, node spec id, term level).
+PARENT, COURSE_SPEC, NODE_SPEC, TERM_LEVEL = range(4)
+
+
+def enabled():
+    return getattr(settings, 'OUROBOROS_EVENT_SOURCING', False)
+
+
+def _interval():
+    return getattr(settings, 'OUROBOROS_SNAPSHOT_INTERVAL', 100)
+
+
+def _remove_descendants(state, course_instance_id):
+    children = [child for child, course in items(state) if course[PARENT] == course_instance_id]
+    for child in children:
+        _remove_descendants(state, child)
+        del state[child]
+
+
+def apply(state, type_, course_instance_id, parent_course_instance_id, course_spec_id, node_spec_id, term_level):
+    """
+    Applies an event to a state (a dictionary of course instance id => course state).
+    """
+
+    if type_ == models.WorkflowEvent.COURSE_CREATED:
+        state[course_instance_id] = [parent_course_instance_id, course_spec_id, None, None]
+    elif type_ == models.WorkflowEvent.NODE_ENTERED:
+        # Replacing the node instance removes the branches of the previous one, if any.
+        _remove_descendants(state, course_instance_id)
+        state[course_instance_id][NODE_SPEC] = node_spec_id
+    else:
+        # Terminations update the node instance in place, but the branches are removed as well.
+        _remove_descendants(state, course_instance_id)
+        state[course_instance_id][NODE_SPEC] = node_spec_id
+        state[course_instance_id][TERM_LEVEL] = term_level
+
+
+EVENT_FIELDS = ('type', 'course_instance_id', 'parent_course_instance_id', 'course_spec_id', 'node_spec_id',
+                'term_level')
+
+
+def replay(workflow_instance, as_of=None, sequence=None):
+    """
+    Rebuilds the course tree of a workflow instance from its latest snapshot and the events after it.
+    :param workflow_instance: The workflow instance.
+    :param as_of: If given, the tree is rebuilt as of this date.
+    :param sequence: If given, the tree is rebuilt as of this event number.
+    :return: A dictionary of course instance id => [parent course instance id, course spec id,
+      node spec id, term level].
+    """
+
+    snapshots = workflow_instance.snapshots.order_by('-sequence')
+    events = workflow_instance.events.order_by('sequence')
+    if as_of is not None:
+        snapshots = snapshots.filter(created_on__lte=as_of)
+        events = events.filter(created_on__lte=as_of)
+    if sequence is not None:
+        snapshots = snapshots.filter(sequence__lte=sequence)
+        events = events.filter(sequence__lte=sequence)
+    snapshot = snapshots.values_list('sequence', 'state').first()
+    if snapshot:
+        state = {int(key): value for key, value in items(json.loads(snapshot[1]))}
+        events = events.filter(sequence__gt=snapshot[0])
+    else:
+        state = {}
+    for event in events.values_list(*EVENT_FIELDS).iterator():
+        apply(state, *event)
+    return state
+
+
+def append(workflow_instance, user, events, stamp):
+    """
+    Appends events to a workflow instance, and takes a snapshot if an interval of events is completed.
+    :param workflow_instance: The workflow instance.
+    :param user: The user running the action causing the events.
+    :param events: A list of dictionaries with the fields of the events (at least 'type' and
+      'course_instance_id').
+    :param stamp: The date of the events.
+    """
+
+    if not events:
+        return
+    last = workflow_instance.events.aggregate(last=Max('sequence'))['last'] or 0
+    models.WorkflowEvent.objects.bulk_create([
+        models.WorkflowEvent(workflow_instance=workflow_instance, sequence=last + index, user=user,
+                             created_on=stamp, **event)
+        for index, event in enumerate(events, 1)
+    ])
+    interval = _interval()
+    if interval and (last + len(events)) // interval > last // interval:
+        sequence = last + len(events)
+        models.WorkflowSnapshot.objects.create(
+            workflow_instance=workflow_instance, sequence=sequence, created_on=stamp,
+            state=json.dumps(replay(workflow_instance, sequence=sequence), sort_keys=True)
+        )
+
+
+def _resolver(compiled_spec, state):
+    # Maps course and node spec ids to (compiled spec, index) pairs. Ids not belonging to the given
+    #   compiled spec come from the versions the instance was migrated from: their versions are
+    #   looked up with one query for each kind, and only if there are such ids.
+    nodes = {course[NODE_SPEC] for course in state.values() if course[NODE_SPEC] is not None}
+    courses = {course[COURSE_SPEC] for course in state.values()}
+    foreign_nodes = nodes.difference(compiled_spec.node_ids)
+    foreign_courses = courses.difference(compiled_spec.course_ids)
+    spec_ids = set()
+    if foreign_nodes:
+        spec_ids.update(models.NodeSpec.objects.filter(pk__in=foreign_nodes).values_list(
+            'course_spec__workflow_spec_id', flat=True
+        ))
+    if foreign_courses:
+        spec_ids.update(models.CourseSpec.objects.filter(pk__in=foreign_courses).values_list(
+            'workflow_spec_id', flat=True
+        ))
+    compiled_specs = [compiled_spec]
+    if spec_ids:
+        compiled_specs.extend(compiled.get(workflow_spec)
+                              for workflow_spec in models.WorkflowSpec.objects.filter(pk__in=spec_ids))
+
+    def find(lookup, id_):
+        for candidate in compiled_specs:
+            try:
+                return candidate, getattr(candidate, lookup)(id_)
+            except KeyError:
+                pass
+        raise KeyError(id_)
+
+    return find
+
+
+def statuses(compiled_spec, state):
+    """
+    Renders a course tree like Workflow.get_workflow_status() does.
+    :param compiled_spec: The compiled spec of the workflow instance. Courses and nodes of the versions
+      the instance was migrated from are rendered through their own (compiled) versions.
+    :param state: The course tree, as returned by replay.
+    :return: A dictionary with 'course.path' => ('status', code).
+    """
+
+    find = _resolver(compiled_spec, state)
+    children = {}
+    for course_instance_id in sorted(state):
+        children.setdefault(state[course_instance_id][PARENT], []).append(course_instance_id)
+    result = {}
+
+    def traverse(course_instance_id, path):
+        node_spec_id = state[course_instance_id][NODE_SPEC]
+        if node_spec_id is None:
+            return
+        spec, node = find('node_index', node_spec_id)
+        type_ = spec.node_type(node)
+        if type_ == models.NodeSpec.SPLIT:
+            result[path] = ('splitting', None)
+            for child in children.get(course_instance_id, ()):
+                course_spec, course = find('course_index', state[child][COURSE_SPEC])
+                code = course_spec.string(course_spec.course_codes[course])
+                traverse(child, code if not path else '%s.%s' % (path, code))
+        elif type_ == models.NodeSpec.INPUT:
+            result[path] = ('waiting', spec.string(spec.node_codes[node]))
+        elif type_ == models.NodeSpec.CANCEL:
+            result[path] = ('cancelled', -1)
+        elif type_ == models.NodeSpec.EXIT:
+            result[path] = ('ended', spec.node_exit_values[node])
+        elif type_ == models.NodeSpec.JOINED:
+            result[path] = ('joined', -1)
+
+    for root in children.get(None, ()):
+        traverse(root, '')
+    return result
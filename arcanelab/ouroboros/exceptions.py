@@ -199,6 +199,10 @@ class WorkflowSpecHasCircularDependentCourses(WorkflowStandardInvalidState):
     CODE = 'workflow-spec:circular-dependent-courses'
 
 
+class WorkflowSpecIsPublished(WorkflowStandardInvalidState):
+    CODE = 'workflow-spec:published'
+
+
 class WorkflowCourseSpecHasNoRequiredNode(WorkflowStandardInvalidState):
     CODE = 'course-spec:no-required-node'
 
@@ -279,6 +283,10 @@ class WorkflowCourseTransitionActionNameNotUnique(WorkflowStandardInvalidState):
     CODE = 'transition-spec:action-name-not-unique'
 
 
+class WorkflowCourseTransitionTimeoutNotPositive(WorkflowStandardInvalidState):
+    CODE = 'transition-spec:timeout-not-positive'
+
+
 class WorkflowInstanceDoesNotAcceptDocument(WorkflowStandardInvalidState):
     CODE = 'workflow-instance:does-not-accept-document'
 
@@ -310,6 +318,10 @@ class WorkflowCourseNodeInstanceIncompleteSplitBranchReferences(WorkflowStandard
 # WorkflowNoSuchElement subclasses
 
 
+class WorkflowSpecDoesNotExist(WorkflowNoSuchElement):
+    pass
+
+
 class WorkflowInstanceDoesNotExist(WorkflowNoSuchElement):
     pass
 
@@ -377,6 +389,22 @@ class WorkflowCourseInstanceAlreadyTerminated(WorkflowExecutionError):
     pass
 
 
+class WorkflowSpecMigrationIncompatible(WorkflowExecutionError):
+    pass
+
+
+class WorkflowSpecNotPublished(WorkflowExecutionError):
+    pass
+
+
+class WorkflowCompiledSpecMismatch(WorkflowExecutionError):
+    pass
+
+
+class WorkflowCourseNodeConditionsNotDeclarative(WorkflowExecutionError):
+    pass
+
+
 ############################################################################
 #                                                                          #
 # Exception helpers go here. These exceptions are useful for verifiers.    #
@@ -6,14 +6,22 @@
 
 from __future__ import unicode_literals
 from contextlib import contextmanager
+from datetime import timedelta
 from django.apps import apps as registry
+from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.db.models import Case, When, Value, CharField, IntegerField, Max, F
+from django.db import router
 from django.db.transaction import atomic
+from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy as _
 from django.utils.six import string_types
 from django.contrib.contenttypes.models import ContentType
 from cantrips.iteration import iterable, items
-from . import exceptions, models
+from . import analysis, compiled, decisions, events, exceptions, expressions, metrics, models, outbox, serializers, \
+    sharding, simulation, statuses, timers
+from threading import local
+import hashlib
 import json
 
 
@@ -27,22 +35,110 @@ def wrap_validation_error(obj):
         raise exceptions.WorkflowInvalidState(obj, e)
 
 
+@contextmanager
+def sharded_atomic(shard_key):
+    """
+    Runs a block in a transaction in the shard of a workflow instance (or in the primary), sending
+      every query to the instance tables there. The compiled specs are checked once for the block.
+    :param shard_key: The shard key of the workflow instance.
+    """
+
+    with sharding.pinned(shard_key) as database, sharding.write_block(), \
+            atomic(using=database or router.db_for_write(models.WorkflowInstance)), compiled.memoizing_generations():
+        yield
+
+
+_conditions_memo = local()
+
+
+@contextmanager
+def memoizing_conditions():
+    """
+    Keeps the results of the multiplexer conditions evaluated inside this block, by (condition
+      path, document, user), if the OUROBOROS_MEMOIZE_CONDITIONS setting is true. Nested blocks
+      share the outermost memo, and the memo is forgotten each time a landing handler runs
+      (since handlers may change the document).
+    """
+
+    if getattr(_conditions_memo, 'results', None) is not None or \
+            not getattr(settings, 'OUROBOROS_MEMOIZE_CONDITIONS', False):
+        yield
+        return
+    _conditions_memo.results = {}
+    try:
+        yield
+    finally:
+        _conditions_memo.results = None
+
+
+def forget_conditions():
+    """
+    Forgets the memoized condition results, if any.
+    """
+
+    if getattr(_conditions_memo, 'results', None):
+        _conditions_memo.results = {}
+
+
+def evaluate_condition(condition, document, user):
+    """
+    Evaluates a condition, using the memo if we are memoizing.
+    :param condition: The condition to evaluate.
+    :param document: The document to evaluate the condition against.
+    :param user: The user running the operation.
+    :return: The condition result.
+    """
+
+    results = getattr(_conditions_memo, 'results', None)
+    if results is None:
+        return condition(document, user)
+    key = (condition, type(document), document.pk, user.pk)
+    try:
+        return results[key]
+    except KeyError:
+        results[key] = result = condition(document, user)
+        return result
+
+
 class Workflow(object):
     """
     Workflow helpers. When used directly, we refer to instances, like calling:
 
-    - workflow = Workflow.get(a document)
-    - workflow = Workflow.create(a user, a wrapped spec, a document)
+    - workflow = Workflow.get(a document[, using=a database])
+    - list_ = Workflow.get_many(many documents[, using=a database])
+    - workflow = Workflow.create(a user, a wrapped spec or a spec code, a document)
     - workflow.start(a user[, 'path.to.course'])
     - workflow.cancel(a user[, 'path.to.course'])
     - workflow.execute(a user, an action[, 'path.to.course'])
-    - dict_ = workflow.get_available_actions()
+    - queued_action = workflow.enqueue(a user, an action[, 'path.to.course'])
+    - dict_ = workflow.get_workflow_available_actions(a user[, using=a database])
+    - dict_ = workflow.get_workflow_status([using=a database])
+    - list_ = Workflow.get_workflow_statuses(many workflows[, using=a database])
+    - dict_ = workflow.replay([a date])
+    - fired, postponed, discarded, full = Workflow.fire_timers(a user[, batch_size=100])
 
     When using its namespaced class Workflow.Spec, we refer to specs, like calling:
-    - workflow_spec = Workflow.Spec.install(a workflow spec data)
-    - workflow_spec = Workflow.Spec.get(a workflow spec code)
+    - workflow_spec = Workflow.Spec.install(a workflow spec data[, publish=False])
+    - workflow_spec = Workflow.Spec.get(a workflow spec code[, a version, using=a database])
+    - workflow_spec.publish()
+    - count = workflow_spec.migrate_instances(another wrapped spec[, a node mapping])
     - workflow = workflow_spec.instantiate(a user, a document) # Calls Workflow.create() with this spec
     - dict_ = workflow.serialized()
+    - count = workflow_spec.dump(a text stream[, instances=False])
+    - workflow_spec, count = Workflow.Spec.load(a text stream)
+    - compiled_spec = workflow_spec.compiled()
+    - workflow_spec.dump_compiled(a binary stream)
+    - compiled_spec = Workflow.Spec.load_compiled(a file path)
+    - dict_ = workflow_spec.analyze([logs=False, max_visits=1, limit=1000])
+    - dict_ = workflow_spec.throughput([since=None, until=None])
+    - dict_ = workflow_spec.dwell_times([percentiles=(50, 90, 99), since=None])
+    - simulation = workflow_spec.simulate(a document or stub[, a user or stub, ...])
+    - queryset = workflow_spec.route(a queryset of documents, a multiplexer node code[, a course code])
+
+    Reads can be sent to replicas by an explicit using= argument or by the router shipped in
+      arcanelab.ouroboros.routers, while writes (and the reads done while writing) use the primary.
+      With OUROBOROS_SHARDS configured, each operation runs in the shard of its workflow instance,
+      and Workflow.get / Workflow.get_many query every shard in parallel.
     """
 
     class Spec(object):
@@ -71,56 +167,301 @@ class Workflow(object):
               whether `dump` is False or True.
             """
 
+            workflow_spec_data = serializers.spec_data(self.spec)
+            return json.dumps(workflow_spec_data) if dump else workflow_spec_data
+
+        def digest(self):
+            """
+            Content hash of this spec. It depends only on the spec data (and not on ids, version numbers
+              or the order the rows were created) so two versions installed from the same data will have
+              the same digest.
+            :return: A sha256 hexadecimal digest.
+            """
+
+            data = self.serialized()
+            for course_data in data['courses']:
+                for node_data in course_data['nodes']:
+                    node_data['branches'] = sorted(node_data['branches'])
+                course_data['nodes'].sort(key=lambda node_data: node_data['code'])
+                course_data['transitions'].sort(key=lambda transition_data: (
+                    transition_data['origin'], transition_data['destination'], transition_data['action_name'] or '',
+                    transition_data['priority'] or 0
+                ))
+            data['courses'].sort(key=lambda course_data: course_data['code'])
+            return hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+        def publish(self):
+            """
+            Validates and publishes this spec version, stamping its digest. Published versions are immutable
+              so, if this version is already published, nothing is done.
+            :return: This same wrapper.
+            """
+
             spec = self.spec
+            if spec.published_on:
+                return self
+            with atomic():
+                self._validate(spec)
+                digest, published_on = self.digest(), now()
+                # Publishing is done by an update since .save() is forbidden for published specs.
+                models.WorkflowSpec.objects.filter(pk=spec.pk, published_on__isnull=True).update(
+                    digest=digest, published_on=published_on
+                )
+                spec.digest, spec.published_on = digest, published_on
+            return self
 
-            course_specs_data = []
-            workflow_spec_data = {
-                'code': spec.code,
-                'name': spec.name,
-                'description': spec.description,
-                'create_permission': spec.create_permission,
-                'cancel_permission': spec.cancel_permission,
-                'courses': course_specs_data
-            }
-
-            for course_spec in spec.course_specs.all():
-                node_specs_data = []
-                transition_specs_data = []
-                course_specs_data.append({
-                    'code': course_spec.code,
-                    'name': course_spec.name,
-                    'description': course_spec.description,
-                    'cancel_permission': course_spec.cancel_permission,
-                    'nodes': node_specs_data,
-                    'transitions': transition_specs_data
-                })
+        def migrate_instances(self, target, node_mapping=None):
+            """
+            Moves the running workflow instances of this spec version to another version (typically, the
+              next one) of the same workflow spec. Terminated instances are kept in this version, as history.
+              Course instances are matched by course code, and node instances are matched by node code unless
+              a mapping is given for them. Everything is done with a fixed number of queries, regardless the
+              number of instances being migrated.
+            :param target: The wrapped workflow spec to move the instances to.
+            :param node_mapping: An optional dictionary like {course_code: {node_code: new_node_code}} for the
+              nodes being renamed in the target version.
+            :return: The number of migrated workflow instances.
+            """
 
-                for node_spec in course_spec.node_specs.all():
-                    node_specs_data.append({
-                        'type': node_spec.type,
-                        'code': node_spec.code,
-                        'name': node_spec.name,
-                        'description': node_spec.description,
-                        'landing_handler': node_spec.landing_handler and node_spec.landing_handler.path,
-                        'exit_value': node_spec.exit_value,
-                        'joiner': node_spec.execute_permission and node_spec.execute_permission.path,
-                        'execute_permission': node_spec.execute_permission,
-                        'branches': list(node_spec.branches.values_list('code', flat=True))
-                    })
+            source, target = self.spec, target.spec
+            node_mapping = node_mapping or {}
+            if source.code != target.code or source.document_type_id != target.document_type_id:
+                raise exceptions.WorkflowSpecMigrationIncompatible(
+                    self, _('Instances can only be migrated between versions of the same workflow spec')
+                )
 
-                for transition_spec in models.TransitionSpec.objects.filter(origin__course_spec=course_spec):
-                    transition_specs_data.append({
-                        'origin': transition_spec.origin.code,
-                        'destination': transition_spec.destination.code,
-                        'action_name': transition_spec.action_name,
-                        'name': transition_spec.name,
-                        'description': transition_spec.description,
-                        'permission': transition_spec.permission,
-                        'condition': transition_spec.condition,
-                        'priority': transition_spec.priority
-                    })
+            def spec_nodes(workflow_spec):
+                return models.NodeSpec.objects.filter(course_spec__workflow_spec=workflow_spec).values_list(
+                    'id', 'course_spec__code', 'code', 'type'
+                )
 
-            return json.dumps(workflow_spec_data) if dump else workflow_spec_data
+            def spec_branches(workflow_spec):
+                branches = {}
+                for node_id, code in models.NodeSpec.branches.through.objects.filter(
+                    nodespec__course_spec__workflow_spec=workflow_spec
+                ).values_list('nodespec_id', 'coursespec__code'):
+                    branches.setdefault(node_id, set()).add(code)
+                return branches
+
+            with atomic():
+                terminated = models.CourseInstance.objects.filter(
+                    workflow_instance__workflow_spec=source, parent__isnull=True,
+                    node_instance__node_spec__type__in=(models.NodeSpec.EXIT, models.NodeSpec.CANCEL)
+                ).values('workflow_instance_id')
+                running = models.WorkflowInstance.objects.filter(workflow_spec=source).exclude(pk__in=terminated)
+                course_instances = models.CourseInstance.objects.filter(workflow_instance__in=running)
+                node_instances = models.NodeInstance.objects.filter(course_instance__workflow_instance__in=running)
+
+                # Matching the courses in use.
+                source_courses = dict(models.CourseSpec.objects.filter(workflow_spec=source).values_list('id', 'code'))
+                target_courses = {code: id_ for id_, code in
+                                  models.CourseSpec.objects.filter(workflow_spec=target).values_list('id', 'code')}
+                courses_map = {}
+                for course_id in set(course_instances.values_list('course_spec_id', flat=True).distinct()):
+                    code = source_courses[course_id]
+                    try:
+                        courses_map[course_id] = target_courses[code]
+                    except KeyError:
+                        raise exceptions.WorkflowCourseDoesNotExist(
+                            target, _('No course exists in the target workflow spec with such code'), code
+                        )
+
+                # Matching the nodes in use. Their types (and branches, for split nodes) must match.
+                source_nodes = {id_: (course_code, code, type_) for id_, course_code, code, type_ in spec_nodes(source)}
+                target_nodes = {(course_code, code): (id_, type_) for id_, course_code, code, type_ in
+                                spec_nodes(target)}
+                source_branches, target_branches = spec_branches(source), spec_branches(target)
+                nodes_map = {}
+                for node_id in set(node_instances.values_list('node_spec_id', flat=True).distinct()):
+                    course_code, code, type_ = source_nodes[node_id]
+                    new_code = node_mapping.get(course_code, {}).get(code, code)
+                    try:
+                        new_node_id, new_type = target_nodes[(course_code, new_code)]
+                    except KeyError:
+                        raise exceptions.WorkflowCourseNodeDoesNotExist(target, course_code, new_code)
+                    if new_type != type_ or source_branches.get(node_id) != target_branches.get(new_node_id):
+                        raise exceptions.WorkflowSpecMigrationIncompatible(
+                            self, _('Node types and branches must match between versions'), course_code, code
+                        )
+                    nodes_map[node_id] = new_node_id
+
+                # Matching the timer transitions by origin and action name. Pending timers keep their due
+                #   dates, and the ones having no timer transition in the target version are dropped.
+                def spec_timers(workflow_spec):
+                    return models.TransitionSpec.objects.filter(
+                        origin__course_spec__workflow_spec=workflow_spec, timeout__isnull=False
+                    ).values_list('id', 'origin__course_spec__code', 'origin__code', 'action_name')
+
+                target_timers = {(course_code, code, action_name): id_
+                                 for id_, course_code, code, action_name in spec_timers(target)}
+                timers_map = {}
+                for id_, course_code, code, action_name in spec_timers(source):
+                    new_code = node_mapping.get(course_code, {}).get(code, code)
+                    if (course_code, new_code, action_name) in target_timers:
+                        timers_map[id_] = target_timers[(course_code, new_code, action_name)]
+
+                # Set-based updates. The workflow instances go last since the other filters depend on them.
+                pending_timers = models.NodeTimer.objects.filter(node_instance__in=node_instances)
+                pending_timers.exclude(transition_spec__in=list(timers_map)).delete()
+                if timers_map:
+                    pending_timers.update(transition_spec=Case(*[When(transition_spec_id=old, then=Value(new))
+                                                                 for old, new in items(timers_map)],
+                                                               output_field=IntegerField()))
+                if nodes_map:
+                    node_instances.update(node_spec=Case(*[When(node_spec_id=old, then=Value(new))
+                                                           for old, new in items(nodes_map)],
+                                                         output_field=IntegerField()))
+                if courses_map:
+                    course_instances.update(course_spec=Case(*[When(course_spec_id=old, then=Value(new))
+                                                               for old, new in items(courses_map)],
+                                                             output_field=IntegerField()))
+                # Statuses include node codes, which may be renamed in the target version.
+                return running.update(workflow_spec=target, status_version=F('status_version') + 1)
+
+        def dump(self, stream, instances=False):
+            """
+            Writes this spec (and, optionally, all its workflow instances) into a text stream, one json
+              record per line. Memory usage and the number of queries do not depend on the number of
+              workflow instances.
+            :param stream: A file-like text object to write into.
+            :param instances: Whether the workflow instances must also be written.
+            :return: The number of written workflow instances.
+            """
+
+            return serializers.dump(self.spec, stream, instances)
+
+        @classmethod
+        def load(cls, stream, batch_size=500):
+            """
+            Reads a stream written by .dump(). The spec is installed as a new version unless a published
+              version with the same code and digest already exists. Then the workflow instances, if any,
+              are created in batches for that version.
+            :param stream: A file-like text object (or any iterator of lines) to read from.
+            :param batch_size: The amount of workflow instances being inserted together.
+            :return: A tuple (wrapped spec, number of loaded workflow instances).
+            """
+
+            lines = iter(stream)
+            spec_data = serializers.read_spec(lines)
+            digest = spec_data.pop('digest', None)
+            workflow_spec = digest and models.WorkflowSpec.objects.filter(
+                code=spec_data.get('code'), digest=digest, published_on__isnull=False
+            ).first()
+            wrapped = cls(workflow_spec) if workflow_spec else cls.install(spec_data, bool(digest))
+            return wrapped, serializers.load_instances(lines, wrapped.spec, batch_size)
+
+        def compiled(self):
+            """
+            Compiled (ORM-free) version of this spec. Published specs are compiled once per process.
+            :return: A CompiledSpec instance.
+            """
+
+            return compiled.get(self.spec)
+
+        def dump_compiled(self, stream):
+            """
+            Writes the compiled version of this spec into a compact binary stream, so worker processes
+              can load it at startup instead of querying the spec tables. Only published specs can be
+              dumped, since loaded specs are validated against their digest.
+            :param stream: A file-like binary object to write into.
+            """
+
+            if not self.spec.published_on:
+                raise exceptions.WorkflowSpecNotPublished(self, _('Only published workflow specs can be compiled '
+                                                                  'into files'))
+            self.compiled().dump(stream)
+
+        @classmethod
+        def load_compiled(cls, path, validate=True):
+            """
+            Loads a compiled spec file into the process cache.
+            :param path: The path of the file.
+            :param validate: If True [default], the loaded spec is validated against the digest in the database.
+            :return: The compiled spec.
+            """
+
+            return compiled.preload([path], validate)[0]
+
+        def route(self, queryset, node_code, course_code=''):
+            """
+            Annotates a queryset of documents with the code of the node each document would be sent to
+              when traversing a multiplexer node, as `ouroboros_route` (None when no condition is satisfied).
+              This is computed in SQL, so every condition of the multiplexer must be a declarative expression.
+            :param queryset: A queryset of documents of this spec's document class.
+            :param node_code: The code of the multiplexer node.
+            :param course_code: The code of the course the node belongs to. By default, the main course.
+            :return: The annotated queryset.
+            """
+
+            compiled_spec = self.compiled()
+            course = compiled_spec.find_course(course_code)
+            if course is None:
+                raise exceptions.WorkflowCourseDoesNotExist(
+                    self.spec, _('No course exists in the workflow spec with such code'), course_code
+                )
+            node = compiled_spec.find_node(course, node_code)
+            if node is None or compiled_spec.node_type(node) != models.NodeSpec.MULTIPLEXER:
+                raise exceptions.WorkflowCourseNodeDoesNotExist(self.spec, course_code, node_code)
+            whens = []
+            for transition, condition in compiled_spec.decision_table(node):
+                if not isinstance(condition, expressions.Expression):
+                    raise exceptions.WorkflowCourseNodeConditionsNotDeclarative(
+                        self.spec, _('Only multiplexer nodes with declarative conditions can be routed in SQL'),
+                        course_code, node_code
+                    )
+                destination = compiled_spec.transition_destinations[transition]
+                whens.append(When(condition.as_q(), then=Value(compiled_spec.string(
+                    compiled_spec.node_codes[destination]
+                ))))
+            return queryset.annotate(ouroboros_route=Case(*whens, default=Value(None), output_field=CharField()))
+
+        def analyze(self, logs=False, max_visits=1, limit=1000):
+            """
+            Statically analyzes this spec: paths, dominators, split outcomes and a coverage matrix of
+              the transitions. See analysis.report for more details.
+            :param logs: Whether the course instance logs of this spec are merged into the coverage matrix.
+            :param max_visits: The cycle bound used to enumerate the paths.
+            :param limit: The maximum number of paths to enumerate by course.
+            :return: A json-serializable dictionary.
+            """
+
+            traces = analysis.log_traces(self.spec) if logs else ()
+            return analysis.report(self.compiled(), traces, max_visits, limit)
+
+        def throughput(self, since=None, until=None):
+            """
+            Gets how many courses entered and left each node of this spec, by hour. It is read from the
+              rollup table, which is maintained on write when the OUROBOROS_THROUGHPUT_ROLLUP setting is
+              True (and can be rebuilt by the ouroboros_rebuild_throughput command).
+            :param since: If given, only the buckets starting since this date are retrieved.
+            :param until: If given, only the buckets starting before this date are retrieved.
+            :return: A dictionary of course code => node code => list of (bucket, entered, left).
+            """
+
+            return metrics.throughput(self.spec, since, until)
+
+        def dwell_times(self, percentiles=(50, 90, 99), since=None):
+            """
+            Computes, in one query, how long the courses stay in each node of this spec. The logs are
+              read in index order, but all of them: see metrics.dwell_times for more details.
+            :param percentiles: The percentiles to compute.
+            :param since: If given, only the nodes left since this date are considered.
+            :return: A dictionary of course code => node code => {'count': n, 'p<percentile>': timedelta, ...}.
+            """
+
+            return metrics.dwell_times(self.spec, percentiles, since)
+
+        def simulate(self, document, user=None, **kwargs):
+            """
+            Creates an in-memory simulation of this spec, which runs its compiled version without
+              touching the database. See simulation.Simulation for more details.
+            :param document: The document, or a stub object, to run the simulation against.
+            :param user: The user, or a stub object, given to the callables.
+            :param kwargs: Extra options for the simulation (overrides, run_handlers).
+            :return: A Simulation instance, not yet started.
+            """
+
+            return simulation.Simulation(self.compiled(), document, user, **kwargs)
 
         def instantiate(self, user, document):
             """
@@ -133,11 +474,57 @@ class Workflow(object):
             return Workflow.create(user, self, document)
 
         @classmethod
-        def install(cls, spec_data):
+        def get(cls, code, version=None, using=None):
+            """
+            Gets a workflow spec by its code and version.
+            :param code: The code of the workflow spec.
+            :param version: The version to get. If None [default], the latest published version is retrieved.
+            :param using: The database to read from (by default, the router decides).
+            :return: The spec, wrapped by this class.
+            """
+
+            manager = models.WorkflowSpec.objects.db_manager(using)
+            try:
+                if version is None:
+                    return cls(manager.get_latest_version(code))
+                return cls(manager.get(code=code, version=version))
+            except models.WorkflowSpec.DoesNotExist:
+                raise exceptions.WorkflowSpecDoesNotExist(
+                    None, _('No workflow spec exists with such code and version'), code, version
+                )
+
+        @classmethod
+        def _validate(cls, workflow_spec):
+            """
+            Massive validation of the whole spec.
+            :param workflow_spec: The workflow spec to validate.
+            """
+
+            # Workflow (one main course; acyclic)
+            with wrap_validation_error(workflow_spec):
+                workflow_spec.full_clean()
+            # Courses (having required nodes; having SPLIT parents, if any; having valid code)
+            for course_spec in workflow_spec.course_specs.all():
+                with wrap_validation_error(course_spec):
+                    course_spec.full_clean()
+                # Nodes (inbounds, outbounds, and attributes)
+                for node_spec in course_spec.node_specs.all():
+                    with wrap_validation_error(node_spec):
+                        node_spec.full_clean()
+                # Transitions (consistency, attributes, wrt origin node)
+                for transition_spec in models.TransitionSpec.objects.filter(origin__course_spec=course_spec):
+                    with wrap_validation_error(transition_spec):
+                        transition_spec.full_clean()
+
+        @classmethod
+        def install(cls, spec_data, publish=False):
             """
             Takes a json specification (either as string or python dict) which includes the model to associate,
-              and tries to create a new workflow spec.
+              and tries to create a new workflow spec. If a workflow spec with the same code already exists, a
+              new version of it is created.
             :param spec_data: The data used to install the spec. Either json or a dict.
+            :param publish: If True, the new version is also published. Otherwise [default] it is kept as a
+              draft which can still be edited.
             :return: The new spec, wrapped by this class.
             """
 
@@ -155,8 +542,9 @@ class Workflow(object):
                 description = spec_data.get('description', '')
                 create_permission = spec_data.get('create_permission')
                 cancel_permission = spec_data.get('cancel_permission')
-                workflow_spec = models.WorkflowSpec(code=code, name=name, description=description,
-                                                    create_permission=create_permission,
+                version = models.WorkflowSpec.objects.filter(code=code).aggregate(version=Max('version'))['version']
+                workflow_spec = models.WorkflowSpec(code=code, version=(version or 0) + 1, name=name,
+                                                    description=description, create_permission=create_permission,
                                                     cancel_permission=cancel_permission,
                                                     document_type=ContentType.objects.get_for_model(model))
                 with wrap_validation_error(workflow_spec):
@@ -212,6 +600,9 @@ class Workflow(object):
                         permission = transition_spec_data.get('permission')
                         condition = transition_spec_data.get('condition')
                         priority = transition_spec_data.get('priority')
+                        timeout = transition_spec_data.get('timeout')
+                        if timeout is not None:
+                            timeout = timedelta(seconds=timeout)
 
                         try:
                             origin = course_spec.node_specs.get(code=origin_code)
@@ -226,7 +617,7 @@ class Workflow(object):
                         transition = models.TransitionSpec(origin=origin, destination=destination, name=name,
                                                            action_name=action_name, description=description,
                                                            permission=permission, condition=condition,
-                                                           priority=priority)
+                                                           priority=priority, timeout=timeout)
                         with wrap_validation_error(transition):
                             transition.full_clean()
                         transition.save()
@@ -245,27 +636,12 @@ class Workflow(object):
                                 workflow_spec, _('No course exists in the workflow spec with such code'), branch
                             )
 
-                #
                 # Massive final validation
-                #
-                # Workflow (one main course; acyclic)
-                with wrap_validation_error(workflow_spec):
-                    workflow_spec.full_clean()
-                # Courses (having required nodes; having SPLIT parents, if any; having valid code)
-                for course_spec in workflow_spec.course_specs.all():
-                    with wrap_validation_error(course_spec):
-                        course_spec.full_clean()
-                    # Nodes (inbounds, outbounds, and attributes)
-                    for node_spec in course_spec.node_specs.all():
-                        with wrap_validation_error(node_spec):
-                            node_spec.full_clean()
-                    # Transitions (consistency, attributes, wrt origin node)
-                    for transition_spec in models.TransitionSpec.objects.filter(origin__course_spec=course_spec):
-                        with wrap_validation_error(transition_spec):
-                            transition_spec.full_clean()
+                cls._validate(workflow_spec)
 
                 # Everything is valid, so we return the wrapped instance
-                return cls(workflow_spec)
+                wrapped = cls(workflow_spec)
+                return wrapped.publish() if publish else wrapped
 
     class PermissionsChecker(object):
         """
@@ -440,6 +816,35 @@ class Workflow(object):
                 return -1
             return course_instance.node_instance.node_spec.exit_value
 
+        @classmethod
+        def get_branches(cls, course_instance):
+            """
+            Gets the branches of a splitting course instance, with their current nodes. The branches share
+              the workflow instance (and so, the document) and the parent node instance of the given course
+              instance, so they are not retrieved again for each branch.
+            :param course_instance: The splitting course instance.
+            :return: A list of course instances.
+            """
+
+            node_instance = course_instance.node_instance
+            branches = list(node_instance.branches.select_related('course_spec', 'node_instance__node_spec'))
+            for branch in branches:
+                branch.workflow_instance = course_instance.workflow_instance
+                branch.parent = node_instance
+            return branches
+
+        @classmethod
+        def get_parent(cls, course_instance):
+            """
+            Gets the parent course instance of a branch, sharing its workflow instance (and so, the document).
+            :param course_instance: The branch course instance.
+            :return: The course instance having the split node this branch comes from.
+            """
+
+            parent_course_instance = course_instance.parent.course_instance
+            parent_course_instance.workflow_instance = course_instance.workflow_instance
+            return parent_course_instance
+
         @classmethod
         def find_course(cls, course_instance, path):
             """
@@ -466,22 +871,21 @@ class Workflow(object):
                 else:
                     head, tail = parts
                 try:
-                    return cls.find_course(course_instance.node_instance.branches.get(course_spec__code=head), tail)
+                    branches = [branch for branch in cls.get_branches(course_instance)
+                                if branch.course_spec.code == head]
                 except models.NodeInstance.DoesNotExist:
                     raise exceptions.WorkflowCourseInstanceDoesNotExist(
                         course_instance, _('There is no children course with this path/code'), path, head
                     )
-                except models.NodeInstance.MultipleObjectsReturned:
-                    raise exceptions.WorkflowNoSuchElement(course_instance, _('Multiple children courses exist '
-                                                                              'with course code in path'), head)
-                except models.CourseInstance.DoesNotExist:
+                if not branches:
                     raise exceptions.WorkflowCourseInstanceDoesNotExist(
                         course_instance, _('There is no children course with this path/code'), path, head
                     )
-                except models.CourseInstance.MultipleObjectsReturned:
+                elif len(branches) > 1:
                     raise exceptions.WorkflowNoSuchElement(
                         course_instance, _('There are multiple children courses with the same path/code'), path, head
                     )
+                return cls.find_course(branches[0], tail)
 
     class WorkflowHelpers(object):
         """
@@ -516,7 +920,14 @@ class Workflow(object):
             :return: The created course instance.
             """
 
-            course_instance = workflow_instance.courses.create(course_spec=course_spec, parent=parent)
+            course_instance = workflow_instance.courses.create(course_spec=course_spec, parent=parent,
+                                                               shard_key=workflow_instance.shard_key)
+            if events.enabled():
+                events.append(workflow_instance, user, [{
+                    'type': models.WorkflowEvent.COURSE_CREATED, 'course_instance_id': course_instance.pk,
+                    'parent_course_instance_id': parent and parent.course_instance_id,
+                    'course_spec_id': course_spec.id
+                }], course_instance.created_on)
             enter_node = course_spec.node_specs.get(type=models.NodeSpec.ENTER)
             enter_node.full_clean()
             cls._move(course_instance, enter_node, user)
@@ -526,13 +937,14 @@ class Workflow(object):
             return course_instance
 
         @classmethod
-        def _move(cls, course_instance, node, user):
+        def _move(cls, course_instance, node, user, transition=None):
             """
             Moves the course to a new node. Checks existence (if node code specified) or consistency
               (if node instance specified).
             :param course_instance: The course instance to move.
             :param node: The node instance or code to move this course instance.
             :param user: The user invoking the action that caused this movement.
+            :param transition: The transition being run to reach the node, if any (it is logged).
             """
 
             if isinstance(node, string_types):
@@ -552,6 +964,7 @@ class Workflow(object):
             handler = node_spec.landing_handler
             if handler:
                 handler(course_instance.workflow_instance.document, user)
+                forget_conditions()
 
             # Nodes of type INPUT, EXIT, SPLIT, JOINED and CANCEL are not intermediate execution nodes but
             #   they end the advancement of a course (EXIT, JOINED and CANCEL do that permanently, while
@@ -561,22 +974,171 @@ class Workflow(object):
             if node_spec.type in (models.NodeSpec.INPUT, models.NodeSpec.SPLIT, models.NodeSpec.EXIT,
                                   models.NodeSpec.CANCEL, models.NodeSpec.JOINED):
                 try:
-                    course_instance.node_instance.delete()
+                    previous = course_instance.node_instance
+                    previous.delete()
                 except models.NodeInstance.DoesNotExist:
-                    pass
-                node_instance = models.NodeInstance.objects.create(course_instance=course_instance, node_spec=node_spec)
-                # We must log the step.
-                models.CourseInstanceLog.objects.create(user=user, course_instance=course_instance, node_spec=node_spec)
+                    previous = None
+                branches = list(node_spec.branches.all()) if node_spec.type == models.NodeSpec.SPLIT else []
+                node_instance = models.NodeInstance.objects.create(course_instance=course_instance, node_spec=node_spec,
+                                                                   branch_count=len(branches),
+                                                                   shard_key=course_instance.shard_key)
+                # Cached statuses of this workflow instance become stale.
+                models.WorkflowInstance.objects.filter(pk=course_instance.workflow_instance_id).update(
+                    status_version=F('status_version') + 1
+                )
+                # We must log the step, along with the previous one.
+                stamp = now()
+                models.CourseInstanceLog.objects.create(
+                    user=user, course_instance=course_instance, node_spec=node_spec, created_on=stamp,
+                    previous_node_spec_id=previous and previous.node_spec_id, transition_spec=transition,
+                    elapsed=previous and stamp - previous.created_on, shard_key=course_instance.shard_key
+                )
+                if node_spec.type == models.NodeSpec.INPUT:
+                    timers.schedule(timers.pending(compiled.get(course_instance.workflow_instance.workflow_spec),
+                                                   node_instance, node_instance.created_on))
+                if metrics.rollup_enabled():
+                    metrics.record_landings(course_instance.workflow_instance.workflow_spec_id,
+                                            [(node_spec.id, previous and previous.node_spec_id)], stamp)
+                if events.enabled():
+                    events.append(course_instance.workflow_instance, user, [{
+                        'type': models.WorkflowEvent.NODE_ENTERED, 'course_instance_id': course_instance.pk,
+                        'node_spec_id': node_spec.id
+                    }], stamp)
+                if outbox.enabled():
+                    workflow_instance = course_instance.workflow_instance
+                    outbox.write([outbox.landing(
+                        compiled.get(workflow_instance.workflow_spec), workflow_instance, course_instance.pk,
+                        course_instance.course_spec_id, node_spec.id, previous and previous.node_spec_id, user, stamp
+                    )])
                 # For split nodes, we also need to create the pending courses as branches.
-                if node_spec.type == models.NodeSpec.SPLIT:
-                    for branch in node_spec.branches.all():
-                        cls._instantiate_course(course_instance.workflow_instance, branch, node_instance, user)
+                for branch in branches:
+                    cls._instantiate_course(course_instance.workflow_instance, branch, node_instance, user)
+
+        @classmethod
+        def _terminate(cls, course_instances, user, node_type, level=0):
+            """
+            Moves course instances (of the same workflow instance) and, recursively, their non-terminated
+              descendants to a node of the given type (CANCEL or JOINED). The tree is loaded at once, the
+              target nodes are taken from the compiled spec, the landing handlers are invoked deepest first
+              (i.e. each course after its branches) and the node instances, logs and term levels are written
+              in bulk.
+
+            Split node instances are updated in place (with their branch counters reset), and their
+              branches are deleted at the end with a single query, just like replacing the node instance
+              would do.
+            :param course_instances: The top course instances being terminated.
+            :param user: The user invoking the action leading to this call.
+            :param node_type: The type of the target nodes (CANCEL or JOINED).
+            :param level: The termination level of the top course instances.
+            """
+
+            course_instances = [course_instance for course_instance in course_instances
+                                if not Workflow.CourseHelpers.is_terminated(course_instance)]
+            if not course_instances:
+                return
+            workflow_instance = course_instances[0].workflow_instance
+            compiled_spec = compiled.get(workflow_instance.workflow_spec)
+
+            # Loading the whole tree once, and sharing the workflow instance (and document).
+            children = {}
+            for candidate in models.CourseInstance.objects.filter(
+                workflow_instance=workflow_instance, parent__isnull=False
+            ).select_related('course_spec', 'parent', 'node_instance__node_spec').order_by('id'):
+                candidate.workflow_instance = workflow_instance
+                children.setdefault(candidate.parent.course_instance_id, []).append(candidate)
+
+            # Collecting the subtree in post-order, with the levels and target nodes.
+            targets, splitting = [], []
+
+            def collect(current, current_level):
+                if Workflow.CourseHelpers.is_terminated(current):
+                    return
+                if Workflow.CourseHelpers.is_splitting(current):
+                    splitting.append(current.pk)
+                    for branch in children.get(current.pk, ()):
+                        collect(branch, current_level + 1)
+                targets.append((current, current_level, decisions.terminal_node(
+                    compiled_spec, compiled_spec.course_index(current.course_spec_id), node_type, current
+                )))
+
+            for course_instance in course_instances:
+                collect(course_instance, level)
+
+            # Landing handlers, deepest first.
+            for current, current_level, node in targets:
+                handler = compiled_spec.path(compiled_spec.node_landing_handlers[node])
+                if handler:
+                    handler(workflow_instance.document, user)
+                    forget_conditions()
+
+            # Bulk writes: node instances, logs, term levels and the status version.
+            stamp = now()
+            node_specs = models.NodeSpec.objects.in_bulk(set(compiled_spec.node_ids[target[2]] for target in targets))
+            by_node, by_level, created, logs, timed = {}, {}, [], [], []
+            for current, current_level, node in targets:
+                node_spec = node_specs[compiled_spec.node_ids[node]]
+                try:
+                    node_instance = current.node_instance
+                    logs.append(models.CourseInstanceLog(
+                        user=user, course_instance=current, node_spec=node_spec, created_on=stamp,
+                        previous_node_spec_id=node_instance.node_spec_id, elapsed=stamp - node_instance.created_on,
+                        shard_key=current.shard_key
+                    ))
+                    by_node.setdefault(node_spec.id, []).append(current.pk)
+                    if compiled_spec.timers(compiled_spec.node_index(node_instance.node_spec_id)):
+                        timed.append(current.pk)
+                    node_instance.node_spec = node_spec
+                    node_instance.branch_count = node_instance.terminated_count = 0
+                    node_instance.created_on = node_instance.updated_on = stamp
+                except models.NodeInstance.DoesNotExist:
+                    logs.append(models.CourseInstanceLog(user=user, course_instance=current, node_spec=node_spec,
+                                                         created_on=stamp, shard_key=current.shard_key))
+                    current.node_instance = models.NodeInstance(course_instance=current, node_spec=node_spec,
+                                                                created_on=stamp, updated_on=stamp,
+                                                                shard_key=current.shard_key)
+                    created.append(current.node_instance)
+                by_level.setdefault(current_level, []).append(current.pk)
+                current.term_level = current_level
+            if by_node:
+                models.NodeInstance.objects.filter(
+                    course_instance__in=[pk for pks in by_node.values() for pk in pks]
+                ).update(node_spec=Case(*[When(course_instance__in=pks, then=Value(node_spec_id))
+                                          for node_spec_id, pks in items(by_node)], output_field=IntegerField()),
+                         branch_count=0, terminated_count=0, created_on=stamp, updated_on=stamp)
+            if timed:
+                # Node instances are updated in place, so their timers are not deleted along with them.
+                timers.discard(timed)
+            models.NodeInstance.objects.bulk_create(created)
+            models.CourseInstanceLog.objects.bulk_create(logs)
+            if metrics.rollup_enabled():
+                metrics.record_landings(workflow_instance.workflow_spec_id,
+                                        [(log.node_spec_id, log.previous_node_spec_id) for log in logs], stamp)
+            if events.enabled():
+                events.append(workflow_instance, user, [{
+                    'type': models.WorkflowEvent.COURSE_TERMINATED, 'course_instance_id': current.pk,
+                    'node_spec_id': compiled_spec.node_ids[node], 'term_level': current_level
+                } for current, current_level, node in targets], stamp)
+            if outbox.enabled():
+                outbox.write([outbox.landing(compiled_spec, workflow_instance, log.course_instance.pk,
+                                             log.course_instance.course_spec_id, log.node_spec_id,
+                                             log.previous_node_spec_id, user, stamp) for log in logs])
+            models.CourseInstance.objects.filter(pk__in=[target[0].pk for target in targets]).update(
+                term_level=Case(*[When(pk__in=pks, then=Value(term_level)) for term_level, pks in items(by_level)],
+                                output_field=IntegerField()),
+                updated_on=stamp
+            )
+            if splitting:
+                # The whole subtree under the terminated splits (logs included) goes away.
+                models.CourseInstance.objects.filter(parent__course_instance__in=splitting).delete()
+            models.WorkflowInstance.objects.filter(pk=workflow_instance.pk).update(
+                status_version=F('status_version') + 1
+            )
 
         @classmethod
         def _cancel(cls, course_instance, user, level=0):
             """
             Moves the course recursively (if this course has children) to a cancel node.
-              For more information see the _move method in this class.
+              For more information see the _terminate method in this class.
             :param course_instance: The course instance being cancelled.
             :param user: The user invoking the action leading to this call.
             :param level: The cancellation level. Not directly useful except as information for the
@@ -584,43 +1146,21 @@ class Workflow(object):
             :return:
             """
 
-            if Workflow.CourseHelpers.is_terminated(course_instance):
-                return
-            node_spec = course_instance.course_spec.verify_has_cancel_node()
-            course_instance.clean()
-            if Workflow.CourseHelpers.is_splitting(course_instance):
-                next_level = level + 1
-                for branch in course_instance.node_instance.branches.all():
-                    cls._cancel(branch, user, next_level)
-            cls._move(course_instance, node_spec, user)
-            course_instance.term_level = level
-            course_instance.save()
+            cls._terminate([course_instance], user, models.NodeSpec.CANCEL, level)
 
         @classmethod
-        def _join(cls, course_instance, user, level=0):
+        def _join(cls, course_instances, user, level=0):
             """
-            Moves the course recursively (if this course has children) to a joined node.
-              For more information see the _move method in this class.
-            :param course_instance: The course instance being joined.
+            Moves the courses recursively (if these courses have children) to a joined node.
+              For more information see the _terminate method in this class.
+            :param course_instances: The course instances being joined.
             :param user: The user invoking the action leading to this call.
             :param level: The joining level. Not directly useful except as information for the
               user, later in the database.
             :return:
             """
 
-            if Workflow.CourseHelpers.is_terminated(course_instance):
-                return
-            node_spec = course_instance.course_spec.verify_has_joined_node()
-            if not node_spec:
-                raise exceptions.WorkflowCourseInstanceNotJoinable(course_instance, _('This course is not joinable'))
-            course_instance.clean()
-            if Workflow.CourseHelpers.is_splitting(course_instance):
-                next_level = level + 1
-                for branch in course_instance.node_instance.branches.all():
-                    cls._join(branch, user, next_level)
-            cls._move(course_instance, node_spec, user)
-            course_instance.term_level = level
-            course_instance.save()
+            cls._terminate(course_instances, user, models.NodeSpec.JOINED, level)
 
         @classmethod
         def _run_transition(cls, course_instance, transition, user):
@@ -651,7 +1191,7 @@ class Workflow(object):
             Workflow.PermissionsChecker.can_advance_course(course_instance, transition, user)
 
             # We move to the destination node
-            cls._move(course_instance, destination, user)
+            cls._move(course_instance, destination, user, transition)
 
             # We must see what happens next.
             # ENTER, CANCEL and JOINED types are not valid destination types.
@@ -667,39 +1207,56 @@ class Workflow(object):
             if destination.type == models.NodeSpec.EXIT:
                 if course_instance.parent:
                     course_instance.parent.clean()
-                    parent_course_instance = course_instance.parent.course_instance
+                    parent_course_instance = Workflow.CourseHelpers.get_parent(course_instance)
                     parent_course_instance.clean()
                     cls._test_split_branch_reached(parent_course_instance, user, course_instance)
             elif destination.type == models.NodeSpec.STEP:
                 # After cleaning destination, we know that it has exactly one outbound.
                 transition = destination.outbounds.get()
                 # Clean the transition.
-                transition.clean()
+                transition.clean(unique=False)
                 # Run the transition.
                 cls._run_transition(course_instance, transition, user)
             elif destination.type == models.NodeSpec.MULTIPLEXER:
-                # After cleaning destination, we know that it has more than one outbound.
-                transitions = list(destination.outbounds.order_by('priority').all())
-                # Clean all the transitions.
-                for transition in transitions:
-                    transition.clean()
-                # Evaluate the conditions and take the transition satisfying the first.
-                # If no transition is picked, an error is thrown.
-                for transition in transitions:
-                    condition = transition.condition
-                    # Condition will be set since we cleaned the transition.
-                    if condition(course_instance.workflow_instance.document, user):
-                        cls._run_transition(course_instance, transition, user)
-                        break
-                else:
-                    raise exceptions.WorkflowCourseNodeMultiplexerDidNotSatisfyAnyCondition(
-                        destination, _('No condition was satisfied when traversing a multiplexer node')
-                    )
+                # After cleaning destination, we know that it has more than one outbound, and
+                #   each outbound has a condition. We use the compiled decision table: the
+                #   transition satisfying the first condition is taken (if none, an error is thrown).
+                compiled_spec = compiled.get(course_spec.workflow_spec)
+                document = course_instance.workflow_instance.document
+                transition = decisions.pick_outbound(
+                    compiled_spec, compiled_spec.node_index(destination.id),
+                    lambda condition: evaluate_condition(condition, document, user), destination
+                )
+                transition = models.TransitionSpec.objects.select_related('origin', 'destination').get(
+                    pk=compiled_spec.transition_ids[transition]
+                )
+                cls._run_transition(course_instance, transition, user)
+
+        @classmethod
+        def _count_terminated_branch(cls, node_instance):
+            """
+            Counts one more terminated branch in a split node instance. The row is locked until the end
+              of the transaction, so concurrent terminations of sibling branches are counted one after
+              the other, and only one of them sees the split as completed.
+            :param node_instance: The split node instance.
+            :return: Whether all the branches of the split node instance are terminated.
+            """
+
+            node_instances = models.NodeInstance.objects.filter(pk=node_instance.pk)
+            node_instances.update(terminated_count=F('terminated_count') + 1)
+            node_instance.branch_count, node_instance.terminated_count = node_instances.select_for_update().values_list(
+                'branch_count', 'terminated_count'
+            ).get()
+            return node_instance.terminated_count >= node_instance.branch_count
 
         @classmethod
         def _test_split_branch_reached(cls, course_instance, user, reaching_branch):
             """
             Decides on a parent course instance what to do when a child branch has reached and end.
+              Splits without joiner just count the terminated branches. Otherwise, the states of all the
+              branches are loaded in one query, the joiner is evaluated on them in memory, and the
+              transitions are taken from the compiled spec (only the picked one is retrieved). Unfinished
+              branches are joined together, in bulk.
             :param course_instance: The parent course instance being evaluated. This instance will have
               a node instance referencing a SPLIT node.
             :param user: The user causing this action by running a transition or cancelling a course.
@@ -712,87 +1269,54 @@ class Workflow(object):
             node_spec = course_instance.node_instance.node_spec
             node_spec.clean()
             joiner = node_spec.joiner
-            branches = course_instance.node_instance.branches.all()
+            compiled_spec = compiled.get(course_instance.workflow_instance.workflow_spec)
+            outbounds = compiled_spec.outbounds(compiled_spec.node_index(node_spec.id))
+            completed = cls._count_terminated_branch(course_instance.node_instance)
+
+            def get_transition(transition):
+                transition = models.TransitionSpec.objects.select_related('origin', 'destination').get(
+                    pk=compiled_spec.transition_ids[transition]
+                )
+                transition.clean(unique=False)
+                return transition
+
             if not joiner:
                 # By cleaning we know we will be handling only one transition
-                transition = node_spec.outbounds.get()
-                transition.clean()
-                # If any branch is not terminated, then we do nothing.
+                # If any branch is not terminated (as told by the split counters), then we do nothing.
                 # Otherwise we will execute the transition.
-                if all(Workflow.CourseHelpers.is_terminated(branch) for branch in branches):
-                    cls._run_transition(course_instance, transition, user)
+                if completed:
+                    cls._run_transition(course_instance, get_transition(outbounds[0]), user)
             else:
-                # By cleaning we know we will be handling at least one transition
-                transitions = node_spec.outbounds.all()
-                one_transition = transitions.count() == 1
-                # We call the joiner with its arguments
-                reaching_branch_code = reaching_branch.course_spec.code
+                branches = Workflow.CourseHelpers.get_branches(course_instance)
                 # Making a dictionary of branch statuses
                 branch_statuses = {branch.course_spec.code: Workflow.CourseHelpers.get_exit_code(branch)
                                    for branch in branches}
                 # Execute the joiner with (document, branch statuses, and current branch being joined) and
-                #   get the return value.
-                returned = joiner(course_instance.workflow_instance.document, branch_statuses, reaching_branch_code)
-                if (one_transition and not returned) or returned is None:
-                    # If all the branches have ended (i.e. they have non-None values), this
-                    #   is an error.
-                    # Otherwise, we do nothing.
-                    if all(bool(status) for status in branch_statuses.values()):
-                        raise exceptions.WorkflowCourseNodeNoTransitionResolvedAfterCompleteSplitJoin(
-                            node_spec, _('The joiner callable returned None -not deciding any action- but '
-                                         'all the branches have terminated')
-                        )
-                elif not one_transition and isinstance(returned, string_types):
-                    # The transitions will have unique and present action codes.
-                    # We validate they have unique codes and all codes are present.
-                    # IF the count of distinct action_names is not the same as the count
-                    #   of transitions, this means that either some transitions do not
-                    #   have action name, or have a repeated one.
-                    count = transitions.count()
-                    transition_codes = {transition.action_name for transition in transitions if transition.action_name}
-                    if len(transition_codes) != count:
-                        raise exceptions.WorkflowCourseNodeBadTransitionActionNamesAfterSplitNode(
-                            node_spec, _('Split node transitions must all have a unique action name')
-                        )
-                    try:
-                        # We get the transition by its code.
-                        transition = transitions.get(action_name=returned)
-                    except models.TransitionSpec.DoesNotExist:
-                        raise exceptions.WorkflowCourseNodeTransitionDoesNotExist(
-                            node_spec, _('No transition has the specified action name'), returned
-                        )
-                    # We clean the transition
-                    transition.clean()
-                    # We force a join in any non-terminated branch (i.e. status in None)
-                    for code, status in items(branch_statuses):
-                        if status is None:
-                            cls._join(branches.get(course_spec__code=code), user)
-                    # And THEN we execute our picked transition
-                    cls._run_transition(course_instance, transition, user)
-                elif not one_transition:
-                    # Invalid joiner return value type
-                    raise exceptions.WorkflowCourseNodeInvalidSplitResolutionCode(
-                        node_spec, _('Invalid joiner resolution code type. Expected string or None'), returned
-                    )
-                else:
-                    # We know we have one transition, and the returned joiner value was bool(x) == True
-                    transition = transitions.first()
-                    transition.clean()
+                #   resolve the return value into a transition (None: keep waiting).
+                returned = joiner(course_instance.workflow_instance.document, branch_statuses,
+                                  reaching_branch.course_spec.code)
+                transition = decisions.join_outbound(compiled_spec, compiled_spec.node_index(node_spec.id), returned,
+                                                     branch_statuses, node_spec)
+                if transition is not None:
+                    # We get (and clean) the transition.
+                    transition = get_transition(transition)
                     # We force a join in any non-terminated branch (i.e. status in None)
-                    for code, status in items(branch_statuses):
-                        if status is None:
-                            cls._join(branches.get(course_spec__code=code), user)
+                    cls._join([branch for branch in branches if branch_statuses[branch.course_spec.code] is None],
+                              user)
                     # And THEN we execute our picked transition
                     cls._run_transition(course_instance, transition, user)
 
-    def __init__(self, workflow_instance):
+    def __init__(self, workflow_instance, clean=True):
         """
         In the end, this whole class is just a Wrapper of a workflow instance,
           and provides all the related methods.
         :param workflow_instance: Instance being wrapped.
+        :param clean: Whether the instance must be validated. Instances just retrieved in bulk
+          were already validated when they were saved, so this can be skipped for them.
         """
 
-        workflow_instance.clean()
+        if clean:
+            workflow_instance.clean()
         self._instance = workflow_instance
 
     @property
@@ -800,21 +1324,76 @@ class Workflow(object):
         return self._instance
 
     @classmethod
-    def get(cls, document):
+    def get(cls, document, using=None):
         """
         Gets an existent workflow for a given document.
         :param document:
+        :param using: The database to read from (by default, the router decides or, if sharding is
+          configured, every shard is queried in parallel). Further reads of the returned workflow (e.g.
+          its status) are done in the same database.
         :return:
         """
 
         content_type = ContentType.objects.get_for_model(type(document))
         object_id = document.id
-        try:
-            return cls(models.WorkflowInstance.objects.get(content_type=content_type, object_id=object_id))
-        except models.WorkflowInstance.DoesNotExist:
+
+        def lookup(database):
+            return list(models.WorkflowInstance.objects.using(database).filter(content_type=content_type,
+                                                                               object_id=object_id)[:1])
+
+        found = lookup(using) if using is not None else sum(sharding.fan_out(lookup), [])
+        if not found:
             raise exceptions.WorkflowInstanceDoesNotExist(
                 None, _('No workflow instance exists for given document'), document
             )
+        return cls(found[0])
+
+    @classmethod
+    def get_many(cls, documents, using=None):
+        """
+        Gets the existent workflows for many documents, with one query per document type (documents
+          with prefetched workflow instances need no query). Retrieved instances are not validated
+          again, and their documents are the given ones (so they are not retrieved again).
+        :param documents: An iterable of documents. They may be of different types.
+        :param using: The database to read from (by default, the router decides or, if sharding is
+          configured, every shard is queried in parallel).
+        :return: A list of wrapped workflow instances (or None for the documents having no workflow
+          instance), in the same order of the documents.
+        """
+
+        documents = list(documents)
+        ids_by_model = {}
+        workflow_instances = {}
+        for document in documents:
+            prefetched = getattr(document, '_prefetched_objects_cache', {}).get('workflow_instances')
+            if prefetched is not None:
+                # Documents coming from .prefetch_related('workflow_instances') need no query.
+                for workflow_instance in prefetched:
+                    workflow_instances[(type(document), document.pk)] = workflow_instance
+            else:
+                ids_by_model.setdefault(type(document), set()).add(document.pk)
+        content_types = ContentType.objects.get_for_models(*ids_by_model.keys())
+
+        def lookup(database):
+            return [(model, workflow_instance) for model, ids in items(ids_by_model)
+                    for workflow_instance in models.WorkflowInstance.objects.using(database).filter(
+                        content_type=content_types[model], object_id__in=ids
+                    ).select_related('workflow_spec')]
+
+        if ids_by_model:
+            found = lookup(using) if using is not None else sum(sharding.fan_out(lookup), [])
+            for model, workflow_instance in found:
+                workflow_instances[(model, workflow_instance.object_id)] = workflow_instance
+
+        result = []
+        for document in documents:
+            workflow_instance = workflow_instances.get((type(document), document.pk))
+            if workflow_instance is None:
+                result.append(None)
+            else:
+                workflow_instance.document = document
+                result.append(cls(workflow_instance, False))
+        return result
 
     @classmethod
     def create(cls, user, workflow_spec, document):
@@ -823,15 +1402,20 @@ class Workflow(object):
           on behalf of the specified user.
         :param user: The user requesting this action. Permission will be checked for him
           against the document.
-        :param workflow_spec: The workflow spec to be tied to.
+        :param workflow_spec: The wrapped workflow spec to be tied to, or the code of a workflow spec (in
+          this case, the latest published version is used).
         :param document: The document to associate.
         :return: A wrapper for the newly created instance.
         """
 
+        if isinstance(workflow_spec, string_types):
+            workflow_spec = cls.Spec.get(workflow_spec)
         # We only care about the actual spec here, which is already cleaned.
         workflow_spec = workflow_spec.spec
-        with atomic():
-            workflow_instance = models.WorkflowInstance(workflow_spec=workflow_spec, document=document)
+        shard_key = sharding.shard_key(workflow_spec, document)
+        with sharded_atomic(shard_key):
+            workflow_instance = models.WorkflowInstance(workflow_spec=workflow_spec, document=document,
+                                                        shard_key=shard_key)
             cls.PermissionsChecker.can_instantiate_workflow(workflow_instance, user)
             workflow_instance.full_clean()
             workflow_instance.save()
@@ -844,7 +1428,7 @@ class Workflow(object):
         :return:
         """
 
-        with atomic():
+        with sharded_atomic(self.instance.shard_key), memoizing_conditions():
             try:
                 self.instance.courses.get(parent__isnull=True)
                 raise exceptions.WorkflowInstanceNotPending(
@@ -854,6 +1438,7 @@ class Workflow(object):
                 course_spec = self.instance.workflow_spec.course_specs.get(callers__isnull=True)
                 course_spec.full_clean()
                 course_instance = self.WorkflowRunner._instantiate_course(self.instance, course_spec, None, user)
+                self._refresh_status_version()
 
     def execute(self, user, action_name, path=''):
         """
@@ -864,7 +1449,7 @@ class Workflow(object):
         :return:
         """
 
-        with atomic():
+        with sharded_atomic(self.instance.shard_key), memoizing_conditions():
             course_instance = self.CourseHelpers.find_course(self.instance.courses.get(parent__isnull=True), path)
             if self.CourseHelpers.is_waiting(course_instance):
                 course_instance.clean()
@@ -881,9 +1466,10 @@ class Workflow(object):
                 except models.TransitionSpec.DoesNotExist:
                     raise exceptions.WorkflowCourseNodeTransitionDoesNotExist(node_spec, action_name)
                 # We clean the transition
-                transition.clean()
+                transition.clean(unique=False)
                 # And THEN we execute our picked transition
                 self.WorkflowRunner._run_transition(course_instance, transition, user)
+                self._refresh_status_version()
             else:
                 raise exceptions.WorkflowCourseInstanceNotWaiting(
                     course_instance, _('No action can be executed in the specified course instance because it is not '
@@ -898,7 +1484,7 @@ class Workflow(object):
         :return:
         """
 
-        with atomic():
+        with sharded_atomic(self.instance.shard_key), memoizing_conditions():
             try:
                 course_instance = self.CourseHelpers.find_course(self.instance.courses.get(parent__isnull=True), path)
             except models.CourseInstance.DoesNotExist:
@@ -923,26 +1509,115 @@ class Workflow(object):
             # Trigger the parent joiner, if any.
             if course_instance.parent:
                 course_instance.parent.clean()
-                parent_course_instance = course_instance.parent.course_instance
+                parent_course_instance = self.CourseHelpers.get_parent(course_instance)
                 parent_course_instance.clean()
                 self.WorkflowRunner._test_split_branch_reached(parent_course_instance, user, course_instance)
+            self._refresh_status_version()
 
-    def get_workflow_status(self):
+    def enqueue(self, user, action_name, path=''):
+        """
+        Enqueues an action, to be executed later (as execute() does) by the worker pool.
+        :param user: The user executing the action.
+        :param action_name: The name of the action (transition) to execute.
+        :param path: Optional path to a course in this instance.
+        :return: The queued action.
         """
-        Get the status of each course in the workflow.
+
+        return models.QueuedAction.objects.create(workflow_instance=self.instance, user=user,
+                                                  action_name=action_name, path=path)
+
+    def replay(self, as_of=None):
+        """
+        Gets the status of each course in the workflow as of a given date, rebuilt from the events
+          (only available for the events appended while the OUROBOROS_EVENT_SOURCING setting is True).
+        :param as_of: The date. If None, the current status is rebuilt.
+        :return: A dictionary like the one returned by get_workflow_status.
+        """
+
+        return events.statuses(compiled.get(self.instance.workflow_spec), events.replay(self.instance, as_of))
+
+    @classmethod
+    def fire_timers(cls, user, batch_size=100):
+        """
+        Runs a batch of due timer transitions, like execute() would run them. Each timer runs in its
+          own savepoint: timers failing with a workflow error are postponed, and timers whose course
+          is not waiting in their origin node anymore are discarded.
+        :param user: The user the timer transitions are run (and logged) as.
+        :param batch_size: The maximum number of timers to run (by shard, if sharding is configured).
+        :return: A timers.Batch tuple (fired, postponed, discarded, full) with the number of timers of
+          each outcome, and whether the batch of any shard was full (i.e. more timers may be due).
+        """
+
+        fired = postponed = discarded = 0
+        full = False
+        stamp = now()
+        for database in sharding.shards() or [None]:
+            with sharding.using(database), sharding.write_block(), atomic(using=database), \
+                    compiled.memoizing_generations():
+                due = timers.lock_due(stamp, batch_size)
+                full = full or len(due) >= batch_size
+                for timer in due:
+                    course_instance = timer.node_instance.course_instance
+                    transition = timer.transition_spec
+                    if timer.node_instance.node_spec_id != transition.origin_id:
+                        timer.delete()
+                        discarded += 1
+                        continue
+                    try:
+                        with atomic(using=database), memoizing_conditions():
+                            course_instance.clean()
+                            course_instance.course_spec.clean()
+                            transition.clean(unique=False)
+                            cls.WorkflowRunner._run_transition(course_instance, transition, user)
+                        fired += 1
+                    except (exceptions.WorkflowInvalidState, exceptions.WorkflowActionDenied,
+                            exceptions.WorkflowExecutionError, exceptions.WorkflowLookupError):
+                        timers.postpone(timer, stamp)
+                        postponed += 1
+        return timers.Batch(fired, postponed, discarded, full)
+
+    def _refresh_status_version(self):
+        # The instance may come from a replica, but the new version is only in the primary so far.
+        self.instance.refresh_from_db(using=router.db_for_write(models.WorkflowInstance, instance=self.instance),
+                                      fields=['status_version'])
+
+    def get_workflow_status(self, using=None):
+        """
+        Get the status of each course in the workflow. If the status cache is configured (by the
+          OUROBOROS_STATUS_CACHE setting), the status is served from the cache when available.
+        :param using: The database to read from (by default, the one the instance was read from).
         :return: A dictionary with 'course.path' => ('status', code), where code is the exit code
           (-1 for cancelled, >= 0 for exit, a node spec's code for waiting, and None for other statuses).
         """
 
+        return statuses.get_many([self.instance], lambda workflow_instance: self._compute_workflow_status(using))[0]
+
+    @classmethod
+    def get_workflow_statuses(cls, workflows, using=None):
+        """
+        Gets the status of many workflows at once (e.g. for list views). Cached statuses are retrieved
+          in a single cache lookup, and only the missing ones are computed.
+        :param workflows: An iterable of workflow wrappers.
+        :param using: The database to read from (by default, the ones the instances were read from).
+        :return: A list of dictionaries like the ones returned by get_workflow_status, in the same order.
+        """
+
+        workflows = list(workflows)
+        wrappers = {workflow.instance.pk: workflow for workflow in workflows}
+        return statuses.get_many([workflow.instance for workflow in workflows], lambda workflow_instance: (
+            wrappers[workflow_instance.pk]._compute_workflow_status(using)
+        ))
+
+    def _compute_workflow_status(self, using=None):
         self.instance.clean()
-        course_instance = self.instance.courses.get(parent__isnull=True)
+        course_instance = self.instance.courses.using(using).get(parent__isnull=True)
         result = {}
 
         def traverse_actions(course_instance, path=''):
             course_instance.clean()
             if self.CourseHelpers.is_splitting(course_instance):
                 result[path] = ('splitting', self.CourseHelpers.get_exit_code(course_instance))
-                for branch in course_instance.node_instance.branches.all():
+                for branch in self.CourseHelpers.get_branches(course_instance):
                     code = branch.course_spec.code
                     new_path = code if not path else "%s.%s" % (path, code)
                     traverse_actions(branch, new_path)
@@ -958,11 +1633,12 @@ class Workflow(object):
         traverse_actions(course_instance)
         return result
 
-    def get_workflow_available_actions(self, user):
+    def get_workflow_available_actions(self, user, using=None):
         """
         Get all the waiting courses metadata (including available actions) for the
           courses in this workflow for a specific user.
         :param: The given user.
+        :param using: The database to read from (by default, the one the instance was read from).
         :return: A dictionary with 'course.path' => {'display_name': _('Course Name'), 'actions': [{
             'action_name': 'list',
             'display_name': 'List'
@@ -979,7 +1655,7 @@ class Workflow(object):
         """
 
         self.instance.clean()
-        course_instance = self.instance.courses.get(parent__isnull=True)
+        course_instance = self.instance.courses.using(using).get(parent__isnull=True)
         result = {}
 
         def traverse_actions(course_instance, path=''):
@@ -988,7 +1664,7 @@ class Workflow(object):
                 # Splits do not have available actions on their own.
                 # They can only continue traversal on their children
                 #   branches.
-                for branch in course_instance.node_instance.branches.all():
+                for branch in self.CourseHelpers.get_branches(course_instance):
                     code = branch.course_spec.code
                     new_path = code if not path else "%s.%s" % (path, code)
                     traverse_actions(branch, new_path)
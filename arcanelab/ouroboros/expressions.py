@@ -0,0 +1,177 @@
+###################################################################################
+#                                                                                 #
+# Declarative conditions: structured data comparing document fields to constant  #
+#   values. They can be evaluated in memory on a loaded document (as any other    #
+#   condition) or be compiled to a Q object to filter or annotate querysets.      #
+#                                                                                 #
+# An expression is either a comparison like ["service_type", "=", "service"]      #
+#   (the field may span relations, like "area__head_id") or a combination like    #
+#   {"all": [...]}, {"any": [...]} or {"not": ...}.                               #
+#                                                                                 #
+###################################################################################
+
+from __future__ import unicode_literals
+from functools import reduce
+from django.db.models import Q
+from django.utils.six import string_types
+from .support import CallableReference
+import json
+import operator
+
+
+def _lookup(lookup, compare):
+    return lookup, lambda value, reference: value is not None and compare(value, reference)
+
+
+class Expression(object):
+    """
+    A declarative condition. Instances are immutable, hashable and callable with the same
+      signature of the callable conditions: (document, user).
+    """
+
+    OPERATORS = {
+        '=': ('exact', operator.eq),
+        '!=': ('exact', operator.eq),
+        '<': _lookup('lt', operator.lt),
+        '<=': _lookup('lte', operator.le),
+        '>': _lookup('gt', operator.gt),
+        '>=': _lookup('gte', operator.ge),
+        'in': ('in', lambda value, reference: value in reference),
+        'isnull': ('isnull', lambda value, reference: (value is None) == bool(reference)),
+    }
+    COMBINATORS = ('all', 'any', 'not')
+
+    def __init__(self, data):
+        """
+        Creates an expression, validating its structure.
+        :param data: The expression data (lists and dicts, as described in this module).
+        """
+
+        self._check(data)
+        self.data = data
+        self._text = json.dumps(data, sort_keys=True, separators=(',', ':'))
+
+    @classmethod
+    def _check(cls, data):
+        if isinstance(data, dict):
+            if len(data) != 1 or list(data)[0] not in cls.COMBINATORS:
+                raise ValueError('Combinations must have exactly one key among: %s' % ', '.join(cls.COMBINATORS))
+            key, value = list(data.items())[0]
+            if key == 'not':
+                cls._check(value)
+            elif not isinstance(value, list) or not value:
+                raise ValueError('"%s" combinations must have a non-empty list of expressions' % key)
+            else:
+                for item in value:
+                    cls._check(item)
+        elif isinstance(data, list):
+            if len(data) != 3 or not isinstance(data[0], string_types) or not data[0] or \
+                    data[1] not in cls.OPERATORS:
+                raise ValueError('Comparisons must be like [field, operator, value], with operator among: %s' %
+                                 ', '.join(sorted(cls.OPERATORS)))
+            if data[1] == 'in' and not isinstance(data[2], list):
+                raise ValueError('"in" comparisons must have a list of values')
+        else:
+            raise ValueError('Expressions must be comparisons (lists) or combinations (dicts)')
+
+    def dumps(self):
+        return self._text
+
+    def __eq__(self, other):
+        return isinstance(other, Expression) and self._text == other._text
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._text)
+
+    def __repr__(self):
+        return 'Expression(%s)' % self._text
+
+    @staticmethod
+    def _resolve(document, field):
+        value = document
+        for part in field.split('__'):
+            if value is None:
+                return None
+            value = getattr(value, part)
+        return value
+
+    def _evaluate(self, data, document):
+        if isinstance(data, dict):
+            key, value = list(data.items())[0]
+            if key == 'not':
+                return not self._evaluate(value, document)
+            elif key == 'all':
+                return all(self._evaluate(item, document) for item in value)
+            else:
+                return any(self._evaluate(item, document) for item in value)
+        field, operator_, reference = data
+        result = self.OPERATORS[operator_][1](self._resolve(document, field), reference)
+        return not result if operator_ == '!=' else result
+
+    def __call__(self, document, user=None):
+        """
+        Evaluates this expression in memory, against a loaded document.
+        :param document: The document to evaluate.
+        :param user: The user running the operation (ignored by expressions).
+        :return: The boolean result.
+        """
+
+        return self._evaluate(self.data, document)
+
+    def _q(self, data):
+        if isinstance(data, dict):
+            key, value = list(data.items())[0]
+            if key == 'not':
+                return ~self._q(value)
+            return reduce(operator.and_ if key == 'all' else operator.or_, [self._q(item) for item in value])
+        field, operator_, reference = data
+        q = Q(**{'%s__%s' % (field, self.OPERATORS[operator_][0]): reference})
+        return ~q if operator_ == '!=' else q
+
+    def as_q(self):
+        """
+        Compiles this expression to a Q object, to be used against a queryset of documents.
+        :return: A Q object.
+        """
+
+        return self._q(self.data)
+
+
+def parse(value):
+    """
+    Parses a condition: a callable reference (dotted path) or an expression (as data, or as
+      its json text).
+    :param value: The value to parse.
+    :return: A CallableReference, an Expression, or None.
+    """
+
+    if not value or isinstance(value, (CallableReference, Expression)):
+        return value or None
+    if isinstance(value, (list, dict)):
+        return Expression(value)
+    if value.lstrip()[:1] in ('[', '{'):
+        return Expression(json.loads(value))
+    return CallableReference(path=value)
+
+
+def dumps(condition):
+    """
+    Gets the text of a condition, to be stored.
+    :param condition: A CallableReference or an Expression.
+    :return: The dotted path or the json text, respectively.
+    """
+
+    return condition.path if isinstance(condition, CallableReference) else condition.dumps()
+
+
+def serialize(condition):
+    """
+    Gets the data of a condition, to be serialized in a spec.
+    :param condition: A CallableReference or an Expression.
+    :return: The dotted path or the expression data, respectively.
+    """
+
+    return condition.path if isinstance(condition, CallableReference) else condition.data
@@ -1,5 +1,7 @@
-from django.db.models.fields import CharField
+from django.core.exceptions import ValidationError
+from django.db.models.fields import CharField, TextField
 from .support import CallableReference
+from . import expressions
 
 
 class CallableReferenceField(CharField):
@@ -21,4 +23,24 @@ class CallableReferenceField(CharField):
         return value and CallableReference(path=value)
 
     def get_prep_value(self, value):
-        return value and value.path
\ No newline at end of file
+        return value and value.path
+
+
+class ConditionField(TextField):
+    """
+    It is like a textfield EXCEPT it handles conditions: references to callables (CallableReference)
+      or declarative expressions (Expression, stored as json).
+    """
+
+    def to_python(self, value):
+        try:
+            return expressions.parse(value)
+        except ValueError as error:
+            raise ValidationError(str(error), code='invalid')
+
+    def from_db_value(self, value, expression, connection, context):
+        return value and expressions.parse(value)
+
+    def get_prep_value(self, value):
+        value = self.to_python(value)
+        return value and expressions.dumps(value)
@@ -0,0 +1,30 @@
+from __future__ import unicode_literals
+from django.core.management.base import BaseCommand
+from arcanelab.ouroboros import archival
+
+
+class Command(BaseCommand):
+    """
+    Moves the logs of the workflow instances terminated long ago into the archive table, or into
+      a gzipped json-lines file.
+    """
+
+    help = 'Archives the course instance logs of terminated workflow instances'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90,
+                            help='Minimum age, in days, of the termination of the workflow instances')
+        parser.add_argument('--batch-size', type=int, default=500, help='Workflow instances by batch')
+        parser.add_argument('--file', default=None,
+                            help='A gzipped json-lines file to append the logs to, instead of the archive table')
+        parser.add_argument('--checkpoint', default=None,
+                            help='A file keeping the progress, so interrupted runs can be resumed')
+
+    def handle(self, *args, **options):
+        total = 0
+        for last, count in archival.archive(options['days'], options['batch_size'], options['file'],
+                                            options['checkpoint']):
+            total += count
+            if options['verbosity'] > 1:
+                self.stdout.write('Archived %d logs, up to workflow instance %d' % (count, last))
+        self.stdout.write('Archived %d logs' % total)
@@ -0,0 +1,31 @@
+from __future__ import unicode_literals
+from django.core.management.base import BaseCommand, CommandError
+from arcanelab.ouroboros import plans
+
+
+class Command(BaseCommand):
+    """
+    Prints the query plans and average timings of the lookups the runner repeats on every operation.
+      To compare them before and after the lookup indexes, run it, then `migrate ouroboros 0018`,
+      run it again, and `migrate ouroboros` back.
+    """
+
+    help = 'Prints the query plans and timings of the workflow runtime lookups'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help='Database to explain the lookups in')
+        parser.add_argument('--repeat', type=int, default=100, help='Runs of each lookup to average (0: no timing)')
+
+    def handle(self, *args, **options):
+        database = options['database']
+        for name, queryset in plans.lookups(database):
+            try:
+                plan = plans.explain(queryset, database)
+            except ValueError as error:
+                raise CommandError(error)
+            if options['repeat']:
+                self.stdout.write('%s: %.3f ms' % (name, plans.timing(queryset, database, options['repeat']) * 1000))
+            else:
+                self.stdout.write('%s:' % name)
+            for line in plan:
+                self.stdout.write('    %s' % line)
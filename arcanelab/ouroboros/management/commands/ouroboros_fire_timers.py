@@ -0,0 +1,43 @@
+from __future__ import unicode_literals
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from arcanelab.ouroboros.executors import Workflow
+import time
+
+
+class Command(BaseCommand):
+    """
+    Runs the due timer transitions, in batches, as the given user. By default, it exits once no timer
+      is due; with --interval, it keeps polling. Many instances of this command can run at once on
+      databases supporting SKIP LOCKED.
+    """
+
+    help = 'Runs the due timer transitions of the waiting courses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='Username of the user the transitions are run as')
+        parser.add_argument('--batch-size', type=int, default=100, help='Timers by batch')
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Seconds to wait between polls when no timer is due (0: exit instead)')
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        try:
+            user = User._default_manager.get_by_natural_key(options['username'])
+        except User.DoesNotExist:
+            raise CommandError('No user exists with username: %s' % options['username'])
+        total_fired = total_postponed = total_discarded = 0
+        while True:
+            fired, postponed, discarded, full = Workflow.fire_timers(user, options['batch_size'])
+            total_fired += fired
+            total_postponed += postponed
+            total_discarded += discarded
+            if (fired or postponed or discarded) and options['verbosity'] > 1:
+                self.stdout.write('Fired %d timers, postponed %d, discarded %d' % (fired, postponed, discarded))
+            # Postponed and discarded timers are not due anymore: only a full batch tells more may be due.
+            if not full:
+                if not options['interval']:
+                    break
+                time.sleep(options['interval'])
+        self.stdout.write('Fired %d timers, postponed %d, discarded %d' % (total_fired, total_postponed,
+                                                                           total_discarded))
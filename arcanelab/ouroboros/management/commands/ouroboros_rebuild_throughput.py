@@ -0,0 +1,27 @@
+from __future__ import unicode_literals
+from django.core.management.base import BaseCommand
+from arcanelab.ouroboros import metrics
+from arcanelab.ouroboros.executors import Workflow
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds the hourly throughput rollup from the course instance logs.
+    """
+
+    help = 'Rebuilds the hourly throughput rollup from the course instance logs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--spec', default=None, help='Code of the workflow spec to rebuild (default: all)')
+        parser.add_argument('--spec-version', type=int, default=None,
+                            help='Version of the workflow spec (default: the latest published one)')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Log ids by batch')
+
+    def handle(self, *args, **options):
+        workflow_spec = None
+        if options['spec']:
+            workflow_spec = Workflow.Spec.get(options['spec'], options['spec_version']).spec
+        for last in metrics.rebuild_throughput(workflow_spec, options['batch_size']):
+            if options['verbosity'] > 1:
+                self.stdout.write('Processed logs up to %d' % last)
+        self.stdout.write('Throughput rollup rebuilt')
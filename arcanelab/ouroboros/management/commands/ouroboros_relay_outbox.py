@@ -0,0 +1,34 @@
+from __future__ import unicode_literals
+from django.core.management.base import BaseCommand
+from arcanelab.ouroboros import outbox
+import time
+
+
+class Command(BaseCommand):
+    """
+    Publishes the pending outbox messages, in batches, to the configured sink (OUROBOROS_OUTBOX_SINK)
+      or the given one. By default, it exits once no message is pending; with --interval, it keeps
+      polling.
+    """
+
+    help = 'Publishes the pending workflow outbox messages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Messages by batch')
+        parser.add_argument('--sink', default=None, help='Dotted path of the sink class')
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Seconds to wait between polls when no message is pending (0: exit instead)')
+
+    def handle(self, *args, **options):
+        sink = outbox.get_sink(options['sink'])
+        total = 0
+        while True:
+            count = outbox.relay(sink, options['batch_size'])
+            total += count
+            if count and options['verbosity'] > 1:
+                self.stdout.write('Published %d messages' % count)
+            if not count:
+                if not options['interval']:
+                    break
+                time.sleep(options['interval'])
+        self.stdout.write('Published %d messages' % total)
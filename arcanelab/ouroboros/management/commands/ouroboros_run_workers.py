@@ -0,0 +1,47 @@
+from __future__ import unicode_literals
+from functools import partial
+from multiprocessing import Pool
+from django.core.management.base import BaseCommand
+from django.db import connections
+from arcanelab.ouroboros import compiled, workers
+import os
+
+
+class Command(BaseCommand):
+    """
+    Runs a pool of worker processes executing the queued actions, and reports the throughput of
+      each worker when they finish (i.e. when no action was pending for --idle seconds). Specs are
+      compiled (see compiled.warm_up) before forking, so the workers start with a warm cache.
+    """
+
+    help = 'Executes the queued workflow actions with a pool of worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of worker processes (1: run in this process)')
+        parser.add_argument('--batch-size', type=int, default=50, help='Workflow instances claimed by batch')
+        parser.add_argument('--idle', type=float, default=0,
+                            help='Seconds to keep polling while no action is pending, before finishing')
+
+    def handle(self, *args, **options):
+        compiled.warm_up()
+        names = ['%s-%d' % (os.getpid(), index) for index in range(options['workers'])]
+        run = partial(workers.run, batch_size=options['batch_size'], idle=options['idle'])
+        if options['workers'] == 1:
+            results = [run(names[0])]
+        else:
+            # Connections must not be shared with the forked workers.
+            connections.close_all()
+            pool = Pool(options['workers'])
+            try:
+                results = pool.map(run, names)
+            finally:
+                pool.close()
+                pool.join()
+        for stats in results:
+            rate = stats['actions'] / stats['elapsed'] if stats['elapsed'] else 0.0
+            self.stdout.write('Worker %s: %d actions (%d failed) on %d instances in %.2fs, %.1f actions/s' % (
+                stats['worker'], stats['actions'], stats['failed'], stats['instances'], stats['elapsed'], rate
+            ))
+        self.stdout.write('Executed %d actions (%d failed)' % (sum(stats['actions'] for stats in results),
+                                                               sum(stats['failed'] for stats in results)))
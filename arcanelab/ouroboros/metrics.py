@@ -0,0 +1,172 @@
+###################################################################################
+#                                                                                 #
+# Metrics computed from the course instance logs, e.g. how long the courses of a  #
+#   workflow spec stay in each node (dwell times), and an hourly rollup of how    #
+#   many courses entered and left each node (throughput), maintained on write.    #
+#                                                                                 #
+###################################################################################
+
+from __future__ import unicode_literals
+from itertools import groupby
+from operator import itemgetter
+from cantrips.iteration import items
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import Count, F, Max
+from django.db.models.functions import TruncHour
+from django.db.transaction import atomic
+from django.utils import timezone
+from . import models
+import math
+
+
+def _percentile(values, percentile):
+    return values[max(int(math.ceil(percentile / 100.0 * len(values))) - 1, 0)]
+
+
+def dwell_time_rows(workflow_spec, since=None):
+    """
+    Builds the query of dwell_times: the elapsed times of the logs leaving each node of a workflow
+      spec, by course code, node code and elapsed time. That is the order of the (previous node spec,
+      elapsed) index, so the database scans it node by node instead of sorting the rows.
+    :param workflow_spec: The workflow spec.
+    :param since: If given, only the nodes left since this date are considered.
+    :return: A queryset of (course code, node code, elapsed) tuples.
+    """
+
+    logs = models.CourseInstanceLog.objects.filter(
+        previous_node_spec__course_spec__workflow_spec=workflow_spec, elapsed__isnull=False
+    )
+    if since is not None:
+        logs = logs.filter(created_on__gte=since)
+    return logs.order_by('previous_node_spec__course_spec__code', 'previous_node_spec__code', 'elapsed').values_list(
+        'previous_node_spec__course_spec__code', 'previous_node_spec__code', 'elapsed'
+    )
+
+
+def dwell_times(workflow_spec, percentiles=(50, 90, 99), since=None):
+    """
+    Computes the dwell time percentiles of each node of a workflow spec (i.e. the times elapsed
+      between landing in the node and leaving it), in one query. Percentiles use the nearest-rank
+      method.
+
+    The percentiles are computed here, not in the database: every (matching) log of the spec is
+      read, although in index order and keeping the elapsed times of one node at a time. For specs
+      with large histories, pass `since` (or archive the old logs).
+    :param workflow_spec: The workflow spec.
+    :param percentiles: The percentiles to compute.
+    :param since: If given, only the nodes left since this date are considered.
+    :return: A dictionary of course code => node code => {'count': n, 'p<percentile>': timedelta, ...}.
+    """
+
+    result = {}
+    for (course_code, node_code), group in groupby(dwell_time_rows(workflow_spec, since).iterator(),
+                                                   itemgetter(0, 1)):
+        values = [row[2] for row in group]
+        stats = {'count': len(values)}
+        for percentile in percentiles:
+            stats['p%s' % percentile] = _percentile(values, percentile)
+        result.setdefault(course_code, {})[node_code] = stats
+    return result
+
+
+def rollup_enabled():
+    return getattr(settings, 'OUROBOROS_THROUGHPUT_ROLLUP', False)
+
+
+def bucket(stamp):
+    """
+    Gets the hourly bucket of a date (truncated in the current time zone, like TruncHour does).
+    :param stamp: The date.
+    :return: The start of its hour.
+    """
+
+    if timezone.is_aware(stamp):
+        stamp = timezone.localtime(stamp)
+    return stamp.replace(minute=0, second=0, microsecond=0)
+
+
+def _upsert(workflow_spec_id, node_spec_id, bucket_, entered=0, left=0):
+    rows = models.NodeThroughput.objects.filter(node_spec_id=node_spec_id, bucket=bucket_)
+    if rows.update(entered=F('entered') + entered, left=F('left') + left):
+        return
+    try:
+        with atomic():
+            models.NodeThroughput.objects.create(workflow_spec_id=workflow_spec_id, node_spec_id=node_spec_id,
+                                                 bucket=bucket_, entered=entered, left=left)
+    except IntegrityError:
+        # Another transaction created the row meanwhile.
+        rows.update(entered=F('entered') + entered, left=F('left') + left)
+
+
+def record_landings(workflow_spec_id, landings, stamp):
+    """
+    Updates the throughput rollup with landings happening at the same time: each landing enters a
+      node and, optionally, leaves the previous one.
+    :param workflow_spec_id: The id of the workflow spec of the nodes.
+    :param landings: An iterable of (node spec id, previous node spec id or None) pairs.
+    :param stamp: The date of the landings.
+    """
+
+    counts = {}
+    for node_spec_id, previous_node_spec_id in landings:
+        counts.setdefault(node_spec_id, [0, 0])[0] += 1
+        if previous_node_spec_id is not None:
+            counts.setdefault(previous_node_spec_id, [0, 0])[1] += 1
+    bucket_ = bucket(stamp)
+    for node_spec_id, (entered, left) in sorted(items(counts)):
+        _upsert(workflow_spec_id, node_spec_id, bucket_, entered, left)
+
+
+def rebuild_throughput(workflow_spec=None, batch_size=10000):
+    """
+    Rebuilds the throughput rollup from the logs, aggregating them by ranges of ids (so each batch
+      is aggregated in the database and only its buckets are kept in memory).
+    :param workflow_spec: If given, only the rows of this workflow spec are rebuilt.
+    :param batch_size: The size of the ranges of log ids.
+    :return: A generator of the last log id of each processed batch.
+    """
+
+    rollup = models.NodeThroughput.objects.all()
+    logs = models.CourseInstanceLog.objects.all()
+    if workflow_spec is not None:
+        rollup = rollup.filter(workflow_spec=workflow_spec)
+        logs = logs.filter(node_spec__course_spec__workflow_spec=workflow_spec)
+    # Rows maintained on write after this point are kept (they belong to newer logs). This is
+    #   still best run while the rollup is not being written.
+    with atomic():
+        last = logs.aggregate(last=Max('id'))['last'] or 0
+        rollup.delete()
+    for start in range(0, last, batch_size):
+        with atomic():
+            batch = logs.filter(id__gt=start, id__lte=start + batch_size).annotate(bucket=TruncHour('created_on'))
+            for field, column in (('node_spec', 'entered'), ('previous_node_spec', 'left')):
+                for workflow_spec_id, node_spec_id, bucket_, count in batch.filter(
+                    **{'%s__isnull' % field: False}
+                ).values_list('%s__course_spec__workflow_spec_id' % field, '%s_id' % field, 'bucket').annotate(
+                    count=Count('id')
+                ).order_by():
+                    _upsert(workflow_spec_id, node_spec_id, bucket_, **{column: count})
+        yield min(start + batch_size, last)
+
+
+def throughput(workflow_spec, since=None, until=None):
+    """
+    Gets how many courses entered and left each node of a workflow spec, by hour, from the rollup.
+    :param workflow_spec: The workflow spec.
+    :param since: If given, only the buckets starting since this date are retrieved.
+    :param until: If given, only the buckets starting before this date are retrieved.
+    :return: A dictionary of course code => node code => list of (bucket, entered, left), by bucket.
+    """
+
+    rows = models.NodeThroughput.objects.filter(workflow_spec=workflow_spec)
+    if since is not None:
+        rows = rows.filter(bucket__gte=since)
+    if until is not None:
+        rows = rows.filter(bucket__lt=until)
+    result = {}
+    for course_code, node_code, bucket_, entered, left in rows.order_by('bucket').values_list(
+        'node_spec__course_spec__code', 'node_spec__code', 'bucket', 'entered', 'left'
+    ):
+        result.setdefault(course_code, {}).setdefault(node_code, []).append((bucket_, entered, left))
+    return result
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 11:52
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ouroboros', '0005_auto_20160926_0057'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workflowspec',
+            name='digest',
+            field=models.CharField(blank=True, editable=False, help_text='Content hash of this version, computed when it is published', max_length=64, null=True, verbose_name='Digest'),
+        ),
+        migrations.AddField(
+            model_name='workflowspec',
+            name='published_on',
+            field=models.DateTimeField(blank=True, editable=False, help_text='Date and time this version was published. Published versions cannot be changed anymore', null=True, verbose_name='Published On'),
+        ),
+        migrations.AddField(
+            model_name='workflowspec',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False, help_text='Version number for this code', verbose_name='Version'),
+        ),
+        migrations.AlterField(
+            model_name='workflowspec',
+            name='code',
+            field=models.SlugField(help_text='Internal code (unique together with the version)', max_length=30, verbose_name='Code'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='workflowspec',
+            unique_together=set([('code', 'version')]),
+        ),
+    ]
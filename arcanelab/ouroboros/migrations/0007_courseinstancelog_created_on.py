@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 11:55
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ouroboros', '0006_workflowspec_versions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='courseinstancelog',
+            name='created_on',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
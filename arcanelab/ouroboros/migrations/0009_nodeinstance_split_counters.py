@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 12:17
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def count_split_branches(apps, schema_editor):
+    NodeInstance = apps.get_model('ouroboros', 'NodeInstance')
+    split_node_instances = NodeInstance.objects.filter(node_spec__type='split')
+    for node_instance in split_node_instances.annotate(
+        total=models.Count('branches'),
+        terminated=models.Sum(models.Case(
+            models.When(branches__node_instance__node_spec__type__in=('exit', 'cancel', 'joined'), then=1),
+            default=0, output_field=models.IntegerField()
+        ))
+    ).iterator():
+        NodeInstance.objects.filter(pk=node_instance.pk).update(branch_count=node_instance.total,
+                                                                terminated_count=node_instance.terminated or 0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ouroboros', '0008_workflowinstance_status_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='nodeinstance',
+            name='branch_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='nodeinstance',
+            name='terminated_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_split_branches, migrations.RunPython.noop),
+    ]
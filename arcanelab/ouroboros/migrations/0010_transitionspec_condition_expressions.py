@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 12:28
+from __future__ import unicode_literals
+
+import arcanelab.ouroboros.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ouroboros', '0009_nodeinstance_split_counters'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transitionspec',
+            name='condition',
+            field=arcanelab.ouroboros.fields.ConditionField(blank=True, help_text='A callable evaluating the condition, or a declarative expression over the document fields. Expected only for multiplexer nodes. The condition will evaluate with signature (document, user) and will return a value that will be treated as boolean.', null=True, verbose_name='Condition'),
+        ),
+    ]
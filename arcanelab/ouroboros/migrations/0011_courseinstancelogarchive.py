@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 12:37
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ouroboros', '0010_transitionspec_condition_expressions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourseInstanceLogArchive',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('log_id', models.IntegerField(editable=False)),
+                ('created_on', models.DateTimeField(editable=False)),
+                ('course_instance_id', models.IntegerField(editable=False)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='courseinstancelogarchive',
+            name='node_spec',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='ouroboros.NodeSpec'),
+        ),
+        migrations.AddField(
+            model_name='courseinstancelogarchive',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='courseinstancelogarchive',
+            name='workflow_instance',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_logs', to='ouroboros.WorkflowInstance'),
+        ),
+    ]
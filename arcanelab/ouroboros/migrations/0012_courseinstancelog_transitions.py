@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 12:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def link_previous_logs(apps, schema_editor):
+    CourseInstanceLog = apps.get_model('ouroboros', 'CourseInstanceLog')
+    previous = None
+    for log in CourseInstanceLog.objects.order_by('course_instance_id', 'id').only(
+        'id', 'course_instance_id', 'node_spec_id', 'created_on'
+    ).iterator():
+        if previous is not None and previous.course_instance_id == log.course_instance_id:
+            CourseInstanceLog.objects.filter(pk=log.pk).update(previous_node_spec_id=previous.node_spec_id,
+                                                               elapsed=log.created_on - previous.created_on)
+        previous = log
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ouroboros', '0011_courseinstancelogarchive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='courseinstancelog',
+            name='elapsed',
+            field=models.DurationField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='courseinstancelog',
+            name='previous_node_spec',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='ouroboros.NodeSpec'),
+        ),
+        migrations.AddField(
+            model_name='courseinstancelog',
+            name='transition_spec',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='ouroboros.TransitionSpec'),
+        ),
+        migrations.AlterIndexTogether(
+            name='courseinstancelog',
+            index_together=set([('previous_node_spec', 'created_on'), ('node_spec', 'created_on')]),
+        ),
+        migrations.RunPython(link_previous_logs, migrations.RunPython.noop),
+    ]
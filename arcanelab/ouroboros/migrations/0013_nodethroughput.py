@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 12:43
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ouroboros', '0012_courseinstancelog_transitions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NodeThroughput',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('entered', models.PositiveIntegerField(default=0)),
+                ('left', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='nodethroughput',
+            name='node_spec',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='ouroboros.NodeSpec'),
+        ),
+        migrations.AddField(
+            model_name='nodethroughput',
+            name='workflow_spec',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='ouroboros.WorkflowSpec'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='nodethroughput',
+            unique_together=set([('node_spec', 'bucket')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='nodethroughput',
+            index_together=set([('workflow_spec', 'bucket')]),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 12:46
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ouroboros', '0013_nodethroughput'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkflowEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sequence', models.PositiveIntegerField(editable=False)),
+                ('type', models.CharField(choices=[('course-created', 'Course Created'), ('node-entered', 'Node Entered'), ('course-terminated', 'Course Terminated')], editable=False, max_length=20)),
+                ('created_on', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+                ('course_instance_id', models.IntegerField(editable=False)),
+                ('parent_course_instance_id', models.IntegerField(editable=False, null=True)),
+                ('term_level', models.PositiveIntegerField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WorkflowSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sequence', models.PositiveIntegerField(editable=False)),
+                ('created_on', models.DateTimeField(editable=False)),
+                ('state', models.TextField(editable=False)),
+                ('workflow_instance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='ouroboros.WorkflowInstance')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='workflowevent',
+            name='course_spec',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='ouroboros.CourseSpec'),
+        ),
+        migrations.AddField(
+            model_name='workflowevent',
+            name='node_spec',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='ouroboros.NodeSpec'),
+        ),
+        migrations.AddField(
+            model_name='workflowevent',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='workflowevent',
+            name='workflow_instance',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='ouroboros.WorkflowInstance'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='workflowsnapshot',
+            unique_together=set([('workflow_instance', 'sequence')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='workflowevent',
+            unique_together=set([('workflow_instance', 'sequence')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='workflowevent',
+            index_together=set([('workflow_instance', 'created_on')]),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 12:50
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ouroboros', '0014_workflow_events'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_on', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+                ('workflow_instance_id', models.IntegerField(editable=False)),
+                ('payload', models.TextField(editable=False)),
+                ('published_on', models.DateTimeField(blank=True, db_index=True, editable=False, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 12:56
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ouroboros', '0015_outbox_messages'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NodeTimer',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('due_on', models.DateTimeField(db_index=True)),
+                ('node_instance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timers', to='ouroboros.NodeInstance')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='transitionspec',
+            name='timeout',
+            field=models.DurationField(blank=True, help_text='If set, this transition runs automatically once a course waited this long in the origin node. Only allowed for input nodes', null=True, verbose_name='Timeout'),
+        ),
+        migrations.AddField(
+            model_name='nodetimer',
+            name='transition_spec',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='ouroboros.TransitionSpec'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='nodetimer',
+            unique_together=set([('node_instance', 'transition_spec')]),
+        ),
+    ]
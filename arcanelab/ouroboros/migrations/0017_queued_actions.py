@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 13:01
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ouroboros', '0016_node_timers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueuedAction',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action_name', models.SlugField(max_length=30)),
+                ('path', models.CharField(blank=True, default='', max_length=255)),
+                ('created_on', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('claimed', 'Claimed'), ('done', 'Done'), ('failed', 'Failed')], default='pending', editable=False, max_length=10)),
+                ('worker', models.CharField(blank=True, editable=False, max_length=100, null=True)),
+                ('claimed_on', models.DateTimeField(blank=True, editable=False, null=True)),
+                ('processed_on', models.DateTimeField(blank=True, editable=False, null=True)),
+                ('error', models.TextField(blank=True, editable=False, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('workflow_instance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='queued_actions', to='ouroboros.WorkflowInstance')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='queuedaction',
+            index_together=set([('status', 'claimed_on'), ('status', 'id')]),
+        ),
+    ]
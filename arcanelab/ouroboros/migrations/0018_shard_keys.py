@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 13:10
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def fill_shard_keys(apps, schema_editor):
+    # Existing instances get the default shard key: the code of their workflow spec.
+    WorkflowSpec = apps.get_model('ouroboros', 'WorkflowSpec')
+    for id_, code in WorkflowSpec.objects.values_list('id', 'code').iterator():
+        apps.get_model('ouroboros', 'WorkflowInstance').objects.filter(workflow_spec_id=id_).update(shard_key=code)
+        apps.get_model('ouroboros', 'CourseInstance').objects.filter(
+            workflow_instance__workflow_spec_id=id_
+        ).update(shard_key=code)
+        apps.get_model('ouroboros', 'NodeInstance').objects.filter(
+            course_instance__workflow_instance__workflow_spec_id=id_
+        ).update(shard_key=code)
+        apps.get_model('ouroboros', 'CourseInstanceLog').objects.filter(
+            course_instance__workflow_instance__workflow_spec_id=id_
+        ).update(shard_key=code)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ouroboros', '0017_queued_actions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='courseinstance',
+            name='shard_key',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='courseinstancelog',
+            name='shard_key',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='nodeinstance',
+            name='shard_key',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='workflowinstance',
+            name='shard_key',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+        migrations.RunPython(fill_shard_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 13:16
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+ROOT_COURSES_INDEX = 'ouroboros_courseinstance_root'
+ACTION_NAMES_INDEX = 'ouroboros_transitionspec_action'
+# Where the root courses index is UNIQUE (see models.ROOT_COURSES_VENDORS).
+ROOT_COURSES_VENDORS = ('postgresql',)
+
+
+def _columns(apps, model_name, *field_names):
+    opts = apps.get_model('ouroboros', model_name)._meta
+    return opts.db_table, [opts.get_field(field_name).column for field_name in field_names]
+
+
+def create_unique_indexes(apps, schema_editor):
+    quote, vendor = schema_editor.quote_name, schema_editor.connection.vendor
+    table, (workflow_instance, parent) = _columns(apps, 'CourseInstance', 'workflow_instance', 'parent')
+    if vendor in ('postgresql', 'sqlite'):
+        # At most one root course by workflow instance. It can only be UNIQUE where Django's CASCADE
+        #   deletes the branches of a split node instance directly: on SQLite (which cannot defer
+        #   constraint checks) it sets their nullable `parent` to NULL first, briefly turning them
+        #   into extra roots. On PostgreSQL CASCADE does not null `parent`, so the (non deferrable)
+        #   UNIQUE index never sees those rows.
+        unique = 'UNIQUE ' if vendor in ROOT_COURSES_VENDORS else ''
+        schema_editor.execute('CREATE %sINDEX %s ON %s (%s) WHERE %s IS NULL' % (
+            unique, quote(ROOT_COURSES_INDEX), quote(table), quote(workflow_instance), quote(parent)
+        ))
+    else:
+        # No partial indexes here: a composite one serves the lookup, without enforcing it.
+        schema_editor.execute('CREATE INDEX %s ON %s (%s, %s)' % (
+            quote(ROOT_COURSES_INDEX), quote(table), quote(workflow_instance), quote(parent)
+        ))
+    table, (origin, action_name) = _columns(apps, 'TransitionSpec', 'origin', 'action_name')
+    # Transitions without action name (NULL) must not collide, which is not the case everywhere.
+    unique = 'UNIQUE ' if vendor in ('postgresql', 'sqlite', 'mysql') else ''
+    schema_editor.execute('CREATE %sINDEX %s ON %s (%s, %s)' % (
+        unique, quote(ACTION_NAMES_INDEX), quote(table), quote(origin), quote(action_name)
+    ))
+
+
+def drop_unique_indexes(apps, schema_editor):
+    quote = schema_editor.quote_name
+    for model_name, index in (('CourseInstance', ROOT_COURSES_INDEX), ('TransitionSpec', ACTION_NAMES_INDEX)):
+        if schema_editor.connection.vendor == 'mysql':
+            schema_editor.execute('DROP INDEX %s ON %s' % (quote(index), quote(_columns(apps, model_name)[0])))
+        else:
+            schema_editor.execute('DROP INDEX %s' % quote(index))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ouroboros', '0018_shard_keys'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='courseinstance',
+            index_together=set([('parent', 'course_spec')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='nodespec',
+            index_together=set([('course_spec', 'type')]),
+        ),
+        migrations.RunPython(create_unique_indexes, drop_unique_indexes),
+    ]
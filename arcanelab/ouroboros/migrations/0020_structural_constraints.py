@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 13:27
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+BRANCHES_INDEX = 'ouroboros_courseinstance_branch'
+PRIORITIES_INDEX = 'ouroboros_transitionspec_priority'
+TERMINATED_CHECK = 'ouroboros_nodeinstance_terminated'
+# NULL values never collide in unique indexes there.
+UNIQUE_KEYS_VENDORS = ('postgresql', 'sqlite', 'mysql')
+# SQLite cannot add constraints to existing tables.
+CHECK_VENDORS = ('postgresql', 'mysql')
+
+
+def _columns(apps, model_name, *field_names):
+    opts = apps.get_model('ouroboros', model_name)._meta
+    return opts.db_table, [opts.get_field(field_name).column for field_name in field_names]
+
+
+def create_constraints(apps, schema_editor):
+    quote, vendor = schema_editor.quote_name, schema_editor.connection.vendor
+    unique = 'UNIQUE ' if vendor in UNIQUE_KEYS_VENDORS else ''
+    # Branches of a split node instance: one by course. This index replaces the one in index_together.
+    table, (parent, course_spec) = _columns(apps, 'CourseInstance', 'parent', 'course_spec')
+    schema_editor.execute('CREATE %sINDEX %s ON %s (%s, %s)' % (
+        unique, quote(BRANCHES_INDEX), quote(table), quote(parent), quote(course_spec)
+    ))
+    if unique:
+        # Priorities of the outbounds of a multiplexer node (NULL for the other nodes).
+        table, (origin, priority) = _columns(apps, 'TransitionSpec', 'origin', 'priority')
+        schema_editor.execute('CREATE UNIQUE INDEX %s ON %s (%s, %s)' % (
+            quote(PRIORITIES_INDEX), quote(table), quote(origin), quote(priority)
+        ))
+    if vendor in CHECK_VENDORS:
+        table, (terminated_count, branch_count) = _columns(apps, 'NodeInstance', 'terminated_count', 'branch_count')
+        schema_editor.execute('ALTER TABLE %s ADD CONSTRAINT %s CHECK (%s <= %s)' % (
+            quote(table), quote(TERMINATED_CHECK), quote(terminated_count), quote(branch_count)
+        ))
+
+
+def drop_constraints(apps, schema_editor):
+    quote, vendor = schema_editor.quote_name, schema_editor.connection.vendor
+    indexes = [('CourseInstance', BRANCHES_INDEX)]
+    if vendor in UNIQUE_KEYS_VENDORS:
+        indexes.append(('TransitionSpec', PRIORITIES_INDEX))
+    for model_name, index in indexes:
+        if vendor == 'mysql':
+            schema_editor.execute('DROP INDEX %s ON %s' % (quote(index), quote(_columns(apps, model_name)[0])))
+        else:
+            schema_editor.execute('DROP INDEX %s' % quote(index))
+    if vendor in CHECK_VENDORS:
+        schema_editor.execute('ALTER TABLE %s DROP %s %s' % (
+            quote(_columns(apps, 'NodeInstance')[0]), 'CHECK' if vendor == 'mysql' else 'CONSTRAINT',
+            quote(TERMINATED_CHECK)
+        ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ouroboros', '0019_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='courseinstance',
+            index_together=set([]),
+        ),
+        migrations.RunPython(create_constraints, drop_constraints),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 16:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ouroboros', '0020_structural_constraints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='courseinstancelogarchive',
+            name='elapsed',
+            field=models.DurationField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='courseinstancelogarchive',
+            name='previous_node_spec',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='ouroboros.NodeSpec'),
+        ),
+        migrations.AddField(
+            model_name='courseinstancelogarchive',
+            name='shard_key',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='courseinstancelogarchive',
+            name='transition_spec',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='ouroboros.TransitionSpec'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 16:40
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ouroboros', '0021_courseinstancelogarchive_transitions'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='courseinstancelog',
+            index_together=set([('previous_node_spec', 'created_on'), ('node_spec', 'created_on'), ('previous_node_spec', 'elapsed')]),
+        ),
+    ]
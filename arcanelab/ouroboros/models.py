@@ -1,11 +1,15 @@
 from __future__ import unicode_literals
 from cantrips.iteration import items
-from django.contrib.contenttypes.fields import GenericForeignKey
-from django.db import models
+from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
+from django.core import checks
+from django.db import connections, models, router, IntegrityError
+from django.db.transaction import atomic
 from django.core.exceptions import ValidationError, ObjectDoesNotExist
 from django.utils.translation import ugettext_lazy as _
 from django.contrib.contenttypes.models import ContentType
 from django.conf import settings
+from django.utils.six import get_unbound_function, text_type
+from django.utils.timezone import now
 from grimoire.django.tracked.models import TrackedLive
 from . import exceptions, fields
 
@@ -27,17 +31,111 @@ def valid_document_type(value):
 
 class Document(models.Model):
     """
-    Base class for any model accepting a workflow
+    Base class for any model accepting a workflow.
+
+    The reverse generic relation allows prefetching the workflow instances (and their
+      courses) from document querysets, e.g. `.prefetch_related('workflow_instances')`.
+      Deleting a document also deletes its workflow instance.
     """
 
+    workflow_instances = GenericRelation('ouroboros.WorkflowInstance')
+
     class Meta:
         abstract = True
 
 
 class WorkflowManager(models.Manager):
 
-    def get_by_natural_key(self, code):
-        return self.get(code=code)
+    def get_by_natural_key(self, code, version):
+        return self.get(code=code, version=version)
+
+    def get_latest_version(self, code, published=True):
+        """
+        Gets the latest version of a workflow spec, given its code.
+        :param code: The code of the workflow spec.
+        :param published: If True [default], only published versions are considered.
+        :return: The workflow spec with the greatest version number.
+        """
+
+        queryset = self.filter(code=code)
+        if published:
+            queryset = queryset.filter(published_on__isnull=False)
+        return queryset.latest('version')
+
+
+# Invariants the migrations turn into database constraints, and the database vendors enforcing them. There,
+#   the verifiers issue no query: the integrity errors are mapped to the same exceptions instead.
+ROOT_COURSES_INDEX = 'ouroboros_courseinstance_root'
+BRANCHES_INDEX = 'ouroboros_courseinstance_branch'
+ROOT_COURSES_VENDORS = ('postgresql',)
+UNIQUE_KEYS_VENDORS = ('postgresql', 'sqlite', 'mysql')
+
+
+def enforced_by_database(instance, vendors):
+    """
+    Tells whether the database an instance is written to enforces an invariant.
+    :param instance: The model instance.
+    :param vendors: The database vendors enforcing the invariant.
+    :return: A boolean.
+    """
+
+    return connections[router.db_for_write(type(instance), instance=instance)].vendor in vendors
+
+
+def violates(error, index, *columns):
+    """
+    Tells whether an integrity error comes from a given unique index. PostgreSQL and MySQL report the
+      index name, while SQLite reports the columns.
+    :param error: The integrity error.
+    :param index: The index name.
+    :param columns: The columns of the index.
+    :return: A boolean.
+    """
+
+    message = text_type(error)
+    return index in message or bool(columns) and all(column in message for column in columns)
+
+
+class SpecPart(object):
+    """
+    A mix-in for models being part of a workflow spec. Parts of published
+      workflow specs cannot be saved or deleted.
+
+    Models using it must override _part_of (this is verified by the system checks).
+    """
+
+    def _part_of(self):
+        """
+        Abstract: gets the workflow spec this object is part of.
+        :return: The workflow spec.
+        :raise ObjectDoesNotExist: When the object is not (yet) part of a workflow spec.
+        """
+
+        raise NotImplementedError
+
+    @classmethod
+    def check(cls, **kwargs):
+        errors = super(SpecPart, cls).check(**kwargs)
+        if get_unbound_function(cls._part_of) is get_unbound_function(SpecPart._part_of):
+            errors.append(checks.Error('%s must override _part_of' % cls.__name__, obj=cls,
+                                       id='ouroboros.E001'))
+        return errors
+
+    def verify_unpublished(self):
+        try:
+            workflow_spec = self._part_of()
+        except ObjectDoesNotExist:
+            return
+        if workflow_spec.published_on:
+            raise exceptions.WorkflowSpecIsPublished(self, _('Published workflow specs cannot be changed'))
+
+    def save(self, *args, **kwargs):
+        self.verify_unpublished()
+        return super(SpecPart, self).save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        self.verify_unpublished()
+        return super(SpecPart, self).delete(*args, **kwargs)
 
 
 class Described(models.Model):
@@ -64,16 +162,26 @@ class Described(models.Model):
         abstract = True
 
 
-class WorkflowSpec(Described):
+class WorkflowSpec(SpecPart, Described):
     """
     Workflow class. Defines itself, and the document type it can associate to.
+
+    Many versions of the same workflow spec (i.e. with the same code) may exist. Once
+      a version is published, it becomes immutable and gets a content digest.
     """
 
     document_type = models.ForeignKey(ContentType, null=False, blank=False, on_delete=models.CASCADE,
                                       validators=[valid_document_type], verbose_name=_('Document Type'),
                                       help_text=_('Accepted related document class'))
-    code = models.SlugField(max_length=30, null=False, blank=False, unique=True, verbose_name=_('Code'),
-                            help_text=_('Internal (unique) code'))
+    code = models.SlugField(max_length=30, null=False, blank=False, verbose_name=_('Code'),
+                            help_text=_('Internal code (unique together with the version)'))
+    version = models.PositiveIntegerField(default=1, null=False, blank=False, editable=False,
+                                          verbose_name=_('Version'), help_text=_('Version number for this code'))
+    published_on = models.DateTimeField(null=True, blank=True, editable=False, verbose_name=_('Published On'),
+                                        help_text=_('Date and time this version was published. Published versions '
+                                                    'cannot be changed anymore'))
+    digest = models.CharField(max_length=64, null=True, blank=True, editable=False, verbose_name=_('Digest'),
+                              help_text=_('Content hash of this version, computed when it is published'))
     create_permission = models.CharField(max_length=201, blank=True, null=True, verbose_name=_('Create Permission'),
                                          help_text=_('Permission code (as <application>.<permission>) to test against '
                                                      'when a workflow instance is created. The user who intends to '
@@ -87,7 +195,18 @@ class WorkflowSpec(Described):
     objects = WorkflowManager()
 
     def natural_key(self):
-        return self.code
+        return self.code, self.version
+
+    def _part_of(self):
+        # We check the stored state, since publishing is the only change we allow
+        #   and it is never performed by .save().
+        if not self.pk:
+            raise WorkflowSpec.DoesNotExist
+        return WorkflowSpec.objects.only('published_on').get(pk=self.pk)
+
+    def delete(self, *args, **kwargs):
+        # Whole versions can be deleted (e.g. when no instance references them).
+        return super(SpecPart, self).delete(*args, **kwargs)
 
     def verify_exactly_one_parent_course(self):
         """
@@ -154,15 +273,16 @@ class WorkflowSpec(Described):
         abstract = False
         verbose_name = _('Workflow Spec')
         verbose_name_plural = _('Workflow Specs')
+        unique_together = (('code', 'version'),)
 
 
 class CourseManager(models.Manager):
 
-    def get_by_natural_key(self, wf_code, code):
-        return self.get(workflow_spec__code=wf_code, code=code)
+    def get_by_natural_key(self, wf_code, wf_version, code):
+        return self.get(workflow_spec__code=wf_code, workflow_spec__version=wf_version, code=code)
 
 
-class CourseSpec(Described):
+class CourseSpec(SpecPart, Described):
     """
     Workflow action course.
     """
@@ -180,7 +300,11 @@ class CourseSpec(Described):
     objects = CourseManager()
 
     def natural_key(self):
-        return self.workflow.code, self.code
+        return self.workflow_spec.natural_key() + (self.code,)
+    natural_key.dependencies = ['ouroboros.workflowspec']
+
+    def _part_of(self):
+        return self.workflow_spec
 
     def _verify_has_node_of_type(self, node_type, msg):
         try:
@@ -348,7 +472,7 @@ class CourseSpec(Described):
         unique_together = (('workflow_spec', 'code'),)
 
 
-class NodeSpec(Described):
+class NodeSpec(SpecPart, Described):
     """
     Workflow action course node.
     """
@@ -411,6 +535,9 @@ class NodeSpec(Described):
     branches = models.ManyToManyField(CourseSpec, blank=True, related_name='callers', verbose_name=_('Branches'),
                                       help_text=_('Courses this node branches to. Expected only for split nodes'))
 
+    def _part_of(self):
+        return self.course_spec.workflow_spec
+
     def verify_node_has_no_inbounds(self):
         exceptions.ensure(lambda obj: not obj.inbounds.exists(), self, _('This node must not have inbounds'),
                           exceptions.WorkflowCourseNodeHasInbounds)
@@ -542,6 +669,8 @@ class NodeSpec(Described):
         verbose_name = _('Node')
         verbose_name_plural = _('Nodes')
         unique_together = (('course_spec', 'code'),)
+        # The runner looks nodes up by type (e.g. the ENTER node of a course).
+        index_together = (('course_spec', 'type'),)
 
 
 def valid_origin_types(obj):
@@ -560,7 +689,7 @@ def valid_destination_types(obj):
         pass
 
 
-class TransitionSpec(Described):
+class TransitionSpec(SpecPart, Described):
     """
     Workflow transition.
     """
@@ -579,14 +708,22 @@ class TransitionSpec(Described):
                                   help_text=_('Permission code (as <application>.<permission>) to test against. It is '
                                               'not required, but only allowed if coming from an input node'))
     # These fields are only allowed for multiplexer
-    condition = fields.CallableReferenceField(blank=True, null=True, verbose_name=_('Condition'),
-                                              help_text=_('A callable evaluating the condition. Expected only for '
-                                                          'multiplexer nodes. The condition will evaluate with '
-                                                          'signature (document, user) and will return a value that '
-                                                          'will be treated as boolean.'))
+    condition = fields.ConditionField(blank=True, null=True, verbose_name=_('Condition'),
+                                      help_text=_('A callable evaluating the condition, or a declarative '
+                                                  'expression over the document fields. Expected only for '
+                                                  'multiplexer nodes. The condition will evaluate with '
+                                                  'signature (document, user) and will return a value that '
+                                                  'will be treated as boolean.'))
     priority = models.PositiveSmallIntegerField(blank=True, null=True, verbose_name=_('Priority'),
                                                 help_text=_('A priority value used to order evaluation of condition. '
                                                             'Expected only for multiplexer nodes'))
+    # These fields are only allowed for input
+    timeout = models.DurationField(blank=True, null=True, verbose_name=_('Timeout'),
+                                   help_text=_('If set, this transition runs automatically once a course waited '
+                                               'this long in the origin node. Only allowed for input nodes'))
+
+    def _part_of(self):
+        return self.origin.course_spec.workflow_spec
 
     def verify_consistency(self):
         exceptions.ensure(lambda obj: obj.origin.course_spec == obj.destination.course_spec, self,
@@ -594,51 +731,80 @@ class TransitionSpec(Described):
                           exceptions.WorkflowCourseTransitionInconsistent)
 
     def verify_unique_priority(self):
-        if self.origin.outbounds.exclude(pk=self.pk).filter(priority=self.priority).exists():
+        if self.priority is not None and \
+                self.origin.outbounds.exclude(pk=self.pk).filter(priority=self.priority).exists():
             raise exceptions.WorkflowCourseTransitionPriorityNotUnique(
                 self, {'priority': [_('This field must be unique among transitions in multiplexer nodes.')]}
             )
 
     def verify_unique_action_name(self):
-        if self.origin.outbounds.exclude(pk=self.pk).filter(action_name=self.action_name).exists():
+        if self.action_name and self.origin.outbounds.exclude(pk=self.pk).filter(action_name=self.action_name).exists():
             raise exceptions.WorkflowCourseTransitionActionNameNotUnique(
                 self, {'action_name': [_('This field must be unique among transitions in multiplexer nodes.')]}
             )
 
+    def save(self, *args, **kwargs):
+        # Action names and priorities are unique by origin in the database as well: a violation is
+        #   reported like the validation does (the savepoint keeps the transaction usable to check it).
+        try:
+            with atomic(using=kwargs.get('using') or router.db_for_write(type(self), instance=self)):
+                return super(TransitionSpec, self).save(*args, **kwargs)
+        except IntegrityError:
+            self.verify_unique_action_name()
+            self.verify_unique_priority()
+            raise
+
+    def verify_unique_keys(self, verifier, unique):
+        # Only saved transitions can be checked by the database, and only callers not relying on the
+        #   validation (e.g. forms) may skip it.
+        if unique or not self.pk or not enforced_by_database(self, UNIQUE_KEYS_VENDORS):
+            verifier()
+
+    def verify_positive_timeout(self):
+        if self.timeout is not None and self.timeout.total_seconds() <= 0:
+            raise exceptions.WorkflowCourseTransitionTimeoutNotPositive(
+                self, {'timeout': [_('This field must be a positive duration.')]}
+            )
+
     def verify_enter_origin(self):
         exceptions.ensure_field('condition', self, True, True)
         exceptions.ensure_field('priority', self, True, True)
+        exceptions.ensure_field('timeout', self, True, True)
         exceptions.ensure_field('action_name', self, True, True)
         # permission is allowed here, but not required
 
-    def verify_split_origin(self):
+    def verify_split_origin(self, unique=True):
         exceptions.ensure_field('condition', self, True, True)
         exceptions.ensure_field('priority', self, True, True)
+        exceptions.ensure_field('timeout', self, True, True)
         exceptions.ensure_field('action_name', self)
         exceptions.ensure_field('permission', self, True, True)
-        self.verify_unique_action_name()
+        self.verify_unique_keys(self.verify_unique_action_name, unique)
 
     def verify_step_origin(self):
         exceptions.ensure_field('condition', self, True, True)
         exceptions.ensure_field('priority', self, True, True)
+        exceptions.ensure_field('timeout', self, True, True)
         exceptions.ensure_field('action_name', self, True, True)
         exceptions.ensure_field('permission', self, True, True)
 
-    def verify_multiplexer_origin(self):
+    def verify_multiplexer_origin(self, unique=True):
         exceptions.ensure_field('condition', self)
         exceptions.ensure_field('priority', self, False, None)
+        exceptions.ensure_field('timeout', self, True, True)
         exceptions.ensure_field('action_name', self, True, True)
         exceptions.ensure_field('permission', self, True, True)
-        self.verify_unique_priority()
+        self.verify_unique_keys(self.verify_unique_priority, unique)
 
-    def verify_input_origin(self):
+    def verify_input_origin(self, unique=True):
         exceptions.ensure_field('condition', self, True, True)
         exceptions.ensure_field('priority', self, True, True)
         exceptions.ensure_field('action_name', self)
         # permission is allowed here, but not required
-        self.verify_unique_action_name()
+        self.verify_unique_keys(self.verify_unique_action_name, unique)
+        self.verify_positive_timeout()
 
-    def clean(self):
+    def clean(self, unique=True):
         """
         Transitions must validate:
         - origin and destination must have the same action course.
@@ -646,7 +812,10 @@ class TransitionSpec(Described):
         - action_name must be present for input and split origins, but absent for any other origin.
         - action_name must be unique for given origin for input and split origins.
         - permission can be present only for input and split origins.
+        - timeout can be present (and positive) only for input origins.
         - priority must be unique for given origin for multiplexer nodes.
+        The runner passes unique=False to skip the uniqueness queries where the database enforces it
+          (see save()), since its transitions are already saved.
         """
 
         self.verify_consistency()
@@ -656,16 +825,18 @@ class TransitionSpec(Described):
             if self.origin.type == NodeSpec.STEP:
                 self.verify_step_origin()
             if self.origin.type == NodeSpec.MULTIPLEXER:
-                self.verify_multiplexer_origin()
+                self.verify_multiplexer_origin(unique)
             if self.origin.type == NodeSpec.INPUT:
-                self.verify_input_origin()
+                self.verify_input_origin(unique)
             if self.origin.type == NodeSpec.SPLIT:
-                self.verify_split_origin()
+                self.verify_split_origin(unique)
 
     class Meta:
         abstract = False
         verbose_name = _('Transition Spec')
         verbose_name_plural = _('Transition Specs')
+        # (origin, action_name) and (origin, priority) are also unique in the database (see the
+        #   migrations and save()).
 
 
 ####################################################
@@ -680,6 +851,11 @@ class WorkflowInstance(TrackedLive):
     content_type = models.ForeignKey(ContentType, blank=False, null=False, on_delete=models.CASCADE)
     object_id = models.PositiveIntegerField(blank=False, null=False)
     document = GenericForeignKey('content_type', 'object_id')
+    # Bumped each time a node instance is persisted for this workflow instance. Cached statuses
+    #   are keyed by it, so they never need to be explicitly invalidated.
+    status_version = models.PositiveIntegerField(default=0, null=False, editable=False)
+    # Routes (or partitions) the rows of this instance. See the sharding module.
+    shard_key = models.CharField(max_length=64, default='', blank=True, editable=False)
 
     def verify_accepts_document(self):
         try:
@@ -710,10 +886,11 @@ class WorkflowInstance(TrackedLive):
     def clean(self, keep=True):
         """
         content_type must match workflow's expected content_type
+        there must be at most one main course (checked by the database where it is enforced there)
         """
 
         self.verify_accepts_document()
-        if self.pk:
+        if self.pk and not enforced_by_database(self, ROOT_COURSES_VENDORS):
             self.verify_at_most_one_parent_course()
 
     class Meta:
@@ -735,6 +912,8 @@ class CourseInstance(TrackedLive):
     parent = models.ForeignKey('NodeInstance', related_name='branches', null=True, blank=True, on_delete=models.CASCADE)
     course_spec = models.ForeignKey(CourseSpec, null=False, blank=False, on_delete=models.CASCADE)
     term_level = models.PositiveIntegerField(null=True, blank=True)
+    # Denormalized from the workflow instance, to route (or partition) the rows by it.
+    shard_key = models.CharField(max_length=64, default='', blank=True, editable=False)
 
     def verify_consistency(self):
         exceptions.ensure(lambda obj: obj.course_spec.workflow_spec == obj.workflow_instance.workflow_spec, self,
@@ -756,6 +935,25 @@ class CourseInstance(TrackedLive):
 
         self.verify_consistency()
 
+    def save(self, *args, **kwargs):
+        # Root courses (by workflow instance) and branches (by parent and course) are unique in the
+        #   database, where supported (see the migrations): violations are reported like the
+        #   verifiers do.
+        try:
+            return super(CourseInstance, self).save(*args, **kwargs)
+        except IntegrityError as error:
+            if self.parent_id is None and violates(error, ROOT_COURSES_INDEX):
+                raise exceptions.WorkflowInstanceHasMultipleMainCourses(
+                    self.workflow_instance, _('Multiple main courses are present for the workflow instance '
+                                              '(expected one)')
+                )
+            if self.parent_id is not None and violates(error, BRANCHES_INDEX, 'parent_id', 'course_spec_id'):
+                raise exceptions.WorkflowCourseNodeInstanceIncompleteSplitBranchReferences(
+                    self.parent, _('This split node does not have children biunivocally referencing the branches '
+                                   'in the split node spec')
+                )
+            raise
+
 
 class NodeInstance(TrackedLive):
     """
@@ -767,6 +965,11 @@ class NodeInstance(TrackedLive):
 
     course_instance = models.OneToOneField(CourseInstance, related_name='node_instance', null=False, blank=False)
     node_spec = models.ForeignKey(NodeSpec, related_name='+', null=False, blank=False, on_delete=models.PROTECT)
+    # For SPLIT nodes: how many branches were created, and how many of them reached an end.
+    branch_count = models.PositiveIntegerField(default=0, null=False, editable=False)
+    terminated_count = models.PositiveIntegerField(default=0, null=False, editable=False)
+    # Denormalized from the workflow instance, to route (or partition) the rows by it.
+    shard_key = models.CharField(max_length=64, default='', blank=True, editable=False)
 
     def verify_consistency(self):
         exceptions.ensure(lambda obj: obj.node_spec.course_spec == obj.course_instance.course_spec, self,
@@ -775,7 +978,8 @@ class NodeInstance(TrackedLive):
 
     def verify_respects_branches(self):
         """
-        When the node is a SPLIT node, we must ensure every branch is instantiated.
+        When the node is a SPLIT node, we must ensure every branch is instantiated. This spans many
+          rows, so the database cannot enforce it (it only keeps the branches unique by course).
         """
 
         if self.node_spec.type == NodeSpec.SPLIT:
@@ -801,13 +1005,188 @@ class NodeInstance(TrackedLive):
         self.verify_respects_branches()
 
 
+class NodeTimer(models.Model):
+    """
+    A timer transition pending to run for a node instance (of an INPUT node) when it is due. Timers
+      are created when the node instance is created, and deleted along with it. This class is not
+      intended to be used directly but just be present in the database.
+    """
+
+    node_instance = models.ForeignKey(NodeInstance, related_name='timers', null=False, blank=False,
+                                      on_delete=models.CASCADE)
+    transition_spec = models.ForeignKey(TransitionSpec, related_name='+', null=False, blank=False,
+                                        on_delete=models.CASCADE)
+    due_on = models.DateTimeField(null=False, blank=False, db_index=True)
+
+    class Meta:
+        unique_together = (('node_instance', 'transition_spec'),)
+
+
 class CourseInstanceLog(models.Model):
     """
     This class is not intended to be used directly but just be present in the database.
     """
 
-    created_on = models.DateTimeField(auto_now_add=True, null=False)
+    created_on = models.DateTimeField(default=now, null=False, editable=False)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, null=False, blank=False, on_delete=models.CASCADE)
     course_instance = models.ForeignKey(CourseInstance, null=False, blank=False, on_delete=models.CASCADE,
                                         related_name='logs')
     node_spec = models.ForeignKey(NodeSpec, related_name='+', null=False, blank=False, on_delete=models.CASCADE)
+    # The previous landing of the course instance (if any), the transition taken to land in this node
+    #   (None for cancellations and joins) and the time elapsed since the previous landing.
+    previous_node_spec = models.ForeignKey(NodeSpec, related_name='+', null=True, blank=True,
+                                           on_delete=models.CASCADE)
+    transition_spec = models.ForeignKey(TransitionSpec, related_name='+', null=True, blank=True,
+                                        on_delete=models.SET_NULL)
+    elapsed = models.DurationField(null=True, blank=True)
+    # Denormalized from the workflow instance, to route (or partition) the rows by it.
+    shard_key = models.CharField(max_length=64, default='', blank=True, editable=False)
+
+    class Meta:
+        # The last one serves the ordered scans of the dwell times.
+        index_together = (('node_spec', 'created_on'), ('previous_node_spec', 'created_on'),
+                          ('previous_node_spec', 'elapsed'))
+
+
+class CourseInstanceLogArchive(models.Model):
+    """
+    Logs of terminated workflow instances, moved here from CourseInstanceLog by the archival command
+      (they are kept even if their course instances are deleted). This class is not intended to be
+      used directly but just be present in the database.
+    """
+
+    log_id = models.IntegerField(null=False, editable=False)
+    created_on = models.DateTimeField(null=False, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=False, blank=False, on_delete=models.CASCADE,
+                             related_name='+')
+    workflow_instance = models.ForeignKey(WorkflowInstance, null=False, blank=False, on_delete=models.CASCADE,
+                                          related_name='archived_logs')
+    course_instance_id = models.IntegerField(null=False, editable=False)
+    node_spec = models.ForeignKey(NodeSpec, related_name='+', null=False, blank=False, on_delete=models.CASCADE)
+    previous_node_spec = models.ForeignKey(NodeSpec, related_name='+', null=True, blank=True,
+                                           on_delete=models.CASCADE)
+    transition_spec = models.ForeignKey(TransitionSpec, related_name='+', null=True, blank=True,
+                                        on_delete=models.SET_NULL)
+    elapsed = models.DurationField(null=True, blank=True)
+    shard_key = models.CharField(max_length=64, default='', blank=True, editable=False)
+
+
+class NodeThroughput(models.Model):
+    """
+    Hourly rollup of how many courses entered and left each node. Rows are maintained by the runner
+      (when the OUROBOROS_THROUGHPUT_ROLLUP setting is True) and can be rebuilt from the logs. This
+      class is not intended to be used directly but just be present in the database.
+    """
+
+    workflow_spec = models.ForeignKey(WorkflowSpec, related_name='+', null=False, blank=False,
+                                      on_delete=models.CASCADE)
+    node_spec = models.ForeignKey(NodeSpec, related_name='+', null=False, blank=False, on_delete=models.CASCADE)
+    bucket = models.DateTimeField(null=False, blank=False)
+    entered = models.PositiveIntegerField(default=0)
+    left = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = (('node_spec', 'bucket'),)
+        index_together = (('workflow_spec', 'bucket'),)
+
+
+class WorkflowEvent(models.Model):
+    """
+    An event appended by the runner (when the OUROBOROS_EVENT_SOURCING setting is True), numbered
+      by workflow instance. Course instances are referenced by id since they may not exist anymore.
+      This class is not intended to be used directly but just be present in the database.
+    """
+
+    COURSE_CREATED = 'course-created'
+    NODE_ENTERED = 'node-entered'
+    COURSE_TERMINATED = 'course-terminated'
+    TYPES = (
+        (COURSE_CREATED, _('Course Created')),
+        (NODE_ENTERED, _('Node Entered')),
+        (COURSE_TERMINATED, _('Course Terminated')),
+    )
+
+    workflow_instance = models.ForeignKey(WorkflowInstance, related_name='events', null=False, blank=False,
+                                          on_delete=models.CASCADE)
+    sequence = models.PositiveIntegerField(null=False, editable=False)
+    type = models.CharField(max_length=20, choices=TYPES, null=False, blank=False, editable=False)
+    created_on = models.DateTimeField(default=now, null=False, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='+', null=True, blank=True,
+                             on_delete=models.SET_NULL)
+    course_instance_id = models.IntegerField(null=False, editable=False)
+    # For COURSE_CREATED events.
+    parent_course_instance_id = models.IntegerField(null=True, editable=False)
+    course_spec = models.ForeignKey(CourseSpec, related_name='+', null=True, blank=True, on_delete=models.CASCADE)
+    # For NODE_ENTERED and COURSE_TERMINATED events.
+    node_spec = models.ForeignKey(NodeSpec, related_name='+', null=True, blank=True, on_delete=models.CASCADE)
+    term_level = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        unique_together = (('workflow_instance', 'sequence'),)
+        index_together = (('workflow_instance', 'created_on'),)
+
+
+class WorkflowSnapshot(models.Model):
+    """
+    The state of the course tree of a workflow instance after a given event, as json. This class is
+      not intended to be used directly but just be present in the database.
+    """
+
+    workflow_instance = models.ForeignKey(WorkflowInstance, related_name='snapshots', null=False, blank=False,
+                                          on_delete=models.CASCADE)
+    sequence = models.PositiveIntegerField(null=False, editable=False)
+    created_on = models.DateTimeField(null=False, editable=False)
+    state = models.TextField(null=False, editable=False)
+
+    class Meta:
+        unique_together = (('workflow_instance', 'sequence'),)
+
+
+class OutboxMessage(models.Model):
+    """
+    A state change (node landing) to be published to downstream services. Messages are written by
+      the runner in the same transaction of the change (when the OUROBOROS_OUTBOX setting is True),
+      and published later by the relay command. This class is not intended to be used directly but
+      just be present in the database.
+    """
+
+    created_on = models.DateTimeField(default=now, null=False, editable=False)
+    workflow_instance_id = models.IntegerField(null=False, editable=False)
+    payload = models.TextField(null=False, editable=False)
+    published_on = models.DateTimeField(null=True, blank=True, editable=False, db_index=True)
+
+
+class QueuedAction(models.Model):
+    """
+    An action enqueued to be executed later (by the worker pool) on a workflow instance. Workers
+      claim all the pending actions of a workflow instance at once, so the actions of each instance
+      are executed in order, by a single worker. This class is not intended to be used directly but
+      just be present in the database.
+    """
+
+    PENDING = 'pending'
+    CLAIMED = 'claimed'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, _('Pending')),
+        (CLAIMED, _('Claimed')),
+        (DONE, _('Done')),
+        (FAILED, _('Failed')),
+    )
+
+    workflow_instance = models.ForeignKey(WorkflowInstance, related_name='queued_actions', null=False, blank=False,
+                                          on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='+', null=False, blank=False,
+                             on_delete=models.CASCADE)
+    action_name = models.SlugField(max_length=30, null=False, blank=False)
+    path = models.CharField(max_length=255, default='', blank=True)
+    created_on = models.DateTimeField(default=now, null=False, editable=False)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING, null=False, editable=False)
+    worker = models.CharField(max_length=100, null=True, blank=True, editable=False)
+    claimed_on = models.DateTimeField(null=True, blank=True, editable=False)
+    processed_on = models.DateTimeField(null=True, blank=True, editable=False)
+    error = models.TextField(null=True, blank=True, editable=False)
+
+    class Meta:
+        index_together = (('status', 'id'), ('status', 'claimed_on'))
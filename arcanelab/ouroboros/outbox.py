@@ -0,0 +1,142 @@
+###################################################################################
+#                                                                                 #
+# Transactional outbox: when the OUROBOROS_OUTBOX setting is True, the runner     #
+#   writes a message for each node landing into the OutboxMessage table, in the   #
+#   same transaction of the landing. The relay publishes them later, in batches   #
+#   and by id (so, in order for each workflow instance), to a pluggable sink.     #
+#                                                                                 #
+# Delivery is at-least-once: messages are marked as published only after the sink #
+#   accepted them, so a failing sink makes the relay retry from the first message #
+#   not accepted (sinks should be idempotent by message id).                      #
+#                                                                                 #
+###################################################################################
+
+from __future__ import unicode_literals
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db.transaction import atomic
+from django.utils.module_loading import import_string
+from django.utils.six import text_type
+from django.utils.timezone import now
+from . import models
+import io
+import json
+
+
+def enabled():
+    return getattr(settings, 'OUROBOROS_OUTBOX', False)
+
+
+def landing(compiled_spec, workflow_instance, course_instance_id, course_spec_id, node_spec_id, previous_node_spec_id,
+            user, stamp):
+    """
+    Builds an (unsaved) outbox message telling a course instance landed in a node. The codes are taken
+      from the compiled spec (and the content types cache), so usually no query is needed.
+    :return: An OutboxMessage.
+    """
+
+    def node_code(node_spec_id):
+        if node_spec_id is None:
+            return None
+        return compiled_spec.string(compiled_spec.node_codes[compiled_spec.node_index(node_spec_id)])
+
+    content_type = ContentType.objects.get_for_id(workflow_instance.content_type_id)
+    return models.OutboxMessage(workflow_instance_id=workflow_instance.pk, created_on=stamp, payload=json.dumps({
+        'workflow_instance': workflow_instance.pk,
+        'workflow_spec': [compiled_spec.code, compiled_spec.version],
+        'document': ['%s.%s' % (content_type.app_label, content_type.model), workflow_instance.object_id],
+        'course_instance': course_instance_id,
+        'course': compiled_spec.string(compiled_spec.course_codes[compiled_spec.course_index(course_spec_id)]),
+        'node': node_code(node_spec_id),
+        'previous_node': node_code(previous_node_spec_id),
+        'user': user.pk if user else None,
+        'created_on': stamp.isoformat(),
+    }, sort_keys=True))
+
+
+def write(messages):
+    """
+    Writes outbox messages (in the current transaction).
+    :param messages: A list of unsaved OutboxMessage instances.
+    """
+
+    models.OutboxMessage.objects.bulk_create(messages)
+
+
+class Sink(object):
+    """
+    Base class of the sinks the relay publishes to. A sink receives the messages of a batch, in
+      order, as dictionaries (the payload plus the 'id' of the message), and must raise an exception
+      if it could not publish all of them.
+    """
+
+    def publish(self, messages):
+        raise NotImplementedError
+
+
+class FileSink(Sink):
+    """
+    Appends the messages, as json lines, to a local file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def publish(self, messages):
+        with io.open(self.path, 'a', encoding='utf-8') as stream:
+            for message in messages:
+                stream.write(text_type(json.dumps(message, sort_keys=True)) + '\n')
+
+
+class MemorySink(Sink):
+    """
+    Keeps the messages in memory, in the class attribute `messages`. Useful for tests.
+    """
+
+    messages = []
+
+    def publish(self, messages):
+        MemorySink.messages.extend(messages)
+
+
+def get_sink(path=None, **options):
+    """
+    Instantiates a sink by the dotted path of its class (by default, the OUROBOROS_OUTBOX_SINK
+      setting) and its options (by default, the OUROBOROS_OUTBOX_SINK_OPTIONS setting).
+    :return: The sink.
+    """
+
+    if path is None:
+        path = getattr(settings, 'OUROBOROS_OUTBOX_SINK', 'arcanelab.ouroboros.outbox.MemorySink')
+        options = dict(getattr(settings, 'OUROBOROS_OUTBOX_SINK_OPTIONS', {}), **options)
+    return import_string(path)(**options)
+
+
+def relay(sink, batch_size=100):
+    """
+    Publishes one batch of pending messages. The batch is locked while it is being published (where the
+      database supports it), so concurrent relays do not publish it twice.
+    :param sink: The sink to publish to.
+    :param batch_size: The maximum number of messages to publish.
+    :return: The number of published messages.
+    """
+
+    with atomic():
+        batch = list(models.OutboxMessage.objects.select_for_update().filter(
+            published_on__isnull=True
+        ).order_by('id').values_list('id', 'payload')[:batch_size])
+        if not batch:
+            return 0
+        sink.publish([dict(json.loads(payload), id=id_) for id_, payload in batch])
+        models.OutboxMessage.objects.filter(id__in=[id_ for id_, payload in batch]).update(published_on=now())
+        return len(batch)
+
+
+def purge(before):
+    """
+    Deletes the published messages older than a given date.
+    :param before: The date.
+    :return: The number of deleted messages.
+    """
+
+    return models.OutboxMessage.objects.filter(published_on__isnull=False, created_on__lt=before).delete()[0]
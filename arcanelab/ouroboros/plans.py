@@ -0,0 +1,102 @@
+###################################################################################
+#                                                                                 #
+# Query plans (and timings) of the lookups the runner repeats on every operation: #
+#   the root course of a workflow instance, a node of a course by its type, an    #
+#   outbound transition by its action name, and a branch of a split by its        #
+#   course code. They are meant to be compared before and after migrating the     #
+#   lookup indexes (0019 and 0020), on each supported database (SQLite,           #
+#   PostgreSQL and MySQL).                                                        #
+#                                                                                 #
+###################################################################################
+
+# Plans recorded with the ouroboros_explain_lookups command on SQLite 3.40.1, before (at
+#   migration 0018) and after the lookup indexes:
+#
+#   root course:          before: SEARCH ouroboros_courseinstance USING INDEX <workflow_instance_id FK>
+#                                 (workflow_instance_id=?), then parent_id IS NULL is checked by row
+#                         after:  SEARCH ouroboros_courseinstance USING INDEX ouroboros_courseinstance_root
+#                                 (workflow_instance_id=?), a partial index holding the root courses only
+#   node by type:         before: SEARCH ouroboros_nodespec USING INDEX <course_spec_id FK> (course_spec_id=?)
+#                         after:  SEARCH ouroboros_nodespec USING INDEX <course_spec_id, type>
+#                                 (course_spec_id=? AND type=?)
+#   transition by action: before: SEARCH ouroboros_transitionspec USING INDEX <origin_id FK> (origin_id=?)
+#                         after:  SEARCH ouroboros_transitionspec USING INDEX ouroboros_transitionspec_action
+#                                 (origin_id=? AND action_name=?)
+#   branch by course:     before: SEARCH ouroboros_courseinstance USING INDEX <parent_id FK> (parent_id=?)
+#                         after:  SEARCH ouroboros_courseinstance USING INDEX ouroboros_courseinstance_branch
+#                                 (parent_id=?)
+#                         both:   SEARCH ouroboros_coursespec USING INTEGER PRIMARY KEY (rowid=?)
+#
+# PostgreSQL plans were not recorded: they depend on the table statistics, so they should be
+#   captured with the command against a populated database.
+
+from __future__ import unicode_literals
+from timeit import default_timer
+from django.db import connections
+from . import models
+
+
+PREFIXES = {'sqlite': 'EXPLAIN QUERY PLAN ', 'postgresql': 'EXPLAIN ', 'mysql': 'EXPLAIN '}
+
+
+def _sample(queryset, fields, default):
+    # Plans may depend on the values, so existing ones are preferred.
+    return queryset.values_list(*fields).first() or default
+
+
+def lookups(using=None):
+    """
+    Builds the runtime lookups, with values taken from existing rows (if any).
+    :param using: The database to take the values from.
+    :return: A list of (name, queryset) tuples.
+    """
+
+    workflow_instance, = _sample(models.WorkflowInstance.objects.using(using), ('id',), (0,))
+    course_spec, = _sample(models.CourseSpec.objects.using(using), ('id',), (0,))
+    origin, action_name = _sample(models.TransitionSpec.objects.using(using).filter(action_name__isnull=False),
+                                  ('origin_id', 'action_name'), (0, ''))
+    parent, code = _sample(models.CourseInstance.objects.using(using).filter(parent__isnull=False),
+                           ('parent_id', 'course_spec__code'), (0, ''))
+    return [
+        ('root course', models.CourseInstance.objects.filter(workflow_instance_id=workflow_instance,
+                                                             parent__isnull=True)),
+        ('node by type', models.NodeSpec.objects.filter(course_spec_id=course_spec, type=models.NodeSpec.ENTER)),
+        ('transition by action', models.TransitionSpec.objects.filter(origin_id=origin, action_name=action_name)),
+        ('branch by course', models.CourseInstance.objects.filter(parent_id=parent, course_spec__code=code)),
+    ]
+
+
+def explain(queryset, using='default'):
+    """
+    Gets the query plan of a queryset.
+    :param queryset: The queryset.
+    :param using: The database to explain it in.
+    :return: A list of lines.
+    """
+
+    connection = connections[using]
+    if connection.vendor not in PREFIXES:
+        raise ValueError('Query plans are not supported for %s databases' % connection.vendor)
+    sql, params = queryset.query.get_compiler(using=using).as_sql()
+    with connection.cursor() as cursor:
+        cursor.execute(PREFIXES[connection.vendor] + sql, params)
+        rows = cursor.fetchall()
+    if connection.vendor == 'sqlite':
+        return ['%s' % row[-1] for row in rows]
+    return [' | '.join('%s' % value for value in row if value is not None) for row in rows]
+
+
+def timing(queryset, using='default', repeat=100):
+    """
+    Measures a queryset, running it several times.
+    :param queryset: The queryset.
+    :param using: The database to run it in.
+    :param repeat: How many times it runs.
+    :return: The average time (in seconds).
+    """
+
+    queryset = queryset.using(using)
+    start = default_timer()
+    for index in range(repeat):
+        list(queryset.all())
+    return (default_timer() - start) / repeat
@@ -0,0 +1,94 @@
+###################################################################################
+#                                                                                 #
+# Database router for deployments with read replicas. Add it to DATABASE_ROUTERS  #
+#   and configure (each setting is optional):                                     #
+#                                                                                 #
+# - OUROBOROS_WRITE_DATABASE: the primary, where every write goes.                #
+# - OUROBOROS_READ_DATABASE: where the workflow instance tables are read from.    #
+# - OUROBOROS_SPEC_DATABASE: where the (immutable, once published) spec tables    #
+#   are read from, e.g. a local replica. Defaults to OUROBOROS_READ_DATABASE.     #
+#                                                                                 #
+# Writes go to the primary (the default database, unless configured), even for   #
+#   objects read from a replica. Reads run by the writing operations of the       #
+#   runner (start(), execute(), cancel() and the others) go to the primary as     #
+#   well, so the runner never reads stale data; any other read (even inside a     #
+#   transaction, e.g. with ATOMIC_REQUESTS) goes to the replica. Objects keep     #
+#   being read from the database they came from, and an explicit using= argument  #
+#   always wins.                                                                  #
+#                                                                                 #
+# When OUROBOROS_SHARDS is configured, the instance tables (not the spec ones)    #
+#   are routed to the shard pinned by the runner (see the sharding module) or, by #
+#   the hint instance, to the shard of its shard key.                             #
+#                                                                                 #
+###################################################################################
+
+from __future__ import unicode_literals
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from . import sharding
+
+
+APP_LABEL = 'ouroboros'
+SPEC_MODELS = ('workflowspec', 'coursespec', 'nodespec', 'transitionspec', 'nodespec_branches')
+
+
+class OuroborosRouter(object):
+
+    def _write(self):
+        return getattr(settings, 'OUROBOROS_WRITE_DATABASE', None)
+
+    def _read(self, model):
+        read = getattr(settings, 'OUROBOROS_READ_DATABASE', None)
+        if model._meta.model_name in SPEC_MODELS:
+            return getattr(settings, 'OUROBOROS_SPEC_DATABASE', None) or read
+        return read
+
+    def _aliases(self):
+        return set(alias for alias in (self._write(), getattr(settings, 'OUROBOROS_READ_DATABASE', None),
+                                       getattr(settings, 'OUROBOROS_SPEC_DATABASE', None)) if alias) | \
+            set(sharding.shards())
+
+    def _shard(self, model, hints):
+        if model._meta.model_name in SPEC_MODELS:
+            return None
+        database = sharding.current()
+        if database:
+            return database
+        instance = hints.get('instance')
+        if sharding.shards() and getattr(instance, 'shard_key', None):
+            return sharding.database(instance.shard_key)
+        return None
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != APP_LABEL:
+            return None
+        shard = self._shard(model, hints)
+        if shard:
+            return shard
+        if sharding.writing():
+            return self._write() or DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        return self._read(model)
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label != APP_LABEL:
+            return None
+        return self._shard(model, hints) or self._write() or DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data, so objects read from any of them can be related. Shards hold
+        #   the shared (spec) tables as well.
+        aliases = self._aliases()
+        if aliases and obj1._state.db in aliases | {DEFAULT_DB_ALIAS} and \
+                obj2._state.db in aliases | {DEFAULT_DB_ALIAS}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema by replication, while shards are migrated one by one.
+        if app_label == APP_LABEL and db != (self._write() or DEFAULT_DB_ALIAS) and db in self._aliases() and \
+                db not in sharding.shards():
+            return False
+        return None
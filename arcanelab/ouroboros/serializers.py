@@ -0,0 +1,379 @@
+###################################################################################
+#                                                                                 #
+# Streaming (json-lines) serialization of workflow specs and workflow instances.  #
+#                                                                                 #
+# A stream is made of one json object per line, having exactly one key telling    #
+#   the record kind: the first record is {"spec": {...}} and it is followed by    #
+#   zero or more {"instance": {...}} records, one per workflow instance (with its #
+#   whole tree of courses, nodes and logs).                                       #
+#                                                                                 #
+# Each log is a list: [created_on, username, node code, previous node code,       #
+#   transition, elapsed seconds], where the transition is its position among the  #
+#   transitions of the course in the spec record. Logs having only the first      #
+#   three items (older streams) are also loaded.                                  #
+#                                                                                 #
+###################################################################################
+
+from __future__ import unicode_literals
+from itertools import groupby
+from operator import itemgetter
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections, router, models as db_models
+from django.db.transaction import atomic
+from django.utils.dateparse import parse_datetime
+from . import compiled, expressions, models, timers
+import json
+
+
+def _datetime(value):
+    return value and value.isoformat()
+
+
+def _insert_all(model, objs):
+    """
+    Inserts all the objects, getting their ids back. This is done in one query if the
+      database supports it, or one query per object otherwise.
+    :param model: The model class of the objects.
+    :param objs: The objects to insert.
+    """
+
+    if not objs:
+        return
+    if connections[router.db_for_write(model)].features.can_return_ids_from_bulk_insert:
+        model.objects.bulk_create(objs)
+    else:
+        for obj in objs:
+            # We bypass TrackedLive.save() since it would overwrite the updated_on field.
+            db_models.Model.save(obj, force_insert=True)
+
+
+def spec_data(workflow_spec, transition_positions=None):
+    """
+    Builds the serialized representation of a workflow spec, using one query per spec table
+      regardless of the amount of courses, nodes and transitions.
+    :param workflow_spec: The workflow spec to serialize.
+    :param transition_positions: An optional dict to fill with the position of each transition
+      (by id) among the transitions of its course.
+    :return: A dict with the specification data for this spec.
+    """
+
+    document_type = ContentType.objects.get_for_id(workflow_spec.document_type_id)
+    courses = {}
+    course_specs_data = []
+    for course_spec in models.CourseSpec.objects.filter(workflow_spec=workflow_spec).order_by('id'):
+        course_spec_data = {
+            'code': course_spec.code,
+            'name': course_spec.name,
+            'description': course_spec.description,
+            'cancel_permission': course_spec.cancel_permission,
+            'nodes': [],
+            'transitions': []
+        }
+        courses[course_spec.id] = course_spec_data
+        course_specs_data.append(course_spec_data)
+
+    branches = {}
+    for node_spec_id, code in models.NodeSpec.branches.through.objects.filter(
+        nodespec__course_spec__workflow_spec=workflow_spec
+    ).order_by('id').values_list('nodespec_id', 'coursespec__code'):
+        branches.setdefault(node_spec_id, []).append(code)
+
+    for node_spec in models.NodeSpec.objects.filter(course_spec__workflow_spec=workflow_spec).order_by('id'):
+        courses[node_spec.course_spec_id]['nodes'].append({
+            'type': node_spec.type,
+            'code': node_spec.code,
+            'name': node_spec.name,
+            'description': node_spec.description,
+            'landing_handler': node_spec.landing_handler and node_spec.landing_handler.path,
+            'exit_value': node_spec.exit_value,
+            'joiner': node_spec.joiner and node_spec.joiner.path,
+            'execute_permission': node_spec.execute_permission,
+            'branches': branches.get(node_spec.id, [])
+        })
+
+    for transition_spec in models.TransitionSpec.objects.filter(
+        origin__course_spec__workflow_spec=workflow_spec
+    ).select_related('origin', 'destination').order_by('id'):
+        transitions = courses[transition_spec.origin.course_spec_id]['transitions']
+        if transition_positions is not None:
+            transition_positions[transition_spec.id] = len(transitions)
+        transitions.append({
+            'origin': transition_spec.origin.code,
+            'destination': transition_spec.destination.code,
+            'action_name': transition_spec.action_name,
+            'name': transition_spec.name,
+            'description': transition_spec.description,
+            'permission': transition_spec.permission,
+            'condition': transition_spec.condition and expressions.serialize(transition_spec.condition),
+            'priority': transition_spec.priority
+        })
+        if transition_spec.timeout is not None:
+            # Only present when set, so the digests of specs without timers are kept.
+            courses[transition_spec.origin.course_spec_id]['transitions'][-1]['timeout'] = int(
+                transition_spec.timeout.total_seconds()
+            )
+
+    return {
+        'model': '%s.%s' % (document_type.app_label, document_type.model),
+        'code': workflow_spec.code,
+        'name': workflow_spec.name,
+        'description': workflow_spec.description,
+        'create_permission': workflow_spec.create_permission,
+        'cancel_permission': workflow_spec.cancel_permission,
+        'courses': course_specs_data
+    }
+
+
+class _GroupCursor(object):
+    """
+    Walks a stream of rows sorted by their first element (the workflow instance id), giving
+      the rows of one workflow instance at a time. Requested keys must be increasing.
+    """
+
+    def __init__(self, rows):
+        self._groups = groupby(rows, key=itemgetter(0))
+        self._current = next(self._groups, None)
+
+    def take(self, key):
+        while self._current is not None and self._current[0] < key:
+            self._current = next(self._groups, None)
+        if self._current is not None and self._current[0] == key:
+            rows = list(self._current[1])
+            self._current = next(self._groups, None)
+            return rows
+        return []
+
+
+def dump(workflow_spec, stream, instances=False):
+    """
+    Writes a workflow spec and, optionally, all its workflow instances into a text stream.
+      Instances are read with exactly four queries, using database iterators and merging
+      them by workflow instance, so only one workflow instance tree is kept in memory at
+      a time.
+    :param workflow_spec: The workflow spec to dump.
+    :param stream: A file-like text object to write into.
+    :param instances: Whether the workflow instances must also be dumped.
+    :return: The number of dumped workflow instances.
+    """
+
+    transition_positions = {}
+    stream.write(json.dumps({'spec': dict(spec_data(workflow_spec, transition_positions),
+                                          digest=workflow_spec.digest)}) + '\n')
+    if not instances:
+        return 0
+
+    username_field = get_user_model().USERNAME_FIELD
+    workflow_instances = models.WorkflowInstance.objects.filter(workflow_spec=workflow_spec).order_by('id')
+    courses = _GroupCursor(models.CourseInstance.objects.filter(
+        workflow_instance__workflow_spec=workflow_spec
+    ).order_by('workflow_instance_id', 'id').values_list(
+        'workflow_instance_id', 'id', 'parent__course_instance_id', 'course_spec__code', 'term_level', 'created_on',
+        'updated_on'
+    ).iterator())
+    nodes = _GroupCursor(models.NodeInstance.objects.filter(
+        course_instance__workflow_instance__workflow_spec=workflow_spec
+    ).order_by('course_instance__workflow_instance_id').values_list(
+        'course_instance__workflow_instance_id', 'course_instance_id', 'node_spec__code', 'created_on', 'updated_on'
+    ).iterator())
+    logs = _GroupCursor(models.CourseInstanceLog.objects.filter(
+        course_instance__workflow_instance__workflow_spec=workflow_spec
+    ).order_by('course_instance__workflow_instance_id', 'id').values_list(
+        'course_instance__workflow_instance_id', 'course_instance_id', 'node_spec__code', 'user__' + username_field,
+        'created_on', 'previous_node_spec__code', 'transition_spec_id', 'elapsed'
+    ).iterator())
+
+    count = 0
+    for id_, app_label, model, object_id, created_on, updated_on, shard_key in workflow_instances.values_list(
+        'id', 'content_type__app_label', 'content_type__model', 'object_id', 'created_on', 'updated_on', 'shard_key'
+    ).iterator():
+        instance_nodes = {course_id: {'code': code, 'created_on': _datetime(node_created_on),
+                                      'updated_on': _datetime(node_updated_on)}
+                          for _, course_id, code, node_created_on, node_updated_on in nodes.take(id_)}
+        instance_logs = {}
+        for _, course_id, code, username, log_created_on, previous_code, transition_id, elapsed in logs.take(id_):
+            instance_logs.setdefault(course_id, []).append([
+                _datetime(log_created_on), username, code, previous_code, transition_positions.get(transition_id),
+                None if elapsed is None else elapsed.total_seconds()
+            ])
+        stream.write(json.dumps({'instance': {
+            'document': [app_label, model, object_id],
+            'created_on': _datetime(created_on),
+            'updated_on': _datetime(updated_on),
+            'shard_key': shard_key,
+            'courses': [{
+                'id': course_id,
+                'parent': parent_id,
+                'code': code,
+                'term_level': term_level,
+                'created_on': _datetime(course_created_on),
+                'updated_on': _datetime(course_updated_on),
+                'node': instance_nodes.get(course_id),
+                'logs': instance_logs.get(course_id, [])
+            } for _, course_id, parent_id, code, term_level, course_created_on, course_updated_on in courses.take(id_)]
+        }}) + '\n')
+        count += 1
+    return count
+
+
+def read_spec(lines):
+    """
+    Reads the spec record from an iterator of lines.
+    :param lines: An iterator of lines (e.g. an open file).
+    :return: The spec data.
+    """
+
+    for line in lines:
+        line = line.strip()
+        if line:
+            record = json.loads(line)
+            if 'spec' not in record:
+                raise ValueError('The first record in a workflow stream must be a spec')
+            return record['spec']
+    raise ValueError('Empty workflow stream')
+
+
+def _load_batch(records, workflow_spec, courses_map, nodes_map, transitions_map, terminal_nodes):
+    """
+    Creates a batch of workflow instance trees. Each tree level of the whole batch is
+      inserted at once, so the number of queries depends on the depth of the trees and
+      not on the amount of instances.
+    """
+
+    User = get_user_model()
+    usernames = set(log[1] for record in records for course in record['courses'] for log in course['logs'])
+    users = dict(User._default_manager.filter(**{User.USERNAME_FIELD + '__in': usernames}).values_list(
+        User.USERNAME_FIELD, 'pk'
+    ))
+
+    workflow_instances = []
+    for record in records:
+        app_label, model, object_id = record['document']
+        workflow_instances.append(models.WorkflowInstance(
+            workflow_spec=workflow_spec, content_type=ContentType.objects.get_by_natural_key(app_label, model),
+            object_id=object_id, created_on=parse_datetime(record['created_on']),
+            updated_on=parse_datetime(record['updated_on']), shard_key=record.get('shard_key') or workflow_spec.code
+        ))
+    _insert_all(models.WorkflowInstance, workflow_instances)
+
+    # Courses are sorted by id in each record, so parents come before their children.
+    pending = [(workflow_instance, course) for workflow_instance, record in zip(workflow_instances, records)
+               for course in record['courses']]
+    # Split counters: (record index, course id) => [branches, terminated branches].
+    counters = {}
+    for workflow_instance, course in pending:
+        if course['parent'] is not None:
+            counter = counters.setdefault((workflow_instance.pk, course['parent']), [0, 0])
+            counter[0] += 1
+            if course['node'] and nodes_map[(course['code'], course['node']['code'])] in terminal_nodes:
+                counter[1] += 1
+    node_instances = {}  # (record index, course id) => node instance
+    course_instances = {}  # (record index, course id) => course instance
+    logs, node_timers = [], []
+    compiled_spec = compiled.get(workflow_spec)
+    while pending:
+        level, waiting = [], []
+        for workflow_instance, course in pending:
+            ready = course['parent'] is None or (workflow_instance.pk, course['parent']) in node_instances
+            (level if ready else waiting).append((workflow_instance, course))
+        pending = waiting
+        if not level:
+            raise ValueError('Workflow stream has course instances with missing parents')
+        level_courses = []
+        for workflow_instance, course in level:
+            course_instance = models.CourseInstance(
+                workflow_instance=workflow_instance, course_spec_id=courses_map[course['code']],
+                parent=node_instances.get((workflow_instance.pk, course['parent'])), term_level=course['term_level'],
+                created_on=parse_datetime(course['created_on']), updated_on=parse_datetime(course['updated_on']),
+                shard_key=workflow_instance.shard_key
+            )
+            course_instances[(workflow_instance.pk, course['id'])] = course_instance
+            level_courses.append(course_instance)
+        _insert_all(models.CourseInstance, level_courses)
+        level_nodes = []
+        for workflow_instance, course in level:
+            course_instance = course_instances[(workflow_instance.pk, course['id'])]
+            previous = None
+            for log_data in course['logs']:
+                created_on, username, code = log_data[:3]
+                log = models.CourseInstanceLog(
+                    course_instance=course_instance, node_spec_id=nodes_map[(course['code'], code)],
+                    user_id=users[username], created_on=parse_datetime(created_on),
+                    shard_key=workflow_instance.shard_key
+                )
+                if len(log_data) > 3:
+                    previous_code, transition, elapsed = log_data[3:6]
+                    log.previous_node_spec_id = previous_code and nodes_map[(course['code'], previous_code)]
+                    log.transition_spec_id = None if transition is None else \
+                        transitions_map[(course['code'], transition)]
+                    log.elapsed = None if elapsed is None else timedelta(seconds=elapsed)
+                elif previous:
+                    log.previous_node_spec_id, log.elapsed = previous.node_spec_id, log.created_on - previous.created_on
+                logs.append(log)
+                previous = log
+            if course['node']:
+                branch_count, terminated_count = counters.get((workflow_instance.pk, course['id']), (0, 0))
+                node_instance = models.NodeInstance(
+                    course_instance=course_instance, node_spec_id=nodes_map[(course['code'], course['node']['code'])],
+                    branch_count=branch_count, terminated_count=terminated_count,
+                    created_on=parse_datetime(course['node']['created_on']),
+                    updated_on=parse_datetime(course['node']['updated_on']), shard_key=workflow_instance.shard_key
+                )
+                node_instances[(workflow_instance.pk, course['id'])] = node_instance
+                level_nodes.append(node_instance)
+        _insert_all(models.NodeInstance, level_nodes)
+        # Timers of waiting courses are due as if they had been running since they landed.
+        for node_instance in level_nodes:
+            node_timers.extend(timers.pending(compiled_spec, node_instance, node_instance.created_on))
+    models.CourseInstanceLog.objects.bulk_create(logs)
+    timers.schedule(node_timers)
+
+
+def load_instances(lines, workflow_spec, batch_size=500):
+    """
+    Reads the workflow instance records from an iterator of lines (the spec record must have
+      already been consumed) and creates them for the given workflow spec. Documents must
+      already exist with the same ids, and users must exist with the same usernames.
+    :param lines: An iterator of lines (e.g. an open file).
+    :param workflow_spec: The workflow spec the instances will be tied to.
+    :param batch_size: The amount of workflow instances being kept in memory and inserted together.
+    :return: The number of loaded workflow instances.
+    """
+
+    courses_map = dict(models.CourseSpec.objects.filter(workflow_spec=workflow_spec).values_list('code', 'id'))
+    nodes_map = {}
+    terminal_nodes = set()
+    for id_, course_code, code, type_ in models.NodeSpec.objects.filter(
+        course_spec__workflow_spec=workflow_spec
+    ).values_list('id', 'course_spec__code', 'code', 'type'):
+        nodes_map[(course_code, code)] = id_
+        if type_ in (models.NodeSpec.EXIT, models.NodeSpec.CANCEL, models.NodeSpec.JOINED):
+            terminal_nodes.add(id_)
+    # (course code, position) => transition id, like the transitions are serialized in the spec record.
+    transitions_map = {}
+    positions = {}
+    for id_, course_code in models.TransitionSpec.objects.filter(
+        origin__course_spec__workflow_spec=workflow_spec
+    ).order_by('id').values_list('id', 'origin__course_spec__code'):
+        position = positions.get(course_code, 0)
+        transitions_map[(course_code, position)] = id_
+        positions[course_code] = position + 1
+
+    count = 0
+    batch = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        batch.append(json.loads(line)['instance'])
+        if len(batch) >= batch_size:
+            with atomic():
+                _load_batch(batch, workflow_spec, courses_map, nodes_map, transitions_map, terminal_nodes)
+            count += len(batch)
+            batch = []
+    if batch:
+        with atomic():
+            _load_batch(batch, workflow_spec, courses_map, nodes_map, transitions_map, terminal_nodes)
+        count += len(batch)
+    return count
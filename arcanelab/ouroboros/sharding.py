@@ -0,0 +1,147 @@
+###################################################################################
+#                                                                                 #
+# Horizontal sharding of the instance tables. Each workflow instance gets a shard #
+#   key when it is created (by default, the code of its workflow spec; or the     #
+#   result of the callable given by the OUROBOROS_SHARD_KEY setting, e.g. a       #
+#   tenant key of the document), which is denormalized onto its course instances, #
+#   node instances and logs (so the tables can also be partitioned by it).        #
+#                                                                                 #
+# When the OUROBOROS_SHARDS setting lists database aliases, each shard key is     #
+#   mapped to one of them (by the OUROBOROS_SHARD_MAP setting, or by a stable     #
+#   hash), and every query about a workflow instance goes to that database: the   #
+#   Workflow operations pin the shard of their instance, and the router in        #
+#   arcanelab.ouroboros.routers sends the instance tables there. Shared tables    #
+#   (specs, users and content types) must be present in every shard.             #
+#                                                                                 #
+###################################################################################
+
+from __future__ import unicode_literals
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+from threading import local
+from zlib import crc32
+from django.conf import settings
+from django.db import connections
+from django.utils.module_loading import import_string
+
+
+_state = local()
+
+
+def shards():
+    return list(getattr(settings, 'OUROBOROS_SHARDS', ()))
+
+
+def shard_key(workflow_spec, document):
+    """
+    Computes the shard key of a new workflow instance.
+    :param workflow_spec: The workflow spec of the instance.
+    :param document: The document of the instance.
+    :return: The shard key (a string).
+    """
+
+    function = getattr(settings, 'OUROBOROS_SHARD_KEY', None)
+    if function:
+        return '%s' % import_string(function)(workflow_spec, document)
+    return workflow_spec.code
+
+
+def database(key):
+    """
+    Gets the database of a shard key.
+    :param key: The shard key.
+    :return: The database alias, or None if sharding is not configured.
+    """
+
+    aliases = shards()
+    if not aliases:
+        return None
+    mapped = getattr(settings, 'OUROBOROS_SHARD_MAP', {}).get(key)
+    if mapped:
+        return mapped
+    return aliases[(crc32(key.encode('utf-8')) & 0xffffffff) % len(aliases)]
+
+
+def current():
+    """
+    Gets the database pinned in this thread by pinned(), if any.
+    """
+
+    return getattr(_state, 'database', None)
+
+
+@contextmanager
+def using(alias):
+    """
+    Sends the queries to the instance tables, in this thread, to a given shard.
+    :param alias: The database alias of the shard (None to stop pinning a shard).
+    :return: A context manager yielding the alias.
+    """
+
+    previous = current()
+    _state.database = alias
+    try:
+        yield alias
+    finally:
+        _state.database = previous
+
+
+def pinned(key):
+    """
+    Sends the queries to the instance tables, in this thread, to the database of a shard key.
+    :param key: The shard key.
+    :return: A context manager yielding the database alias (None if sharding is not configured).
+    """
+
+    return using(database(key))
+
+
+def writing():
+    """
+    Tells whether a writing operation of the runner is running in this thread (see write_block()).
+    """
+
+    return getattr(_state, 'writing', False)
+
+
+@contextmanager
+def write_block():
+    """
+    Marks a writing operation of the runner (e.g. start() or execute()) in this thread, so the router
+      reads from the primary while it runs.
+    :return: A context manager.
+    """
+
+    previous = writing()
+    _state.writing = True
+    try:
+        yield
+    finally:
+        _state.writing = previous
+
+
+def fan_out(function, aliases=None):
+    """
+    Runs a function once per shard, in parallel threads (each one using its own connection, closed
+      afterwards). With a single shard (or none configured), the function runs in this thread.
+    :param function: A function taking a database alias (None if sharding is not configured).
+    :param aliases: The shards to run it for. By default, all of them.
+    :return: The list of results, in order of the aliases.
+    """
+
+    aliases = shards() if aliases is None else list(aliases)
+    if len(aliases) < 2:
+        return [function(alias) for alias in aliases or [None]]
+
+    def run(alias):
+        try:
+            return function(alias)
+        finally:
+            connections[alias].close()
+
+    pool = ThreadPool(len(aliases))
+    try:
+        return pool.map(run, aliases)
+    finally:
+        pool.close()
+        pool.join()
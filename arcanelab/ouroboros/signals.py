@@ -0,0 +1,78 @@
+###################################################################################
+#                                                                                 #
+# Receivers keeping the compiled specs cache consistent with the spec tables,     #
+#   warming it up on the first request, and guarding the branches of published    #
+#   specs (changing them issues no save on the spec parts).                       #
+#                                                                                 #
+###################################################################################
+
+from __future__ import unicode_literals
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.signals import request_started
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from . import compiled, models
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+def _workflow_spec_id(instance):
+    if isinstance(instance, models.WorkflowSpec):
+        return instance.pk
+    elif isinstance(instance, models.CourseSpec):
+        return instance.workflow_spec_id
+    elif isinstance(instance, models.NodeSpec):
+        return instance.course_spec.workflow_spec_id
+    else:
+        return instance.origin.course_spec.workflow_spec_id
+
+
+def invalidate_compiled_spec(sender, instance, **kwargs):
+    try:
+        workflow_spec_id = _workflow_spec_id(instance)
+    except ObjectDoesNotExist:
+        # Parts being deleted in cascade: the workflow spec being deleted invalidates itself.
+        return
+    compiled.invalidate(workflow_spec_id)
+
+
+def invalidate_compiled_spec_branches(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_compiled_spec(sender, instance)
+
+
+def verify_branches_unpublished(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('pre_add', 'pre_remove', 'pre_clear'):
+        return
+    if not reverse:
+        instance.verify_unpublished()
+        return
+    # Changed from the course side: the branches belong to the calling nodes.
+    nodes = models.NodeSpec.objects.filter(branches=instance) if pk_set is None else \
+        models.NodeSpec.objects.filter(pk__in=pk_set)
+    for node in nodes.filter(course_spec__workflow_spec__published_on__isnull=False)[:1]:
+        node.verify_unpublished()
+
+
+def warm_up_compiled_specs(sender, **kwargs):
+    # Only once per process. Specs not preloaded are compiled on first use anyway, so a failing
+    #   warm-up (e.g. a missing file or spec) is just reported.
+    request_started.disconnect(warm_up_compiled_specs, dispatch_uid='ouroboros-warm-up')
+    try:
+        compiled.warm_up()
+    except Exception:
+        logger.exception('The compiled workflow specs could not be warmed up')
+
+
+def connect():
+    for model in (models.WorkflowSpec, models.CourseSpec, models.NodeSpec, models.TransitionSpec):
+        post_save.connect(invalidate_compiled_spec, sender=model,
+                          dispatch_uid='ouroboros-spec-save-%s' % model.__name__)
+        post_delete.connect(invalidate_compiled_spec, sender=model,
+                            dispatch_uid='ouroboros-spec-delete-%s' % model.__name__)
+    m2m_changed.connect(invalidate_compiled_spec_branches, sender=models.NodeSpec.branches.through,
+                        dispatch_uid='ouroboros-spec-branches')
+    m2m_changed.connect(verify_branches_unpublished, sender=models.NodeSpec.branches.through,
+                        dispatch_uid='ouroboros-spec-branches-published')
+    request_started.connect(warm_up_compiled_specs, dispatch_uid='ouroboros-warm-up')
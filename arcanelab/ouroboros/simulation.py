@@ -0,0 +1,341 @@
+###################################################################################
+#                                                                                 #
+# Simulations: dry runs of a compiled workflow spec, entirely in memory. They     #
+#   follow the same semantics of the workflow runner (automatic nodes, multi-     #
+#   plexers, splits, joiners, joins and cancellations) against a document which   #
+#   may be a stub, but they never touch the database.                             #
+#                                                                                 #
+# Simulations record the visited nodes, the invoked callables (landing handlers,  #
+#   conditions and joiners) and the writes the runner would perform, so they are  #
+#   useful to test spec changes, to estimate path lengths and to fuzz specs.      #
+#                                                                                 #
+# The decisions (multiplexer outbounds, terminal nodes and joiner resolutions)    #
+#   are taken by the decisions module, like the runner does. Errors are raised    #
+#   with the compiled spec as their raiser.                                       #
+#                                                                                 #
+###################################################################################
+
+from __future__ import unicode_literals
+from collections import namedtuple
+from django.utils.translation import ugettext_lazy as _
+from . import decisions, exceptions, expressions, models
+
+
+# A node a course went through (even an automatic one), as (course path, node code).
+Visit = namedtuple('Visit', ('path', 'node'))
+# A callable invocation, as (kind, reference, course path, returned value). The kind is one
+#   of 'landing_handler', 'condition' or 'joiner', and the reference is its stored text.
+Call = namedtuple('Call', ('kind', 'reference', 'path', 'result'))
+# A write the runner would perform, as (operation, model name, course path, node code).
+Write = namedtuple('Write', ('operation', 'model', 'path', 'node'))
+
+
+class SimulatedCourse(object):
+    """
+    A course instance, in memory. Its node is an index in the compiled spec, and only persistent
+      nodes (INPUT, SPLIT, EXIT, CANCEL and JOINED) are kept, like node instances are.
+    """
+
+    __slots__ = ('course', 'code', 'path', 'parent', 'node', 'branches', 'branch_count', 'terminated_count',
+                 'term_level')
+
+    def __init__(self, course, code, parent):
+        self.course = course
+        self.code = code
+        self.path = '' if parent is None else code if not parent.path else '%s.%s' % (parent.path, code)
+        self.parent = parent
+        self.node = None
+        self.branches = []
+        self.branch_count = self.terminated_count = 0
+        self.term_level = None
+
+    def __repr__(self):
+        return 'SimulatedCourse(%r)' % self.path
+
+
+class Simulation(object):
+    """
+    Runs a compiled spec in memory. Permissions are not checked, and the callables may be replaced
+      by stubs (by giving their references in `overrides`).
+
+    The public methods are like the ones of the Workflow wrapper:
+    - simulation.start()
+    - simulation.execute(an action[, 'path.to.course'])
+    - simulation.cancel(['path.to.course'])
+    - dict_ = simulation.get_workflow_status()
+    """
+
+    def __init__(self, compiled_spec, document, user=None, overrides=None, run_handlers=True):
+        """
+        Creates a simulation.
+        :param compiled_spec: The compiled spec to run.
+        :param document: The document (or any stub object having the fields needed by the callables).
+        :param user: The user (or stub) given to the callables.
+        :param overrides: An optional dictionary of callables, by reference (i.e. the dotted path
+          of a callable, or the json text of an expression), to invoke instead of the referenced ones.
+        :param run_handlers: Whether the landing handlers are invoked. They are recorded anyway.
+        """
+
+        self.compiled_spec = compiled_spec
+        self.document = document
+        self.user = user
+        self.overrides = overrides or {}
+        self.run_handlers = run_handlers
+        self.root = None
+        self.visited = []
+        self.calls = []
+        self.writes = []
+
+    # Spec helpers.
+
+    def _code(self, node):
+        return self.compiled_spec.string(self.compiled_spec.node_codes[node])
+
+    def _type(self, node):
+        return self.compiled_spec.node_type(node)
+
+    def _invoke(self, kind, reference, course, *args):
+        text = expressions.dumps(reference)
+        result = self.overrides.get(text, reference)(*args)
+        self.calls.append(Call(kind, text, course.path, result))
+        return result
+
+    def _main_course(self):
+        compiled_spec = self.compiled_spec
+        branches = set(compiled_spec.branch_courses)
+        courses = [course for course in range(len(compiled_spec.course_ids)) if course not in branches]
+        if len(courses) != 1:
+            raise exceptions.WorkflowSpecHasNoMainCourse(compiled_spec, _('Exactly one main course is expected in '
+                                                                          'the simulated workflow spec'))
+        return courses[0]
+
+    # Course helpers.
+
+    def _is(self, course, *types):
+        return course.node is not None and self._type(course.node) in types
+
+    def _is_terminated(self, course):
+        return self._is(course, models.NodeSpec.EXIT, models.NodeSpec.CANCEL, models.NodeSpec.JOINED)
+
+    def _exit_code(self, course):
+        if not self._is_terminated(course):
+            return None
+        if self._is(course, models.NodeSpec.EXIT):
+            return self.compiled_spec.node_exit_values[course.node]
+        return -1
+
+    def _find_course(self, path):
+        if self.root is None:
+            raise exceptions.WorkflowCourseInstanceDoesNotExist(self.compiled_spec, _('No main course exists for '
+                                                                                      'this simulation'))
+        course = self.root
+        for head in path.split('.') if path else ():
+            branches = [branch for branch in course.branches if branch.code == head] \
+                if self._is(course, models.NodeSpec.SPLIT) else []
+            if not branches:
+                raise exceptions.WorkflowCourseInstanceDoesNotExist(
+                    self.compiled_spec, _('There is no children course with this path/code'), path, head
+                )
+            course = branches[0]
+        return course
+
+    # Runner semantics.
+
+    def _instantiate_course(self, course, parent):
+        compiled_spec = self.compiled_spec
+        course_instance = SimulatedCourse(course, compiled_spec.string(compiled_spec.course_codes[course]), parent)
+        if parent is not None:
+            parent.branches.append(course_instance)
+        self.writes.append(Write('create', 'CourseInstance', course_instance.path, None))
+        enter = compiled_spec.nodes_of_type(course, models.NodeSpec.ENTER)[0]
+        self._move(course_instance, enter)
+        self._run_transition(course_instance, compiled_spec.outbounds(enter)[0])
+        return course_instance
+
+    def _move(self, course_instance, node):
+        compiled_spec = self.compiled_spec
+        code = self._code(node)
+        self.visited.append(Visit(course_instance.path, code))
+        handler = compiled_spec.path(compiled_spec.node_landing_handlers[node])
+        if handler:
+            if self.run_handlers:
+                self._invoke('landing_handler', handler, course_instance, self.document, self.user)
+            else:
+                self.calls.append(Call('landing_handler', handler.path, course_instance.path, None))
+        if self._type(node) in (models.NodeSpec.INPUT, models.NodeSpec.SPLIT, models.NodeSpec.EXIT,
+                                models.NodeSpec.CANCEL, models.NodeSpec.JOINED):
+            if course_instance.node is not None:
+                self.writes.append(Write('delete', 'NodeInstance', course_instance.path,
+                                         self._code(course_instance.node)))
+            # Leaving a split node removes its branches, like the cascade does.
+            course_instance.branches = []
+            branches = compiled_spec.branches(node) if self._type(node) == models.NodeSpec.SPLIT else ()
+            course_instance.node = node
+            course_instance.branch_count, course_instance.terminated_count = len(branches), 0
+            self.writes.append(Write('create', 'NodeInstance', course_instance.path, code))
+            self.writes.append(Write('update', 'WorkflowInstance', course_instance.path, code))
+            self.writes.append(Write('create', 'CourseInstanceLog', course_instance.path, code))
+            for branch in branches:
+                self._instantiate_course(branch, course_instance)
+
+    def _terminate(self, course_instances, node_type, level=0):
+        compiled_spec = self.compiled_spec
+        targets = []
+
+        def collect(current, current_level):
+            if self._is_terminated(current):
+                return
+            if self._is(current, models.NodeSpec.SPLIT):
+                for branch in current.branches:
+                    collect(branch, current_level + 1)
+            targets.append((current, current_level, decisions.terminal_node(compiled_spec, current.course, node_type,
+                                                                            compiled_spec)))
+
+        for course_instance in course_instances:
+            collect(course_instance, level)
+
+        for current, current_level, node in targets:
+            code = self._code(node)
+            self.visited.append(Visit(current.path, code))
+            handler = compiled_spec.path(compiled_spec.node_landing_handlers[node])
+            if handler and self.run_handlers:
+                self._invoke('landing_handler', handler, current, self.document, self.user)
+            elif handler:
+                self.calls.append(Call('landing_handler', handler.path, current.path, None))
+            self.writes.append(Write('update' if current.node is not None else 'create', 'NodeInstance',
+                                     current.path, code))
+            self.writes.append(Write('create', 'CourseInstanceLog', current.path, code))
+            self.writes.append(Write('update', 'CourseInstance', current.path, code))
+            if current.branches:
+                # The branches of a terminated split are deleted, like the runner does.
+                self.writes.append(Write('delete', 'CourseInstance', current.path, None))
+                current.branches = []
+            current.node, current.term_level = node, current_level
+            current.branch_count = current.terminated_count = 0
+        if targets:
+            self.writes.append(Write('update', 'WorkflowInstance', targets[-1][0].path, None))
+
+    def _run_transition(self, course_instance, transition):
+        compiled_spec = self.compiled_spec
+        destination = compiled_spec.transition_destinations[transition]
+        self._move(course_instance, destination)
+        type_ = self._type(destination)
+        if type_ == models.NodeSpec.EXIT:
+            if course_instance.parent is not None:
+                self._test_split_branch_reached(course_instance.parent, course_instance)
+        elif type_ == models.NodeSpec.STEP:
+            self._run_transition(course_instance, compiled_spec.outbounds(destination)[0])
+        elif type_ == models.NodeSpec.MULTIPLEXER:
+            self._run_transition(course_instance, decisions.pick_outbound(
+                compiled_spec, destination,
+                lambda condition: self._invoke('condition', condition, course_instance, self.document, self.user),
+                compiled_spec
+            ))
+
+    def _test_split_branch_reached(self, course_instance, reaching_branch):
+        compiled_spec = self.compiled_spec
+        node = course_instance.node
+        outbounds = compiled_spec.outbounds(node)
+        joiner = compiled_spec.path(compiled_spec.node_joiners[node])
+        course_instance.terminated_count += 1
+        self.writes.append(Write('update', 'NodeInstance', course_instance.path, self._code(node)))
+        if not joiner:
+            if course_instance.terminated_count >= course_instance.branch_count:
+                self._run_transition(course_instance, outbounds[0])
+            return
+
+        branch_statuses = {branch.code: self._exit_code(branch) for branch in course_instance.branches}
+        returned = self._invoke('joiner', joiner, course_instance, self.document, branch_statuses,
+                                reaching_branch.code)
+        transition = decisions.join_outbound(compiled_spec, node, returned, branch_statuses, compiled_spec)
+        if transition is not None:
+            self._terminate([branch for branch in course_instance.branches if branch_statuses[branch.code] is None],
+                            models.NodeSpec.JOINED)
+            self._run_transition(course_instance, transition)
+
+    # Public interface.
+
+    def start(self):
+        """
+        Starts the simulated workflow by its main course.
+        """
+
+        if self.root is not None:
+            raise exceptions.WorkflowInstanceNotPending(
+                self.compiled_spec, _('The specified course instance cannot be started because it is not pending')
+            )
+        self.root = self._instantiate_course(self._main_course(), None)
+
+    def execute(self, action_name, path=''):
+        """
+        Executes an action in the simulated workflow by its main course, or in a course given by its path.
+        :param action_name: The name of the action (transition) to execute.
+        :param path: Optional path to a course in this simulation.
+        """
+
+        course_instance = self._find_course(path)
+        if not self._is(course_instance, models.NodeSpec.INPUT):
+            raise exceptions.WorkflowCourseInstanceNotWaiting(
+                self.compiled_spec, _('No action can be executed in the specified course instance because it is not '
+                                   'waiting for an action to be taken')
+            )
+        compiled_spec = self.compiled_spec
+        for transition in compiled_spec.outbounds(course_instance.node):
+            if compiled_spec.string(compiled_spec.transition_action_names[transition]) == action_name:
+                self._run_transition(course_instance, transition)
+                break
+        else:
+            raise exceptions.WorkflowCourseNodeTransitionDoesNotExist(compiled_spec, action_name)
+
+    def cancel(self, path=''):
+        """
+        Cancels the simulated workflow entirely (by its main course), or a course given by its path.
+        :param path: Optional path to a course in this simulation.
+        """
+
+        course_instance = self._find_course(path)
+        if self._is_terminated(course_instance):
+            raise exceptions.WorkflowCourseInstanceAlreadyTerminated(
+                self.compiled_spec, _('Cannot cancel this instance because it is already terminated')
+            )
+        self._terminate([course_instance], models.NodeSpec.CANCEL)
+        if course_instance.parent is not None:
+            self._test_split_branch_reached(course_instance.parent, course_instance)
+
+    def get_workflow_status(self):
+        """
+        Gets the status of each course in the simulated workflow.
+        :return: A dictionary like the one of Workflow.get_workflow_status().
+        """
+
+        result = {}
+
+        def traverse(course_instance):
+            if self._is(course_instance, models.NodeSpec.SPLIT):
+                result[course_instance.path] = ('splitting', None)
+                for branch in course_instance.branches:
+                    traverse(branch)
+            elif self._is(course_instance, models.NodeSpec.INPUT):
+                result[course_instance.path] = ('waiting', self._code(course_instance.node))
+            elif self._is(course_instance, models.NodeSpec.CANCEL):
+                result[course_instance.path] = ('cancelled', -1)
+            elif self._is(course_instance, models.NodeSpec.EXIT):
+                result[course_instance.path] = ('ended', self._exit_code(course_instance))
+            elif self._is(course_instance, models.NodeSpec.JOINED):
+                result[course_instance.path] = ('joined', -1)
+
+        if self.root is not None:
+            traverse(self.root)
+        return result
+
+    def get_available_actions(self):
+        """
+        Gets the action names available in each waiting course of the simulated workflow (permissions
+          are not considered). Useful to enumerate paths or to fuzz a spec.
+        :return: A dictionary of 'course.path' => [action names].
+        """
+
+        compiled_spec = self.compiled_spec
+        return {path: [compiled_spec.string(compiled_spec.transition_action_names[transition])
+                       for transition in compiled_spec.outbounds(self._find_course(path).node)]
+                for path, (status, code) in self.get_workflow_status().items() if status == 'waiting'}
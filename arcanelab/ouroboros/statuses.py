@@ -0,0 +1,52 @@
+###################################################################################
+#                                                                                 #
+# Optional cache of workflow status snapshots, shared among processes by using    #
+#   one of Django's caches (the one named by the OUROBOROS_STATUS_CACHE setting). #
+#                                                                                 #
+# Snapshots are keyed by the workflow instance and its status version, which is   #
+#   bumped each time a node instance is persisted. Stale snapshots are never read #
+#   again, so they just expire (after OUROBOROS_STATUS_CACHE_TIMEOUT seconds, or  #
+#   the cache's default timeout).                                                 #
+#                                                                                 #
+###################################################################################
+
+from __future__ import unicode_literals
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+
+def _status_cache():
+    alias = getattr(settings, 'OUROBOROS_STATUS_CACHE', None)
+    return caches[alias] if alias else None
+
+
+def _key(workflow_instance):
+    # The creation date protects against ids being reused (e.g. after rolled back transactions).
+    return 'ouroboros:status:%s:%s:%s' % (workflow_instance.pk, workflow_instance.created_on.isoformat(),
+                                          workflow_instance.status_version)
+
+
+def get_many(workflow_instances, compute):
+    """
+    Gets the status snapshots of many workflow instances, with one round trip to the cache.
+      Snapshots not being in the cache are computed and stored (with one more round trip).
+      When the status cache is not configured, every snapshot is computed.
+    :param workflow_instances: The workflow instances to get the snapshots of. Their status
+      versions must be up to date.
+    :param compute: A callable computing the snapshot of a single workflow instance.
+    :return: A list with the snapshots, in the same order of the workflow instances.
+    """
+
+    cache = _status_cache()
+    if cache is None:
+        return [compute(workflow_instance) for workflow_instance in workflow_instances]
+    keys = [_key(workflow_instance) for workflow_instance in workflow_instances]
+    found = cache.get_many(keys)
+    missing = {}
+    for key, workflow_instance in zip(keys, workflow_instances):
+        if key not in found:
+            found[key] = missing[key] = compute(workflow_instance)
+    if missing:
+        cache.set_many(missing, getattr(settings, 'OUROBOROS_STATUS_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
+    return [found[key] for key in keys]
@@ -0,0 +1,93 @@
+###################################################################################
+#                                                                                 #
+# Timer transitions: outbound transitions of INPUT nodes may have a timeout. When #
+#   a course lands in such node, a NodeTimer row is created for each of them with #
+#   its due date, and it is deleted along with the node instance when the course  #
+#   leaves the node. The scheduler only reads the due rows, by the index on the   #
+#   due date, so the amount of pending timers (or instances) does not matter.     #
+#                                                                                 #
+# Batches of due timers are locked with SKIP LOCKED where the database supports   #
+#   it, so many schedulers can run at once without picking the same timers.       #
+#                                                                                 #
+###################################################################################
+
+from __future__ import unicode_literals
+from collections import namedtuple
+from datetime import timedelta
+from django.conf import settings
+from django.db import connections, router
+from . import models
+
+
+# The outcome of a batch of due timers: how many were fired, postponed and discarded, and whether
+#   the batch was full (in any shard), so more timers may be due.
+Batch = namedtuple('Batch', ('fired', 'postponed', 'discarded', 'full'))
+
+
+def _retry_delay():
+    return timedelta(seconds=getattr(settings, 'OUROBOROS_TIMER_RETRY_DELAY', 300))
+
+
+def pending(compiled_spec, node_instance, since):
+    """
+    Builds the (unsaved) timers of a node instance.
+    :param compiled_spec: The compiled spec of the workflow instance.
+    :param node_instance: The node instance.
+    :param since: The date the course landed in the node.
+    :return: A list of NodeTimer instances (empty if the node has no timer transitions).
+    """
+
+    return [models.NodeTimer(node_instance=node_instance, transition_spec_id=compiled_spec.transition_ids[transition],
+                             due_on=since + timedelta(seconds=timeout))
+            for transition, timeout in compiled_spec.timers(compiled_spec.node_index(node_instance.node_spec_id))]
+
+
+def schedule(timers):
+    """
+    Saves timers (in the current transaction).
+    :param timers: A list of unsaved NodeTimer instances.
+    """
+
+    if timers:
+        models.NodeTimer.objects.bulk_create(timers)
+
+
+def discard(course_instance_ids):
+    """
+    Deletes the timers of the node instances of some course instances (used when node instances are
+      updated in place instead of being replaced).
+    :param course_instance_ids: The ids of the course instances.
+    """
+
+    models.NodeTimer.objects.filter(node_instance__course_instance__in=course_instance_ids).delete()
+
+
+def lock_due(stamp, batch_size=100):
+    """
+    Locks and gets a batch of due timers, by due date. Must be called inside a transaction, which
+      keeps the lock. The ids are locked first, and then the timers are loaded along with their node
+      instances, courses and transitions (so the related rows are not locked).
+    :param stamp: The current date.
+    :param batch_size: The maximum number of timers to get.
+    :return: A list of NodeTimer instances.
+    """
+
+    features = connections[router.db_for_write(models.NodeTimer)].features
+    ids = list(models.NodeTimer.objects.select_for_update(
+        skip_locked=features.has_select_for_update_skip_locked
+    ).filter(due_on__lte=stamp).order_by('due_on').values_list('id', flat=True)[:batch_size])
+    return list(models.NodeTimer.objects.filter(id__in=ids).select_related(
+        'node_instance__course_instance__workflow_instance', 'transition_spec'
+    ).order_by('due_on', 'id'))
+
+
+def postpone(timer, stamp):
+    """
+    Delays a timer which could not run, by the OUROBOROS_TIMER_RETRY_DELAY setting (in seconds,
+      300 by default).
+    :param timer: The timer.
+    :param stamp: The current date.
+    """
+
+    timer.due_on = stamp + _retry_delay()
+    timer.save(update_fields=['due_on'])
@@ -0,0 +1,130 @@
+###################################################################################
+#                                                                                 #
+# Worker pool for queued actions. Workers claim batches of workflow instances     #
+#   having pending actions (locking the workflow instances with SKIP LOCKED where #
+#   the database supports it), and then execute all the claimed actions of each   #
+#   instance, in order. An instance is not claimed again while a worker holds a   #
+#   fresh claim on it, so each instance is handled by a single worker at a time.  #
+#                                                                                 #
+# Claims older than the OUROBOROS_QUEUE_CLAIM_TIMEOUT setting (in seconds, 600 by #
+#   default) are considered abandoned (e.g. the worker died) and can be claimed   #
+#   again. Each action is marked as done in the transaction executing it.         #
+#                                                                                 #
+###################################################################################
+
+from __future__ import unicode_literals
+from datetime import timedelta
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import Q
+from django.db.transaction import atomic
+from django.utils.six import text_type
+from django.utils.timezone import now
+from .executors import Workflow
+from . import models
+import time
+
+
+def _claim_timeout():
+    return timedelta(seconds=getattr(settings, 'OUROBOROS_QUEUE_CLAIM_TIMEOUT', 600))
+
+
+def claim(worker, batch_size=50):
+    """
+    Claims the pending actions of up to `batch_size` workflow instances.
+    :param worker: The name of the claiming worker.
+    :param batch_size: The maximum number of workflow instances to claim.
+    :return: A list of (workflow instance, list of queued actions) pairs, in order of their first
+      action, with the actions in order.
+    """
+
+    stamp = now()
+    stale = stamp - _claim_timeout()
+    claimable = Q(status=models.QueuedAction.PENDING) | Q(status=models.QueuedAction.CLAIMED, claimed_on__lt=stale)
+
+    def busy():
+        return models.QueuedAction.objects.filter(status=models.QueuedAction.CLAIMED,
+                                                  claimed_on__gte=stale).values('workflow_instance_id')
+
+    features = connections[router.db_for_write(models.WorkflowInstance)].features
+    with atomic():
+        candidates = []
+        for workflow_instance_id in models.QueuedAction.objects.filter(claimable).exclude(
+            workflow_instance_id__in=busy()
+        ).order_by('id').values_list('workflow_instance_id', flat=True)[:batch_size * 10]:
+            if workflow_instance_id not in candidates:
+                candidates.append(workflow_instance_id)
+                if len(candidates) == batch_size:
+                    break
+        if not candidates:
+            return []
+        # Locking the instances, and then checking again that no other worker claimed them meanwhile.
+        locked = models.WorkflowInstance.objects.select_for_update(
+            skip_locked=features.has_select_for_update_skip_locked
+        ).filter(pk__in=candidates).exclude(pk__in=busy())
+        ids = list(locked.values_list('pk', flat=True))
+        models.QueuedAction.objects.filter(claimable, workflow_instance_id__in=ids).update(
+            status=models.QueuedAction.CLAIMED, worker=worker, claimed_on=stamp
+        )
+    groups = {}
+    for action in models.QueuedAction.objects.filter(
+        status=models.QueuedAction.CLAIMED, worker=worker, claimed_on=stamp, workflow_instance_id__in=ids
+    ).select_related('workflow_instance__workflow_spec', 'user').order_by('id'):
+        groups.setdefault(action.workflow_instance_id, (action.workflow_instance, []))[1].append(action)
+    return sorted(groups.values(), key=lambda group: group[1][0].id)
+
+
+def process(workflow_instance, actions):
+    """
+    Executes the claimed actions of a workflow instance, in order. Each action is marked as done in
+      the same transaction executing it, or marked as failed (with the error) otherwise.
+    :param workflow_instance: The workflow instance.
+    :param actions: The claimed actions.
+    :return: The number of failed actions.
+    """
+
+    workflow = Workflow(workflow_instance)
+    failed = 0
+    for action in actions:
+        try:
+            with atomic():
+                workflow.execute(action.user, action.action_name, action.path)
+                models.QueuedAction.objects.filter(pk=action.pk).update(status=models.QueuedAction.DONE,
+                                                                        processed_on=now())
+        except Exception as error:
+            models.QueuedAction.objects.filter(pk=action.pk).update(
+                status=models.QueuedAction.FAILED, processed_on=now(),
+                error='%s: %s' % (type(error).__name__, text_type(error))
+            )
+            failed += 1
+    return failed
+
+
+def run(worker, batch_size=50, idle=0, poll=1.0):
+    """
+    Claims and processes batches until no action is pending for `idle` seconds.
+    :param worker: The name of this worker.
+    :param batch_size: The maximum number of workflow instances by batch.
+    :param idle: How many seconds to keep polling, while no action is pending, before returning.
+    :param poll: How many seconds to wait between polls.
+    :return: A dictionary with the throughput of this worker: 'worker', 'batches', 'instances',
+      'actions', 'failed' and 'elapsed' (seconds).
+    """
+
+    stats = {'worker': worker, 'batches': 0, 'instances': 0, 'actions': 0, 'failed': 0}
+    started = last_work = time.time()
+    while True:
+        batch = claim(worker, batch_size)
+        if batch:
+            stats['batches'] += 1
+            for workflow_instance, actions in batch:
+                stats['instances'] += 1
+                stats['actions'] += len(actions)
+                stats['failed'] += process(workflow_instance, actions)
+            last_work = time.time()
+        elif time.time() - last_work >= idle:
+            break
+        else:
+            time.sleep(poll)
+    stats['elapsed'] = time.time() - started
+    return stats
@@ -1,6 +1,9 @@
+from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 from django.test import TestCase
-from sample.models import Task
+from arcanelab.ouroboros.executors import Workflow
+from arcanelab.ouroboros.models import NodeSpec
+from sample.models import Task, Area
 
 
 def dummy_joiner(*args):
@@ -45,6 +48,15 @@ def invoice_control_joiner(task, branches, reached):
         return None
 
 
+def review_joiner(task, branches, reached):
+    if 101 in branches.values():
+        return 'rejected'
+    elif all(status is not None for status in branches.values()):
+        return 'approved'
+    else:
+        return None
+
+
 def is_deliverable(document, user):
     return document.service_type == Task.DELIVERABLE
 
@@ -57,11 +69,166 @@ def is_service(document, user):
     return document.service_type == Task.SERVICE
 
 
+# Documents being tested by is_service_counted, in order.
+SERVICE_CHECKS = []
+
+
+def is_service_counted(document, user):
+    SERVICE_CHECKS.append(document.pk)
+    return document.service_type == Task.SERVICE
+
+
 def on_pending_delivery(document, user):
     document.content += ' Pending Delivery'
     document.save()
 
 
+def approval_spec_data(code='approval-flow'):
+    """
+    A spec having a main course waiting for input, and then splitting into two
+      parallel branches (approval, audit) resolved by approve_audit_joiner.
+    """
+
+    return {'model': 'sample.Task', 'code': code, 'name': 'Approval Flow',
+            'create_permission': '', 'cancel_permission': '',
+            'courses': [{
+                'code': '', 'name': 'Main',
+                'nodes': [{
+                    'type': NodeSpec.ENTER, 'code': 'origin', 'name': 'Origin',
+                }, {
+                    'type': NodeSpec.INPUT, 'code': 'created', 'name': 'Created',
+                }, {
+                    'type': NodeSpec.SPLIT, 'code': 'approve-audit', 'name': 'Split Audit/Approve',
+                    'branches': ['approval', 'audit'], 'joiner': 'sample.support.approve_audit_joiner'
+                }, {
+                    'type': NodeSpec.EXIT, 'code': 'was-rejected', 'name': 'Was Rejected', 'exit_value': 100,
+                }, {
+                    'type': NodeSpec.EXIT, 'code': 'was-satisfied', 'name': 'Was Satisfied', 'exit_value': 101,
+                }, {
+                    'type': NodeSpec.CANCEL, 'code': 'cancel', 'name': 'Cancel',
+                }],
+                'transitions': [{
+                    'origin': 'origin', 'destination': 'created', 'name': 'Enter',
+                }, {
+                    'origin': 'created', 'destination': 'approve-audit', 'name': 'Submit', 'action_name': 'submit',
+                }, {
+                    'origin': 'approve-audit', 'destination': 'was-rejected', 'name': 'Rejected',
+                    'action_name': 'rejected'
+                }, {
+                    'origin': 'approve-audit', 'destination': 'was-satisfied', 'name': 'Satisfied',
+                    'action_name': 'satisfied'
+                }]
+            }, {
+                'code': 'approval', 'name': 'Approval',
+                'nodes': [{
+                    'type': NodeSpec.ENTER, 'code': 'origin', 'name': 'Origin',
+                }, {
+                    'type': NodeSpec.INPUT, 'code': 'pending-approval', 'name': 'Pending Approval',
+                }, {
+                    'type': NodeSpec.EXIT, 'code': 'approved', 'name': 'Approved', 'exit_value': 101,
+                }, {
+                    'type': NodeSpec.EXIT, 'code': 'rejected', 'name': 'Rejected', 'exit_value': 102,
+                }, {
+                    'type': NodeSpec.CANCEL, 'code': 'cancel', 'name': 'Cancel',
+                }, {
+                    'type': NodeSpec.JOINED, 'code': 'joined', 'name': 'Joined',
+                }],
+                'transitions': [{
+                    'origin': 'origin', 'destination': 'pending-approval', 'name': 'Enter'
+                }, {
+                    'origin': 'pending-approval', 'destination': 'approved', 'name': 'Approve',
+                    'action_name': 'approve'
+                }, {
+                    'origin': 'pending-approval', 'destination': 'rejected', 'name': 'Reject',
+                    'action_name': 'reject'
+                }]
+            }, {
+                'code': 'audit', 'name': 'Audit',
+                'nodes': [{
+                    'type': NodeSpec.ENTER, 'code': 'origin', 'name': 'Origin',
+                }, {
+                    'type': NodeSpec.INPUT, 'code': 'pending-audit', 'name': 'Pending Audit',
+                }, {
+                    'type': NodeSpec.EXIT, 'code': 'audited', 'name': 'Audited', 'exit_value': 103,
+                }, {
+                    'type': NodeSpec.CANCEL, 'code': 'cancel', 'name': 'Cancel',
+                }, {
+                    'type': NodeSpec.JOINED, 'code': 'joined', 'name': 'Joined',
+                }],
+                'transitions': [{
+                    'origin': 'origin', 'destination': 'pending-audit', 'name': 'Enter'
+                }, {
+                    'origin': 'pending-audit', 'destination': 'audited', 'name': 'Audit', 'action_name': 'audit'
+                }]
+            }]}
+
+
+def wide_split_spec_data(width, code='review-flow', joiner=True):
+    """
+    A spec having a main course waiting for input, and then splitting into `width`
+      parallel review branches (r0, r1, ...) resolved by review_joiner or, if no
+      joiner is requested, just waiting for all of them to end.
+    """
+
+    branches = ['r%d' % index for index in range(width)]
+    ends = [{
+        'type': NodeSpec.EXIT, 'code': 'was-approved', 'name': 'Was Approved', 'exit_value': 100,
+    }]
+    if joiner:
+        split = {'type': NodeSpec.SPLIT, 'code': 'review', 'name': 'Review',
+                 'branches': branches, 'joiner': 'sample.support.review_joiner'}
+        ends.append({'type': NodeSpec.EXIT, 'code': 'was-rejected', 'name': 'Was Rejected', 'exit_value': 101})
+        split_transitions = [{
+            'origin': 'review', 'destination': 'was-approved', 'name': 'Approved', 'action_name': 'approved'
+        }, {
+            'origin': 'review', 'destination': 'was-rejected', 'name': 'Rejected', 'action_name': 'rejected'
+        }]
+    else:
+        split = {'type': NodeSpec.SPLIT, 'code': 'review', 'name': 'Review', 'branches': branches}
+        split_transitions = [{
+            'origin': 'review', 'destination': 'was-approved', 'name': 'Reviewed', 'action_name': 'reviewed'
+        }]
+    return {'model': 'sample.Task', 'code': code, 'name': 'Review Flow',
+            'create_permission': '', 'cancel_permission': '',
+            'courses': [{
+                'code': '', 'name': 'Main',
+                'nodes': [{
+                    'type': NodeSpec.ENTER, 'code': 'origin', 'name': 'Origin',
+                }, {
+                    'type': NodeSpec.INPUT, 'code': 'created', 'name': 'Created',
+                }, split] + ends + [{
+                    'type': NodeSpec.CANCEL, 'code': 'cancel', 'name': 'Cancel',
+                }],
+                'transitions': [{
+                    'origin': 'origin', 'destination': 'created', 'name': 'Enter',
+                }, {
+                    'origin': 'created', 'destination': 'review', 'name': 'Submit', 'action_name': 'submit',
+                }] + split_transitions
+            }] + [{
+                'code': branch, 'name': 'Review %s' % branch,
+                'nodes': [{
+                    'type': NodeSpec.ENTER, 'code': 'origin', 'name': 'Origin',
+                }, {
+                    'type': NodeSpec.INPUT, 'code': 'pending', 'name': 'Pending',
+                }, {
+                    'type': NodeSpec.EXIT, 'code': 'approved', 'name': 'Approved', 'exit_value': 100,
+                }, {
+                    'type': NodeSpec.EXIT, 'code': 'rejected', 'name': 'Rejected', 'exit_value': 101,
+                }, {
+                    'type': NodeSpec.CANCEL, 'code': 'cancel', 'name': 'Cancel',
+                }, {
+                    'type': NodeSpec.JOINED, 'code': 'joined', 'name': 'Joined',
+                }],
+                'transitions': [{
+                    'origin': 'origin', 'destination': 'pending', 'name': 'Enter'
+                }, {
+                    'origin': 'pending', 'destination': 'approved', 'name': 'Approve', 'action_name': 'approve'
+                }, {
+                    'origin': 'pending', 'destination': 'rejected', 'name': 'Reject', 'action_name': 'reject'
+                }]
+            } for branch in branches]}
+
+
 class ValidationErrorWrappingTestCase(TestCase):
 
     def unwrapValidationError(self, exception, field='__all__'):
@@ -73,3 +240,26 @@ class ValidationErrorWrappingTestCase(TestCase):
         self.assertIsInstance(ed_items[field][0], ValidationError, 'The raised ValidationError has a non-list object in'
                                                                    ' %s' % field)
         return ed_items[field][0]
+
+
+class ApprovalWorkflowTestCase(ValidationErrorWrappingTestCase):
+    """
+    Sets up a user ('foo'), an area headed by it and, unless `install_approval` is False, the
+      approval workflow spec (installed and published, as `self.workflow`). Tasks are created
+      by `_task()`, with the same user in every role.
+    """
+
+    install_approval = True
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user('foo', 'foo@example.com', 'foo1')
+        self.area = Area.objects.create(head=self.user)
+        if self.install_approval:
+            self.workflow = Workflow.Spec.install(approval_spec_data(), publish=True)
+
+    def _task(self, title='Sample', service_type=Task.SERVICE):
+        return Task.objects.create(area=self.area, service_type=service_type, title=title,
+                                   content='Lorem ipsum dolor sit amet', performer=self.user, reviewer=self.user,
+                                   accountant=self.user, auditor=self.user, dispatcher=self.user,
+                                   attendant=self.user)
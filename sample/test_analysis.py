@@ -0,0 +1,160 @@
+from __future__ import unicode_literals
+from arcanelab.ouroboros import analysis
+from arcanelab.ouroboros.executors import Workflow
+from arcanelab.ouroboros.models import NodeSpec
+from .support import ApprovalWorkflowTestCase, approval_spec_data
+from .models import Task
+
+
+def loop_spec_data():
+    return {'model': 'sample.Task', 'code': 'loop', 'name': 'Loop',
+            'create_permission': '', 'cancel_permission': '',
+            'courses': [{
+                'code': '', 'name': 'Main',
+                'nodes': [{
+                    'type': NodeSpec.ENTER, 'code': 'origin', 'name': 'Origin',
+                }, {
+                    'type': NodeSpec.INPUT, 'code': 'created', 'name': 'Created',
+                }, {
+                    'type': NodeSpec.INPUT, 'code': 'reviewing', 'name': 'Reviewing',
+                }, {
+                    'type': NodeSpec.EXIT, 'code': 'done', 'name': 'Done', 'exit_value': 100,
+                }, {
+                    'type': NodeSpec.CANCEL, 'code': 'cancel', 'name': 'Cancel',
+                }],
+                'transitions': [{
+                    'origin': 'origin', 'destination': 'created', 'name': 'Enter',
+                }, {
+                    'origin': 'created', 'destination': 'reviewing', 'name': 'Review', 'action_name': 'review',
+                }, {
+                    'origin': 'reviewing', 'destination': 'created', 'name': 'Reject', 'action_name': 'reject',
+                }, {
+                    'origin': 'reviewing', 'destination': 'done', 'name': 'Accept', 'action_name': 'accept',
+                }]
+            }]}
+
+
+def routing_spec_data():
+    return {'model': 'sample.Task', 'code': 'routing', 'name': 'Routing',
+            'create_permission': '', 'cancel_permission': '',
+            'courses': [{
+                'code': '', 'name': 'Main',
+                'nodes': [{
+                    'type': NodeSpec.ENTER, 'code': 'origin', 'name': 'Origin',
+                }, {
+                    'type': NodeSpec.INPUT, 'code': 'created', 'name': 'Created',
+                }, {
+                    'type': NodeSpec.MULTIPLEXER, 'code': 'first-routing', 'name': 'First Routing',
+                }, {
+                    'type': NodeSpec.MULTIPLEXER, 'code': 'second-routing', 'name': 'Second Routing',
+                }, {
+                    'type': NodeSpec.EXIT, 'code': 'service', 'name': 'Service', 'exit_value': 100,
+                }, {
+                    'type': NodeSpec.EXIT, 'code': 'non-deliverable', 'name': 'Non Deliverable', 'exit_value': 101,
+                }, {
+                    'type': NodeSpec.CANCEL, 'code': 'cancel', 'name': 'Cancel',
+                }],
+                'transitions': [{
+                    'origin': 'origin', 'destination': 'created', 'name': 'Enter',
+                }, {
+                    'origin': 'created', 'destination': 'first-routing', 'name': 'Route', 'action_name': 'route',
+                }, {
+                    'origin': 'first-routing', 'destination': 'non-deliverable', 'name': 'Is Non Deliverable',
+                    'condition': ['service_type', '=', Task.NON_DELIVERABLE], 'priority': 1,
+                }, {
+                    'origin': 'first-routing', 'destination': 'second-routing', 'name': 'Is Other',
+                    'condition': ['service_type', '!=', Task.NON_DELIVERABLE], 'priority': 2,
+                }, {
+                    'origin': 'second-routing', 'destination': 'service', 'name': 'Is Service',
+                    'condition': ['service_type', '=', Task.SERVICE], 'priority': 1,
+                }, {
+                    'origin': 'second-routing', 'destination': 'non-deliverable', 'name': 'Is Non Deliverable',
+                    'condition': ['service_type', '!=', Task.SERVICE], 'priority': 2,
+                }]
+            }]}
+
+
+class AnalysisTestCase(ApprovalWorkflowTestCase):
+
+    install_approval = False
+
+    def test_approval_report(self):
+        workflow = Workflow.Spec.install(approval_spec_data(), publish=True)
+        report = workflow.analyze()
+        main = report['courses']['']
+        self.assertEqual(len(main['paths']), 2)
+        self.assertEqual(main['condensed_path_count'], 2)
+        self.assertFalse(main['cyclic'])
+        self.assertEqual(main['dominators']['was-rejected'], 'approve-audit')
+        self.assertEqual(main['dominators']['approve-audit'], 'created')
+        self.assertEqual(main['splits'], {'approve-audit': {
+            'branches': {'approval': [-1, 101, 102], 'audit': [-1, 103]}, 'combinations': 6
+        }})
+        self.assertEqual(len(report['courses']['approval']['paths']), 2)
+        self.assertTrue(all(row['paths'] and not row['hits'] for row in report['coverage']))
+
+    def test_coverage_from_logs(self):
+        workflow = Workflow.Spec.install(approval_spec_data(), publish=True)
+        instance = workflow.instantiate(self.user, self._task())
+        instance.start(self.user)
+        instance.execute(self.user, 'submit')
+        instance.execute(self.user, 'reject', 'approval')
+        rows = {(row['course'], row['origin'], row['destination']): row['hits']
+                for row in workflow.analyze(logs=True)['coverage']}
+        # The branches are removed with their logs once the split is left.
+        self.assertEqual(rows, {('', 'origin', 'created'): 1, ('', 'created', 'approve-audit'): 1,
+                                ('', 'approve-audit', 'was-rejected'): 1, ('', 'approve-audit', 'was-satisfied'): 0,
+                                ('approval', 'origin', 'pending-approval'): 0,
+                                ('approval', 'pending-approval', 'approved'): 0,
+                                ('approval', 'pending-approval', 'rejected'): 0,
+                                ('audit', 'origin', 'pending-audit'): 0, ('audit', 'pending-audit', 'audited'): 0})
+
+    def test_coverage_of_ambiguous_segments(self):
+        # Both routes lead from created to non-deliverable through automatic nodes only: the logged
+        #   transition tells which one was taken.
+        workflow = Workflow.Spec.install(routing_spec_data(), publish=True)
+        task = self._task()
+        Task.objects.filter(pk=task.pk).update(service_type=Task.NON_DELIVERABLE)
+        instance = workflow.instantiate(self.user, Task.objects.get(pk=task.pk))
+        instance.start(self.user)
+        instance.execute(self.user, 'route')
+        rows = {(row['origin'], row['destination']): row['hits'] for row in workflow.analyze(logs=True)['coverage']}
+        self.assertEqual(rows, {('origin', 'created'): 1, ('created', 'first-routing'): 1,
+                                ('first-routing', 'non-deliverable'): 1, ('first-routing', 'second-routing'): 0,
+                                ('second-routing', 'service'): 0, ('second-routing', 'non-deliverable'): 0})
+        # Without the transitions, only the shared ones are counted.
+        report = analysis.report(workflow.compiled(), [[(landing[0], None, landing[2]) for landing in trace]
+                                                       for trace in analysis.log_traces(workflow.spec)])
+        self.assertEqual(sum(row['hits'] for row in report['coverage']), 2)
+
+    def test_coverage_of_migrated_instances(self):
+        first = Workflow.Spec.install(approval_spec_data(), publish=True)
+        instance = first.instantiate(self.user, self._task())
+        instance.start(self.user)
+        instance.execute(self.user, 'submit')
+        second = Workflow.Spec.install(approval_spec_data(), publish=True)
+        first.migrate_instances(second)
+        Workflow.get(instance.instance.document).execute(self.user, 'approve', 'approval')
+
+        def hits(workflow):
+            return {(row['course'], row['origin'], row['destination']) for row in
+                    workflow.analyze(logs=True)['coverage'] if row['hits']}
+
+        # Each version only counts the landings in its own nodes.
+        self.assertEqual(hits(first), {('', 'origin', 'created'), ('', 'created', 'approve-audit'),
+                                       ('approval', 'origin', 'pending-approval'),
+                                       ('audit', 'origin', 'pending-audit')})
+        self.assertEqual(hits(second), {('approval', 'pending-approval', 'approved')})
+
+    def test_cycles_are_bounded(self):
+        compiled_spec = Workflow.Spec.install(loop_spec_data(), publish=True).compiled()
+        course = compiled_spec.find_course('')
+        self.assertEqual(len(list(analysis.enumerate_paths(compiled_spec, course))), 1)
+        self.assertEqual(len(list(analysis.enumerate_paths(compiled_spec, course, 3))), 3)
+        self.assertEqual(len(list(analysis.enumerate_paths(compiled_spec, course, 3, limit=2))), 2)
+        self.assertEqual(analysis.count_paths(compiled_spec, course), 1)
+        component, edges = analysis.condensation(compiled_spec, course)
+        created = compiled_spec.find_node(course, 'created')
+        self.assertEqual(component[created], component[compiled_spec.find_node(course, 'reviewing')])
+        idom = analysis.dominators(compiled_spec, course)
+        self.assertEqual(idom[compiled_spec.find_node(course, 'done')], compiled_spec.find_node(course, 'reviewing'))
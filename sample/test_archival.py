@@ -0,0 +1,84 @@
+from __future__ import unicode_literals
+from datetime import timedelta
+from django.core.management import call_command
+from django.db import transaction
+from django.utils.six import StringIO
+from django.utils.timezone import now
+from arcanelab.ouroboros import archival
+from arcanelab.ouroboros.models import NodeInstance, CourseInstanceLog, CourseInstanceLogArchive
+from .support import ApprovalWorkflowTestCase
+import os
+import shutil
+import tempfile
+
+
+class LogArchivalTestCase(ApprovalWorkflowTestCase):
+
+    def setUp(self):
+        super(LogArchivalTestCase, self).setUp()
+        self.instances = []
+        for index in range(4):
+            instance = self.workflow.instantiate(self.user, self._task('Sample %d' % index))
+            instance.start(self.user)
+            instance.execute(self.user, 'submit')
+            self.instances.append(instance)
+        self.instances[0].cancel(self.user)
+        self.instances[1].execute(self.user, 'reject', 'approval')
+        self.instances[2].cancel(self.user)
+        # The first two instances terminated long ago, the third one recently, and the last one is pending.
+        NodeInstance.objects.filter(
+            course_instance__workflow_instance__in=[instance.instance for instance in self.instances[:2]]
+        ).update(created_on=now() - timedelta(days=100))
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _log_counts(self):
+        return [CourseInstanceLog.objects.filter(course_instance__workflow_instance=instance.instance).count()
+                for instance in self.instances]
+
+    def test_archive_into_table(self):
+        counts = self._log_counts()
+        stdout = StringIO()
+        call_command('ouroboros_archive_logs', days=30, batch_size=1, stdout=stdout)
+        self.assertIn('Archived %d logs' % (counts[0] + counts[1]), stdout.getvalue())
+        self.assertEqual(self._log_counts(), [0, 0] + counts[2:])
+        for instance, count in zip(self.instances, counts[:2] + [0, 0]):
+            self.assertEqual(instance.instance.archived_logs.count(), count)
+
+    def test_archive_into_file(self):
+        counts = self._log_counts()
+        path = os.path.join(self.directory, 'logs.jsonl.gz')
+        call_command('ouroboros_archive_logs', days=30, batch_size=1, file=path, stdout=StringIO())
+        self.assertFalse(CourseInstanceLogArchive.objects.exists())
+        self.assertEqual(len(list(archival.read_archive(path))), counts[0] + counts[1])
+        records = list(archival.read_archive(path, self.instances[1].instance.pk))
+        self.assertEqual(len(records), counts[1])
+        self.assertEqual(set(record['user'] for record in records), {self.user.pk})
+
+    def test_archives_keep_the_log_fields(self):
+        logs = sorted(CourseInstanceLog.objects.filter(
+            course_instance__workflow_instance__in=[instance.instance for instance in self.instances[:2]]
+        ).values_list(*archival.FIELDS))
+        self.assertTrue(any(log[-3] is not None for log in logs))
+        self.assertTrue(any(log[-2] is not None for log in logs))
+        with transaction.atomic():
+            list(archival.archive(30))
+            self.assertEqual(sorted(CourseInstanceLogArchive.objects.values_list(*archival.COLUMNS)), logs)
+            transaction.set_rollback(True)
+        path = os.path.join(self.directory, 'logs.jsonl.gz')
+        list(archival.archive(30, path=path))
+        self.assertEqual(sorted(tuple(record[key] for key in archival.KEYS)
+                                for record in archival.read_archive(path)), logs)
+
+    def test_interrupted_runs_are_resumed(self):
+        checkpoint = os.path.join(self.directory, 'checkpoint.json')
+        batches = archival.archive(30, 1, checkpoint=checkpoint)
+        last, count = next(batches)
+        self.assertEqual(last, self.instances[0].instance.pk)
+        batches.close()
+        self.assertTrue(os.path.exists(checkpoint))
+        self.assertEqual([batch[0] for batch in archival.archive(30, 1, checkpoint=checkpoint)],
+                         [self.instances[1].instance.pk])
+        self.assertFalse(os.path.exists(checkpoint))
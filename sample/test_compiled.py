@@ -0,0 +1,156 @@
+from __future__ import unicode_literals
+from io import BytesIO
+from logging.handlers import BufferingHandler
+from django.core.signals import request_started
+from django.test.utils import override_settings
+from arcanelab.ouroboros.executors import Workflow
+from arcanelab.ouroboros.compiled import CompiledSpec
+from arcanelab.ouroboros.models import NodeSpec, WorkflowSpec
+from arcanelab.ouroboros import compiled, exceptions, signals
+from .support import ValidationErrorWrappingTestCase, approval_spec_data
+import os
+import tempfile
+
+
+class CompiledSpecTestCase(ValidationErrorWrappingTestCase):
+
+    def _dump_to_file(self, workflow):
+        fd, path = tempfile.mkstemp(suffix='.ouroboros')
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, 'wb') as f:
+            workflow.dump_compiled(f)
+        return path
+
+    def test_compiled_graph(self):
+        workflow = Workflow.Spec.install(approval_spec_data(), publish=True)
+        compiled_spec = workflow.compiled()
+        main = compiled_spec.find_course('')
+        split = compiled_spec.find_node(main, 'approve-audit')
+        self.assertEqual(compiled_spec.node_type(split), NodeSpec.SPLIT)
+        self.assertEqual(compiled_spec.path(compiled_spec.node_joiners[split]).path,
+                         'sample.support.approve_audit_joiner')
+        self.assertEqual(sorted(compiled_spec.string(compiled_spec.course_codes[course])
+                                for course in compiled_spec.branches(split)), ['approval', 'audit'])
+        self.assertEqual(sorted(compiled_spec.string(compiled_spec.transition_action_names[transition])
+                                for transition in compiled_spec.outbounds(split)), ['rejected', 'satisfied'])
+        self.assertEqual(len(compiled_spec.nodes_of_type(main, NodeSpec.EXIT)), 2)
+        self.assertIs(workflow.compiled(), compiled_spec)
+
+    def test_changed_draft_specs_are_invalidated(self):
+        workflow = Workflow.Spec.install(approval_spec_data())
+        compiled_spec = workflow.compiled()
+        self.assertIs(workflow.compiled(), compiled_spec)
+        node_spec = workflow.spec.course_specs.get(code='').node_specs.get(code='created')
+        node_spec.name = 'Just Created'
+        node_spec.save()
+        recompiled = workflow.compiled()
+        self.assertIsNot(recompiled, compiled_spec)
+        main = recompiled.find_course('')
+        self.assertEqual(recompiled.string(recompiled.node_names[recompiled.find_node(main, 'created')]),
+                         'Just Created')
+
+    def test_branch_changes_are_invalidated(self):
+        workflow = Workflow.Spec.install(approval_spec_data())
+        self.assertEqual(len(workflow.compiled().branches(workflow.compiled().find_node(
+            workflow.compiled().find_course(''), 'approve-audit'
+        ))), 2)
+        split = workflow.spec.course_specs.get(code='').node_specs.get(code='approve-audit')
+        split.branches.remove(workflow.spec.course_specs.get(code='audit'))
+        recompiled = workflow.compiled()
+        self.assertEqual(len(recompiled.branches(recompiled.find_node(recompiled.find_course(''), 'approve-audit'))),
+                         1)
+
+    def test_invalidation_from_another_process(self):
+        workflow = Workflow.Spec.install(approval_spec_data(), publish=True)
+        compiled_spec = workflow.compiled()
+        # Another process bumps the generation counter in the shared cache. The local entry
+        #   is still there, but it must not be used anymore.
+        key = compiled._generation_key(workflow.spec.pk)
+        shared = compiled._shared_cache()
+        shared.set(key, shared.get(key, 0) + 1, None)
+        self.assertIsNot(workflow.compiled(), compiled_spec)
+        with self.assertNumQueries(0):
+            self.assertIs(workflow.compiled(), workflow.compiled())
+
+    def test_generations_checked_once_per_operation(self):
+        workflow = Workflow.Spec.install(approval_spec_data(), publish=True)
+        key = compiled._generation_key(workflow.spec.pk)
+        shared = compiled._shared_cache()
+        with compiled.memoizing_generations():
+            compiled_spec = workflow.compiled()
+            shared.set(key, shared.get(key, 0) + 1, None)
+            self.assertIs(workflow.compiled(), compiled_spec)
+            compiled.invalidate(workflow.spec.pk)
+            self.assertIsNot(workflow.compiled(), compiled_spec)
+        shared.set(key, shared.get(key, 0) + 1, None)
+        self.assertIsNot(workflow.compiled(), compiled_spec)
+
+    def test_warm_up_on_first_request(self):
+        workflow = Workflow.Spec.install(approval_spec_data(), publish=True)
+        compiled._cache.clear()
+        self.addCleanup(signals.connect)
+        with override_settings(OUROBOROS_PRELOAD_SPECS=['approval-flow']):
+            request_started.send(sender=None)
+        with self.assertNumQueries(0):
+            workflow.compiled()
+        # Only the first request warms the cache up, and failures are just logged.
+        handler = BufferingHandler(10)
+        signals.logger.addHandler(handler)
+        self.addCleanup(signals.logger.removeHandler, handler)
+        compiled._cache.clear()
+        signals.connect()
+        with override_settings(OUROBOROS_PRELOAD_SPECS=['missing-flow']):
+            request_started.send(sender=None)
+            request_started.send(sender=None)
+        self.assertEqual(compiled._cache, {})
+        self.assertEqual(len(handler.buffer), 1)
+
+    def test_warm_up_from_settings(self):
+        workflow = Workflow.Spec.install(approval_spec_data(), publish=True)
+        other = Workflow.Spec.install(approval_spec_data('other-flow'), publish=True)
+        path = self._dump_to_file(other)
+        compiled._cache.clear()
+        with override_settings(OUROBOROS_PRELOAD_SPECS=['approval-flow'], OUROBOROS_PRELOAD_COMPILED_SPECS=[path]):
+            loaded = compiled.warm_up()
+        self.assertEqual(sorted(compiled_spec.code for compiled_spec in loaded), ['approval-flow', 'other-flow'])
+        with self.assertNumQueries(0):
+            workflow.compiled()
+            other.compiled()
+
+    def test_binary_round_trip(self):
+        workflow = Workflow.Spec.install(approval_spec_data(), publish=True)
+        stream = BytesIO()
+        workflow.dump_compiled(stream)
+        loaded = CompiledSpec.loads(stream.getvalue())
+        original = workflow.compiled()
+        self.assertEqual(loaded.header, original.header)
+        self.assertEqual(loaded.strings, original.strings)
+        self.assertEqual(loaded.paths, original.paths)
+        for name in CompiledSpec.ARRAYS:
+            self.assertEqual(getattr(loaded, name), getattr(original, name))
+
+    def test_load_from_file_without_spec_queries(self):
+        workflow = Workflow.Spec.install(approval_spec_data(), publish=True)
+        path = self._dump_to_file(workflow)
+        compiled._cache.clear()
+        with self.assertNumQueries(1):
+            loaded = Workflow.Spec.load_compiled(path)
+        self.assertEqual(loaded.digest, workflow.spec.digest)
+        with self.assertNumQueries(0):
+            self.assertIs(workflow.compiled(), loaded)
+
+    def test_load_mismatching_file_is_bad(self):
+        workflow = Workflow.Spec.install(approval_spec_data(), publish=True)
+        path = self._dump_to_file(workflow)
+        WorkflowSpec.objects.filter(pk=workflow.spec.pk).update(digest='0' * 64)
+        with self.assertRaises(exceptions.WorkflowCompiledSpecMismatch):
+            Workflow.Spec.load_compiled(path)
+
+    def test_dump_draft_is_bad(self):
+        workflow = Workflow.Spec.install(approval_spec_data())
+        with self.assertRaises(exceptions.WorkflowSpecNotPublished):
+            workflow.dump_compiled(BytesIO())
+
+    def test_bad_file_is_bad(self):
+        with self.assertRaises(ValueError):
+            CompiledSpec.loads(b'NOTASPEC')
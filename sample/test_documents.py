@@ -0,0 +1,58 @@
+from __future__ import unicode_literals
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from arcanelab.ouroboros.executors import Workflow
+from arcanelab.ouroboros.models import WorkflowInstance
+from .support import ValidationErrorWrappingTestCase, approval_spec_data
+from .models import Task, Area
+
+
+class WorkflowDocumentTestCase(ValidationErrorWrappingTestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user('foo', 'foo@example.com', 'foo1')
+        area = Area.objects.create(head=self.user)
+        self.tasks = [Task.objects.create(area=area, service_type=Task.SERVICE, title='Sample %d' % index,
+                                          content='Lorem ipsum dolor sit amet', performer=self.user,
+                                          reviewer=self.user, accountant=self.user, auditor=self.user,
+                                          dispatcher=self.user, attendant=self.user)
+                      for index in range(3)]
+        self.workflow = Workflow.Spec.install(approval_spec_data(), publish=True)
+
+    def test_branches_share_workflow_instance(self):
+        instance = self.workflow.instantiate(self.user, self.tasks[0])
+        instance.start(self.user)
+        instance.execute(self.user, 'submit')
+        root = instance.instance.courses.get(parent__isnull=True)
+        self.assertIs(root.workflow_instance, instance.instance)
+        branches = Workflow.CourseHelpers.get_branches(root)
+        self.assertEqual(sorted(branch.course_spec.code for branch in branches), ['approval', 'audit'])
+        for branch in branches:
+            self.assertIs(branch.workflow_instance, instance.instance)
+            self.assertIs(Workflow.CourseHelpers.get_parent(branch), root)
+
+    def test_document_is_loaded_once(self):
+        instance = self.workflow.instantiate(self.user, self.tasks[0])
+        instance.start(self.user)
+        instance.execute(self.user, 'submit')
+        instance = Workflow.get_many([Task.objects.get(pk=self.tasks[0].pk)])[0]
+        with CaptureQueriesContext(connection) as context:
+            instance.execute(self.user, 'audit', 'audit')
+            instance.execute(self.user, 'approve', 'approval')
+        self.assertEqual(instance.get_workflow_status(), {'': ('ended', 101)})
+        self.assertFalse([query for query in context.captured_queries if 'FROM "sample_task"' in query['sql']])
+
+    def test_prefetched_workflow_instances(self):
+        instances = [self.workflow.instantiate(self.user, task) for task in self.tasks[:2]]
+        documents = list(Task.objects.order_by('id').prefetch_related('workflow_instances'))
+        with self.assertNumQueries(0):
+            workflows = Workflow.get_many(documents)
+        self.assertEqual([workflow and workflow.instance for workflow in workflows],
+                         [instances[0].instance, instances[1].instance, None])
+
+    def test_deleting_document_deletes_workflow_instance(self):
+        self.workflow.instantiate(self.user, self.tasks[0]).start(self.user)
+        self.tasks[0].delete()
+        self.assertFalse(WorkflowInstance.objects.exists())
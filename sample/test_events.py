@@ -0,0 +1,78 @@
+from __future__ import unicode_literals
+from datetime import timedelta
+from django.test.utils import override_settings
+from django.utils.timezone import now
+from arcanelab.ouroboros import events
+from arcanelab.ouroboros.models import WorkflowEvent, WorkflowSnapshot
+from arcanelab.ouroboros.executors import Workflow
+from .support import ApprovalWorkflowTestCase, approval_spec_data
+import json
+
+
+@override_settings(OUROBOROS_EVENT_SOURCING=True, OUROBOROS_SNAPSHOT_INTERVAL=4)
+class EventSourcingTestCase(ApprovalWorkflowTestCase):
+
+    def setUp(self):
+        super(EventSourcingTestCase, self).setUp()
+        self.task = self._task()
+
+    def test_replay_as_of(self):
+        instance = self.workflow.instantiate(self.user, self.task)
+        base = now() - timedelta(days=1)
+        steps = [lambda: instance.start(self.user),
+                 lambda: instance.execute(self.user, 'submit'),
+                 lambda: instance.cancel(self.user, 'audit'),
+                 lambda: instance.execute(self.user, 'approve', 'approval')]
+        history = []
+        for index, step in enumerate(steps):
+            step()
+            # Each step happens one hour after the previous one.
+            stamp = base + timedelta(hours=index)
+            WorkflowEvent.objects.filter(created_on__gt=base + timedelta(hours=index - 1)).update(created_on=stamp)
+            WorkflowSnapshot.objects.filter(created_on__gt=base + timedelta(hours=index - 1)).update(created_on=stamp)
+            history.append((stamp, instance.get_workflow_status()))
+        self.assertEqual(instance.replay(), instance.get_workflow_status())
+        self.assertEqual(instance.replay(base - timedelta(hours=1)), {})
+        for stamp, status in history:
+            self.assertEqual(instance.replay(stamp), status)
+            self.assertEqual(instance.replay(stamp + timedelta(minutes=30)), status)
+
+    def test_snapshots(self):
+        instance = self.workflow.instantiate(self.user, self.task)
+        instance.start(self.user)
+        instance.execute(self.user, 'submit')
+        instance.execute(self.user, 'reject', 'approval')
+        count = WorkflowEvent.objects.count()
+        self.assertEqual(WorkflowSnapshot.objects.count(), count // 4)
+        self.assertEqual(list(WorkflowEvent.objects.order_by('id').values_list('sequence', flat=True)),
+                         list(range(1, count + 1)))
+        # A snapshot and its tail are read in two queries.
+        with self.assertNumQueries(2):
+            state = events.replay(instance.instance)
+        self.assertEqual(events.statuses(self.workflow.compiled(), state), {'': ('ended', 100)})
+        # The state of a snapshot matches the replay of all the events up to it.
+        snapshot = WorkflowSnapshot.objects.order_by('sequence').first()
+        with self.settings(OUROBOROS_SNAPSHOT_INTERVAL=0):
+            WorkflowSnapshot.objects.all().delete()
+            self.assertEqual(events.replay(instance.instance, sequence=snapshot.sequence),
+                             {int(key): value for key, value in json.loads(snapshot.state).items()})
+
+    def test_replay_after_migration(self):
+        instance = self.workflow.instantiate(self.user, self.task)
+        instance.start(self.user)
+        instance.execute(self.user, 'submit')
+        second = Workflow.Spec.install(approval_spec_data(), publish=True)
+        self.assertEqual(self.workflow.migrate_instances(second), 1)
+        instance = Workflow.get(self.task)
+        # The events (and snapshot) written so far still reference the first version.
+        self.assertEqual(instance.replay(), instance.get_workflow_status())
+        instance.execute(self.user, 'approve', 'approval')
+        self.assertEqual(instance.replay(), {
+            '': ('splitting', None), 'approval': ('ended', 101), 'audit': ('waiting', 'pending-audit')
+        })
+        self.assertEqual(instance.replay(), instance.get_workflow_status())
+
+    @override_settings(OUROBOROS_EVENT_SOURCING=False)
+    def test_event_sourcing_is_optional(self):
+        self.workflow.instantiate(self.user, self.task).start(self.user)
+        self.assertFalse(WorkflowEvent.objects.exists())
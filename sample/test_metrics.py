@@ -0,0 +1,84 @@
+from __future__ import unicode_literals
+from datetime import timedelta
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils.six import StringIO
+from arcanelab.ouroboros import metrics, plans
+from arcanelab.ouroboros.models import CourseInstanceLog, NodeThroughput
+from .support import ApprovalWorkflowTestCase
+
+
+class MetricsTestCase(ApprovalWorkflowTestCase):
+
+    def _instance(self):
+        instance = self.workflow.instantiate(self.user, self._task())
+        instance.start(self.user)
+        return instance
+
+    def test_logs_link_previous_landings(self):
+        instance = self._instance()
+        instance.execute(self.user, 'submit')
+        instance.cancel(self.user, 'audit')
+        logs = {log.node_spec.code: log for log in CourseInstanceLog.objects.filter(
+            course_instance__course_spec__code__in=('', 'audit')
+        ).select_related('node_spec', 'previous_node_spec', 'transition_spec')}
+        self.assertIsNone(logs['created'].previous_node_spec)
+        self.assertIsNone(logs['created'].elapsed)
+        self.assertEqual(logs['approve-audit'].previous_node_spec.code, 'created')
+        self.assertEqual(logs['approve-audit'].transition_spec.action_name, 'submit')
+        self.assertGreaterEqual(logs['approve-audit'].elapsed, timedelta(0))
+        # Cancellations are logged without transition.
+        self.assertEqual(logs['cancel'].previous_node_spec.code, 'pending-audit')
+        self.assertIsNone(logs['cancel'].transition_spec)
+
+    def test_dwell_time_percentiles(self):
+        for index in range(4):
+            self._instance().execute(self.user, 'submit')
+        # Sets known dwell times for the 'created' node: 1, 2, 3 and 4 hours.
+        logs = CourseInstanceLog.objects.filter(previous_node_spec__code='created').order_by('id')
+        for hours, log in enumerate(logs, 1):
+            CourseInstanceLog.objects.filter(pk=log.pk).update(elapsed=timedelta(hours=hours))
+        with self.assertNumQueries(1):
+            times = self.workflow.dwell_times((50, 100))
+        self.assertEqual(times, {'': {'created': {'count': 4, 'p50': timedelta(hours=2),
+                                                  'p100': timedelta(hours=4)}}})
+        if connection.vendor == 'sqlite':
+            # The logs are scanned by the (previous node spec, elapsed) index, without sorting them.
+            plan = plans.explain(metrics.dwell_time_rows(self.workflow.spec))
+            self.assertTrue(any('previous_node_spec_id_elapsed' in line for line in plan))
+            self.assertFalse(any('TEMP B-TREE' in line for line in plan))
+
+    def _totals(self):
+        return {(course, node): (sum(row[1] for row in rows), sum(row[2] for row in rows))
+                for course, nodes in self.workflow.throughput().items() for node, rows in nodes.items()}
+
+    @override_settings(OUROBOROS_THROUGHPUT_ROLLUP=True)
+    def test_throughput_rollup(self):
+        instances = [self._instance() for index in range(3)]
+        for instance in instances:
+            instance.execute(self.user, 'submit')
+        instances[0].execute(self.user, 'reject', 'approval')
+        instances[1].cancel(self.user)
+        totals = self._totals()
+        self.assertEqual(totals[('', 'created')], (3, 3))
+        self.assertEqual(totals[('', 'approve-audit')], (3, 2))
+        self.assertEqual(totals[('', 'was-rejected')], (1, 0))
+        self.assertEqual(totals[('', 'cancel')], (1, 0))
+        self.assertEqual(totals[('audit', 'pending-audit')], (3, 2))
+        buckets = set(row[0] for nodes in self.workflow.throughput().values() for rows in nodes.values()
+                      for row in rows)
+        self.assertTrue(buckets)
+        self.assertTrue(all(bucket == metrics.bucket(bucket) for bucket in buckets))
+        # Rebuilding from the logs gives the same figures (except for the logs of the removed branches,
+        #   both joined and cancelled).
+        NodeThroughput.objects.update(entered=0, left=0)
+        call_command('ouroboros_rebuild_throughput', spec='approval-flow', batch_size=5, stdout=StringIO())
+        rebuilt = self._totals()
+        self.assertEqual(rebuilt[('', 'created')], (3, 3))
+        self.assertEqual(rebuilt[('', 'approve-audit')], (3, 2))
+        self.assertEqual(rebuilt[('audit', 'pending-audit')], (1, 0))
+
+    def test_throughput_rollup_is_optional(self):
+        self._instance().execute(self.user, 'submit')
+        self.assertFalse(NodeThroughput.objects.exists())
@@ -0,0 +1,169 @@
+from __future__ import unicode_literals
+from django.contrib.auth import get_user_model
+from django.test.utils import override_settings
+from arcanelab.ouroboros import exceptions
+from arcanelab.ouroboros.executors import Workflow
+from arcanelab.ouroboros.expressions import Expression
+from arcanelab.ouroboros.models import NodeSpec
+from .support import ValidationErrorWrappingTestCase, SERVICE_CHECKS
+from .models import Task, Area
+
+
+class MultiplexerTestCase(ValidationErrorWrappingTestCase):
+
+    def _spec_data(self, handler=None):
+        return {'model': 'sample.Task', 'code': 'routing', 'name': 'Routing',
+                'create_permission': '', 'cancel_permission': '',
+                'courses': [{
+                    'code': '', 'name': 'Main',
+                    'nodes': [{
+                        'type': NodeSpec.ENTER, 'code': 'origin', 'name': 'Origin',
+                    }, {
+                        'type': NodeSpec.INPUT, 'code': 'created', 'name': 'Created',
+                    }, {
+                        'type': NodeSpec.MULTIPLEXER, 'code': 'first-routing', 'name': 'First Routing',
+                    }, {
+                        'type': NodeSpec.MULTIPLEXER, 'code': 'second-routing', 'name': 'Second Routing',
+                        'landing_handler': handler
+                    }, {
+                        'type': NodeSpec.EXIT, 'code': 'service', 'name': 'Service', 'exit_value': 100,
+                    }, {
+                        'type': NodeSpec.EXIT, 'code': 'deliverable', 'name': 'Deliverable', 'exit_value': 101,
+                    }, {
+                        'type': NodeSpec.EXIT, 'code': 'non-deliverable', 'name': 'Non Deliverable',
+                        'exit_value': 102,
+                    }, {
+                        'type': NodeSpec.CANCEL, 'code': 'cancel', 'name': 'Cancel',
+                    }],
+                    'transitions': [{
+                        'origin': 'origin', 'destination': 'created', 'name': 'Enter',
+                    }, {
+                        'origin': 'created', 'destination': 'first-routing', 'name': 'Route', 'action_name': 'route',
+                    }, {
+                        'origin': 'first-routing', 'destination': 'deliverable', 'name': 'Is Deliverable',
+                        'condition': 'sample.support.is_deliverable', 'priority': 1,
+                    }, {
+                        'origin': 'first-routing', 'destination': 'second-routing', 'name': 'Is Other',
+                        'condition': 'sample.support.is_service_counted', 'priority': 3,
+                    }, {
+                        'origin': 'first-routing', 'destination': 'non-deliverable', 'name': 'Is Non Deliverable',
+                        'condition': 'sample.support.is_non_deliverable', 'priority': 2,
+                    }, {
+                        'origin': 'second-routing', 'destination': 'service', 'name': 'Is Service',
+                        'condition': 'sample.support.is_service_counted', 'priority': 1,
+                    }, {
+                        'origin': 'second-routing', 'destination': 'non-deliverable', 'name': 'Is Non Deliverable',
+                        'condition': 'sample.support.is_non_deliverable', 'priority': 2,
+                    }]
+                }]}
+
+    def _declarative_spec_data(self):
+        expressions = {
+            'sample.support.is_deliverable': ['service_type', '=', Task.DELIVERABLE],
+            'sample.support.is_non_deliverable': ['service_type', '=', Task.NON_DELIVERABLE],
+            'sample.support.is_service_counted': {'all': [['service_type', 'in', [Task.SERVICE]],
+                                                          {'not': ['area__head_id', 'isnull', True]}]},
+        }
+        spec_data = self._spec_data()
+        for transition in spec_data['courses'][0]['transitions']:
+            if 'condition' in transition:
+                transition['condition'] = expressions[transition['condition']]
+        return spec_data
+
+    def setUp(self):
+        del SERVICE_CHECKS[:]
+        User = get_user_model()
+        self.user = User.objects.create_user('foo', 'foo@example.com', 'foo1')
+        self.area = Area.objects.create(head=self.user)
+
+    def _task(self, service_type):
+        return Task.objects.create(area=self.area, service_type=service_type, title='Sample',
+                                   content='Lorem ipsum dolor sit amet', performer=self.user, reviewer=self.user,
+                                   accountant=self.user, auditor=self.user, dispatcher=self.user,
+                                   attendant=self.user)
+
+    def _route(self, workflow, service_type):
+        instance = workflow.instantiate(self.user, self._task(service_type))
+        instance.start(self.user)
+        instance.execute(self.user, 'route')
+        return instance.get_workflow_status()['']
+
+    def test_decision_table(self):
+        workflow = Workflow.Spec.install(self._spec_data(), publish=True)
+        compiled_spec = workflow.compiled()
+        node = compiled_spec.find_node(compiled_spec.find_course(''), 'first-routing')
+        self.assertEqual([condition.path for transition, condition in compiled_spec.decision_table(node)],
+                         ['sample.support.is_deliverable', 'sample.support.is_non_deliverable',
+                          'sample.support.is_service_counted'])
+        self.assertEqual(self._route(workflow, Task.SERVICE), ('ended', 100))
+        self.assertEqual(self._route(workflow, Task.DELIVERABLE), ('ended', 101))
+        self.assertEqual(self._route(workflow, Task.NON_DELIVERABLE), ('ended', 102))
+
+    def test_conditions_are_not_memoized_by_default(self):
+        workflow = Workflow.Spec.install(self._spec_data(), publish=True)
+        self._route(workflow, Task.SERVICE)
+        self.assertEqual(len(SERVICE_CHECKS), 2)
+
+    @override_settings(OUROBOROS_MEMOIZE_CONDITIONS=True)
+    def test_conditions_are_memoized_in_one_operation(self):
+        workflow = Workflow.Spec.install(self._spec_data(), publish=True)
+        self._route(workflow, Task.SERVICE)
+        self.assertEqual(len(SERVICE_CHECKS), 1)
+        self._route(workflow, Task.SERVICE)
+        self.assertEqual(len(SERVICE_CHECKS), 2)
+
+    @override_settings(OUROBOROS_MEMOIZE_CONDITIONS=True)
+    def test_landing_handlers_reset_the_memo(self):
+        workflow = Workflow.Spec.install(self._spec_data('sample.support.on_pending_delivery'), publish=True)
+        self._route(workflow, Task.SERVICE)
+        self.assertEqual(len(SERVICE_CHECKS), 2)
+
+    def test_declarative_conditions(self):
+        workflow = Workflow.Spec.install(self._declarative_spec_data(), publish=True)
+        compiled_spec = workflow.compiled()
+        node = compiled_spec.find_node(compiled_spec.find_course(''), 'first-routing')
+        self.assertEqual([condition for transition, condition in compiled_spec.decision_table(node)],
+                         [Expression(['service_type', '=', Task.DELIVERABLE]),
+                          Expression(['service_type', '=', Task.NON_DELIVERABLE]),
+                          Expression({'all': [['service_type', 'in', [Task.SERVICE]],
+                                              {'not': ['area__head_id', 'isnull', True]}]})])
+        transitions = workflow.serialized()['courses'][0]['transitions']
+        self.assertIn(['service_type', '=', Task.DELIVERABLE], [transition['condition'] for transition in transitions])
+        self.assertEqual(self._route(workflow, Task.SERVICE), ('ended', 100))
+        self.assertEqual(self._route(workflow, Task.DELIVERABLE), ('ended', 101))
+        self.assertEqual(self._route(workflow, Task.NON_DELIVERABLE), ('ended', 102))
+
+    def test_route_in_sql(self):
+        workflow = Workflow.Spec.install(self._declarative_spec_data(), publish=True)
+        for service_type in (Task.SERVICE, Task.DELIVERABLE, Task.NON_DELIVERABLE):
+            self._task(service_type)
+        workflow.compiled()
+        with self.assertNumQueries(1):
+            routes = list(workflow.route(Task.objects.order_by('id'), 'first-routing')
+                          .values_list('ouroboros_route', flat=True))
+        self.assertEqual(routes, ['second-routing', 'deliverable', 'non-deliverable'])
+        routes = workflow.route(Task.objects.order_by('id'), 'second-routing').values_list('ouroboros_route',
+                                                                                           flat=True)
+        self.assertEqual(list(routes), ['service', None, 'non-deliverable'])
+
+    def test_route_requires_declarative_conditions(self):
+        workflow = Workflow.Spec.install(self._spec_data(), publish=True)
+        with self.assertRaises(exceptions.WorkflowCourseNodeConditionsNotDeclarative):
+            workflow.route(Task.objects.all(), 'first-routing')
+        with self.assertRaises(exceptions.WorkflowCourseNodeDoesNotExist):
+            workflow.route(Task.objects.all(), 'created')
+
+    def test_expressions_match_their_queries(self):
+        tasks = [self._task(service_type) for service_type in (Task.SERVICE, Task.DELIVERABLE)]
+        for data in (['service_type', '!=', Task.SERVICE], ['performer__username', '=', 'foo'],
+                     {'any': [['title', '>=', 'Z'], {'not': ['service_type', 'in', [Task.DELIVERABLE]]}]}):
+            expression = Expression(data)
+            self.assertEqual([task.pk for task in tasks if expression(task, self.user)],
+                             list(Task.objects.filter(expression.as_q()).order_by('id')
+                                  .values_list('id', flat=True)))
+
+    def test_invalid_expressions_are_rejected(self):
+        spec_data = self._declarative_spec_data()
+        spec_data['courses'][0]['transitions'][2]['condition'] = ['service_type', '~', Task.DELIVERABLE]
+        with self.assertRaises(exceptions.WorkflowInvalidState):
+            Workflow.Spec.install(spec_data)
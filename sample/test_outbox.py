@@ -0,0 +1,96 @@
+from __future__ import unicode_literals
+from datetime import timedelta
+from django.core.management import call_command
+from django.test.utils import override_settings
+from django.utils.six import StringIO
+from django.utils.timezone import now
+from arcanelab.ouroboros import outbox
+from arcanelab.ouroboros.models import OutboxMessage
+from .support import ApprovalWorkflowTestCase
+import io
+import json
+import os
+import tempfile
+
+
+class FailingSink(outbox.Sink):
+
+    def __init__(self, accepted):
+        self.accepted = accepted
+
+    def publish(self, messages):
+        outbox.MemorySink().publish(messages[:self.accepted])
+        raise IOError('Sink unavailable')
+
+
+@override_settings(OUROBOROS_OUTBOX=True, OUROBOROS_OUTBOX_SINK='arcanelab.ouroboros.outbox.MemorySink')
+class OutboxTestCase(ApprovalWorkflowTestCase):
+
+    def setUp(self):
+        super(OutboxTestCase, self).setUp()
+        del outbox.MemorySink.messages[:]
+
+    def _run(self, action_name='reject'):
+        instance = self.workflow.instantiate(self.user, self._task())
+        instance.start(self.user)
+        instance.execute(self.user, 'submit')
+        instance.execute(self.user, action_name, 'approval')
+        return instance
+
+    def test_messages_mirror_the_logs(self):
+        instance = self._run()
+        payloads = [json.loads(payload) for payload in OutboxMessage.objects.order_by('id').values_list('payload',
+                                                                                                     flat=True)]
+        self.assertEqual(payloads[0]['node'], 'created')
+        self.assertIsNone(payloads[0]['previous_node'])
+        self.assertEqual(payloads[0]['document'], ['sample.task', instance.instance.object_id])
+        self.assertEqual(payloads[0]['workflow_spec'], [self.workflow.spec.code, self.workflow.spec.version])
+        # Unlike the logs, the messages of the branches are kept after the split node is left.
+        self.assertEqual([(payload['course'], payload['node'], payload['previous_node']) for payload in payloads[2:]],
+                         [('approval', 'pending-approval', None), ('audit', 'pending-audit', None),
+                          ('approval', 'rejected', 'pending-approval'), ('audit', 'joined', 'pending-audit'),
+                          ('', 'was-rejected', 'approve-audit')])
+
+    def test_relay_in_batches(self):
+        self._run()
+        self._run('approve')
+        count = OutboxMessage.objects.count()
+        out = StringIO()
+        call_command('ouroboros_relay_outbox', batch_size=3, stdout=out)
+        self.assertIn('Published %d messages' % count, out.getvalue())
+        messages = outbox.MemorySink.messages
+        self.assertEqual([message['id'] for message in messages], sorted(message['id'] for message in messages))
+        self.assertFalse(OutboxMessage.objects.filter(published_on__isnull=True).exists())
+        self.assertEqual(outbox.relay(outbox.MemorySink()), 0)
+        self.assertEqual(outbox.purge(now() + timedelta(seconds=1)), count)
+
+    def test_at_least_once(self):
+        self._run()
+        count = OutboxMessage.objects.count()
+        with self.assertRaises(IOError):
+            outbox.relay(FailingSink(2), 5)
+        # The partially published batch is retried as a whole.
+        self.assertEqual(OutboxMessage.objects.filter(published_on__isnull=True).count(), count)
+        self.assertEqual(outbox.relay(outbox.MemorySink(), count), count)
+        ids = [message['id'] for message in outbox.MemorySink.messages]
+        self.assertEqual(ids[:2], ids[2:4])
+        self.assertEqual(sorted(set(ids)), ids[2:])
+
+    def test_file_sink(self):
+        self._run()
+        handle, path = tempfile.mkstemp(suffix='.jsonl')
+        os.close(handle)
+        try:
+            with self.settings(OUROBOROS_OUTBOX_SINK='arcanelab.ouroboros.outbox.FileSink',
+                               OUROBOROS_OUTBOX_SINK_OPTIONS={'path': path}):
+                call_command('ouroboros_relay_outbox', stdout=StringIO())
+            with io.open(path, encoding='utf-8') as stream:
+                lines = [json.loads(line) for line in stream]
+            self.assertEqual(len(lines), OutboxMessage.objects.count())
+        finally:
+            os.remove(path)
+
+    def test_disabled(self):
+        with self.settings(OUROBOROS_OUTBOX=False):
+            self._run()
+        self.assertFalse(OutboxMessage.objects.exists())
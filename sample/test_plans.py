@@ -0,0 +1,70 @@
+from __future__ import unicode_literals
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.utils.six import StringIO
+from arcanelab.ouroboros import exceptions, models, plans
+from arcanelab.ouroboros.executors import Workflow
+from .support import ApprovalWorkflowTestCase, approval_spec_data
+
+
+class PlansTestCase(ApprovalWorkflowTestCase):
+
+    def setUp(self):
+        super(PlansTestCase, self).setUp()
+        self.instance = self.workflow.instantiate(self.user, self._task())
+        self.instance.start(self.user)
+        self.instance.execute(self.user, 'submit')
+
+    def test_lookups_use_the_indexes(self):
+        lookups = dict(plans.lookups())
+        self.assertEqual(lookups['root course'].get().workflow_instance, self.instance.instance)
+        self.assertEqual(lookups['node by type'].get().type, models.NodeSpec.ENTER)
+        self.assertEqual(lookups['branch by course'].count(), 1)
+        for name, index in (('root course', 'ouroboros_courseinstance_root'),
+                            ('node by type', 'ouroboros_nodespec_course_spec_id_type'),
+                            ('transition by action', 'ouroboros_transitionspec_action'),
+                            ('branch by course', 'ouroboros_courseinstance_branch')):
+            self.assertTrue(any(index in line for line in plans.explain(lookups[name])), name)
+
+    def test_unique_indexes(self):
+        if connection.vendor in models.ROOT_COURSES_VENDORS:
+            root = self.instance.instance.courses.get(parent__isnull=True)
+            with self.assertRaises(IntegrityError), transaction.atomic():
+                models.CourseInstance.objects.create(workflow_instance=self.instance.instance,
+                                                     course_spec=root.course_spec)
+        draft = Workflow.Spec.install(approval_spec_data('approval-draft')).spec
+        transition = models.TransitionSpec.objects.filter(origin__course_spec__workflow_spec=draft,
+                                                          action_name='approve').first()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            models.TransitionSpec.objects.bulk_create([models.TransitionSpec(
+                origin=transition.origin, destination=transition.destination, action_name='approve'
+            )])
+        with self.assertRaises(exceptions.WorkflowCourseTransitionActionNameNotUnique):
+            models.TransitionSpec.objects.create(origin=transition.origin, destination=transition.destination,
+                                                 action_name='approve')
+
+    def test_structural_invariants(self):
+        split = models.NodeInstance.objects.select_related('node_spec').get(node_spec__type=models.NodeSpec.SPLIT)
+        split.verify_respects_branches()
+        transition = models.TransitionSpec.objects.select_related('origin').get(
+            origin__course_spec__workflow_spec=self.instance.instance.workflow_spec, action_name='approve'
+        )
+        with self.assertNumQueries(0 if models.enforced_by_database(transition, models.UNIQUE_KEYS_VENDORS) else 1):
+            transition.verify_input_origin(unique=False)
+        with self.assertNumQueries(1):
+            transition.verify_input_origin()
+        transition.action_name = transition.origin.outbounds.exclude(pk=transition.pk).first().action_name
+        with self.assertRaises(exceptions.WorkflowCourseTransitionActionNameNotUnique):
+            transition.clean()
+        branch = split.branches.first()
+        with self.assertRaises(exceptions.WorkflowCourseNodeInstanceIncompleteSplitBranchReferences), \
+                transaction.atomic():
+            models.CourseInstance.objects.create(workflow_instance=self.instance.instance, parent=split,
+                                                 course_spec=branch.course_spec)
+
+    def test_command(self):
+        stdout = StringIO()
+        call_command('ouroboros_explain_lookups', repeat=2, stdout=stdout)
+        output = stdout.getvalue()
+        self.assertIn('root course: ', output)
+        self.assertIn('ouroboros_courseinstance_root', output)
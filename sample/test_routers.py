@@ -0,0 +1,95 @@
+from __future__ import unicode_literals
+from django.db.utils import ConnectionDoesNotExist
+from django.test import SimpleTestCase
+from django.test.utils import override_settings
+from arcanelab.ouroboros import exceptions, models, sharding
+from arcanelab.ouroboros.executors import Workflow
+from arcanelab.ouroboros.routers import OuroborosRouter
+from .support import ApprovalWorkflowTestCase
+from .models import Task
+
+
+@override_settings(OUROBOROS_WRITE_DATABASE='default', OUROBOROS_READ_DATABASE='replica',
+                   OUROBOROS_SPEC_DATABASE='local')
+class RouterTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.router = OuroborosRouter()
+
+    def test_reads(self):
+        self.assertEqual(self.router.db_for_read(models.CourseInstance), 'replica')
+        self.assertEqual(self.router.db_for_read(models.NodeSpec), 'local')
+        self.assertEqual(self.router.db_for_read(models.NodeSpec.branches.through), 'local')
+        self.assertIsNone(self.router.db_for_read(Task))
+        instance = models.WorkflowInstance()
+        instance._state.db = 'default'
+        self.assertEqual(self.router.db_for_read(models.CourseInstance, instance=instance), 'default')
+        with sharding.write_block():
+            self.assertEqual(self.router.db_for_read(models.CourseInstance), 'default')
+        with override_settings(OUROBOROS_SPEC_DATABASE=None):
+            self.assertEqual(self.router.db_for_read(models.WorkflowSpec), 'replica')
+
+    def test_writes_and_migrations(self):
+        self.assertEqual(self.router.db_for_write(models.CourseInstance), 'default')
+        instance = models.WorkflowInstance()
+        instance._state.db = 'replica'
+        with override_settings(OUROBOROS_WRITE_DATABASE=None):
+            self.assertEqual(self.router.db_for_write(models.CourseInstance, instance=instance), 'default')
+        self.assertIsNone(self.router.db_for_write(Task))
+        self.assertIsNone(self.router.allow_migrate('default', 'ouroboros'))
+        self.assertFalse(self.router.allow_migrate('replica', 'ouroboros'))
+        self.assertIsNone(self.router.allow_migrate('replica', 'sample'))
+
+    def test_relations(self):
+        spec, instance = models.WorkflowSpec(), models.WorkflowInstance()
+        spec._state.db, instance._state.db = 'local', 'default'
+        self.assertTrue(self.router.allow_relation(spec, instance))
+        instance._state.db = 'other'
+        self.assertIsNone(self.router.allow_relation(spec, instance))
+
+
+@override_settings(OUROBOROS_READ_DATABASE='replica',
+                   DATABASE_ROUTERS=['arcanelab.ouroboros.routers.OuroborosRouter'])
+class ReplicaTestCase(ApprovalWorkflowTestCase):
+    # The replica is never replicated to in these tests: it stays empty.
+    multi_db = True
+
+    def setUp(self):
+        super(ReplicaTestCase, self).setUp()
+        self.task = self._task()
+        instance = self.workflow.instantiate(self.user, self.task)
+        instance.start(self.user)
+        instance.execute(self.user, 'submit')
+
+    def test_reads_use_the_given_database(self):
+        self.assertEqual(Workflow.Spec.get('approval-flow', using='default').spec, self.workflow.spec)
+        with self.assertRaises(exceptions.WorkflowSpecDoesNotExist):
+            Workflow.Spec.get('approval-flow', using='replica')
+        with self.assertRaises(exceptions.WorkflowInstanceDoesNotExist):
+            Workflow.get(self.task, using='replica')
+        self.assertEqual(Workflow.get_many([self.task], using='replica'), [None])
+        workflow = Workflow.get(self.task, using='default')
+        self.assertEqual(workflow.instance._state.db, 'default')
+        self.assertEqual(sorted(workflow.get_workflow_available_actions(self.user, using='default')),
+                         ['approval', 'audit'])
+        for read in (lambda: Workflow.Spec.get('approval-flow', using='missing'),
+                     lambda: Workflow.get(self.task, using='missing'),
+                     lambda: workflow.get_workflow_available_actions(self.user, using='missing')):
+            with self.assertRaises(ConnectionDoesNotExist):
+                read()
+
+    def test_writing_operations_use_the_primary(self):
+        # Test cases run inside a transaction, like requests do with ATOMIC_REQUESTS: other reads
+        #   still go to the replica.
+        self.assertEqual(OuroborosRouter().db_for_read(models.CourseInstance), 'replica')
+        workflow = Workflow.get(self.task, using='default')
+        # As if it was read from the replica.
+        workflow.instance._state.db = 'replica'
+        workflow.execute(self.user, 'approve', 'approval')
+        self.assertFalse(models.CourseInstanceLog.objects.using('replica').exists())
+        self.assertTrue(models.CourseInstanceLog.objects.using('default').filter(
+            transition_spec__action_name='approve'
+        ).exists())
+        self.assertEqual(Workflow.get(self.task, using='default').get_workflow_status(using='default'), {
+            '': ('splitting', None), 'approval': ('ended', 101), 'audit': ('waiting', 'pending-audit')
+        })
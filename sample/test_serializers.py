@@ -0,0 +1,108 @@
+from __future__ import unicode_literals
+from datetime import timedelta
+from io import StringIO
+from django.contrib.auth import get_user_model
+from arcanelab.ouroboros.executors import Workflow
+from arcanelab.ouroboros.models import WorkflowInstance, CourseInstanceLog
+from .support import ValidationErrorWrappingTestCase, approval_spec_data
+from .models import Task, Area
+import json
+
+
+class WorkflowStreamingTestCase(ValidationErrorWrappingTestCase):
+
+    def _install_users_and_data(self, count):
+        User = get_user_model()
+        user = User.objects.create_user('foo', 'foo@example.com', 'foo1')
+        area = Area.objects.create(head=user)
+        tasks = [Task.objects.create(area=area, service_type=Task.SERVICE, title='Sample %d' % index,
+                                     content='Lorem ipsum dolor sit amet', performer=user, reviewer=user,
+                                     accountant=user, auditor=user, dispatcher=user, attendant=user)
+                 for index in range(count)]
+        return user, tasks
+
+    def _run_instances(self, workflow, user, tasks):
+        instances = [workflow.instantiate(user, task) for task in tasks]
+        for index, instance in enumerate(instances):
+            instance.start(user)
+            if index % 3 > 0:
+                instance.execute(user, 'submit')
+            if index % 3 > 1:
+                instance.execute(user, 'audit', 'audit')
+        return instances
+
+    def _logs(self):
+        return sorted(CourseInstanceLog.objects.values_list(
+            'course_instance__workflow_instance__object_id', 'course_instance__course_spec__code', 'created_on',
+            'node_spec_id', 'previous_node_spec_id', 'transition_spec_id', 'elapsed'
+        ))
+
+    def test_serialized_spec_is_installable(self):
+        workflow = Workflow.Spec.install(approval_spec_data())
+        data = workflow.serialized()
+        split = [node for node in data['courses'][0]['nodes'] if node['code'] == 'approve-audit'][0]
+        self.assertEqual(split['joiner'], 'sample.support.approve_audit_joiner')
+        self.assertEqual(sorted(split['branches']), ['approval', 'audit'])
+        reinstalled = Workflow.Spec.install(json.loads(workflow.serialized(True)))
+        self.assertEqual(reinstalled.spec.version, 2)
+        self.assertEqual(reinstalled.digest(), workflow.digest())
+
+    def test_dump_uses_constant_queries(self):
+        workflow = Workflow.Spec.install(approval_spec_data(), publish=True)
+        user, tasks = self._install_users_and_data(6)
+        self._run_instances(workflow, user, tasks[:1])
+        stream = StringIO()
+        with self.assertNumQueries(8):
+            workflow.dump(stream, True)
+        self._run_instances(workflow, user, tasks[1:])
+        stream = StringIO()
+        with self.assertNumQueries(8):
+            self.assertEqual(workflow.dump(stream, True), 6)
+        self.assertEqual(len(stream.getvalue().splitlines()), 7)
+
+    def test_dump_and_load_instances(self):
+        workflow = Workflow.Spec.install(approval_spec_data(), publish=True)
+        user, tasks = self._install_users_and_data(6)
+        instances = self._run_instances(workflow, user, tasks)
+        statuses = [instance.get_workflow_status() for instance in instances]
+        logs = self._logs()
+        self.assertTrue(any(log[-2] is not None for log in logs))
+        stream = StringIO()
+        workflow.dump(stream, True)
+        WorkflowInstance.objects.all().delete()
+
+        stream.seek(0)
+        loaded, count = Workflow.Spec.load(stream, batch_size=4)
+        self.assertEqual(loaded.spec, workflow.spec)
+        self.assertEqual(count, 6)
+        self.assertEqual(self._logs(), logs)
+        for task, status in zip(tasks, statuses):
+            self.assertEqual(Workflow.get(task).get_workflow_status(), status)
+        reloaded = Workflow.get(tasks[2])
+        reloaded.execute(user, 'approve', 'approval')
+        self.assertEqual(reloaded.get_workflow_status(), {'': ('ended', 101)})
+
+    def test_zero_elapsed_times_are_kept(self):
+        # Landings in the same instant as the previous one.
+        workflow = Workflow.Spec.install(approval_spec_data(), publish=True)
+        user, tasks = self._install_users_and_data(3)
+        self._run_instances(workflow, user, tasks)
+        CourseInstanceLog.objects.filter(elapsed__isnull=False).update(elapsed=timedelta(0))
+        logs = self._logs()
+        stream = StringIO()
+        workflow.dump(stream, True)
+        WorkflowInstance.objects.all().delete()
+        stream.seek(0)
+        Workflow.Spec.load(stream)
+        self.assertEqual(self._logs(), logs)
+        self.assertTrue(any(log[-1] == timedelta(0) for log in logs))
+
+    def test_load_installs_unknown_spec(self):
+        workflow = Workflow.Spec.install(approval_spec_data())
+        stream = StringIO()
+        workflow.dump(stream)
+        stream.seek(0)
+        loaded, count = Workflow.Spec.load(stream)
+        self.assertEqual(count, 0)
+        self.assertNotEqual(loaded.spec, workflow.spec)
+        self.assertEqual(loaded.digest(), workflow.digest())
@@ -0,0 +1,96 @@
+from __future__ import unicode_literals
+from django.test import SimpleTestCase
+from django.test.utils import override_settings
+from arcanelab.ouroboros import models, sharding
+from arcanelab.ouroboros.executors import Workflow
+from arcanelab.ouroboros.routers import OuroborosRouter
+from .support import ApprovalWorkflowTestCase, approval_spec_data
+
+
+def area_shard_key(workflow_spec, document):
+    return 'area-%s' % document.area_id
+
+
+class ShardingTestCase(SimpleTestCase):
+
+    def test_databases(self):
+        self.assertEqual(sharding.shards(), [])
+        self.assertIsNone(sharding.database('approval-flow'))
+        with override_settings(OUROBOROS_SHARDS=['one', 'two'], OUROBOROS_SHARD_MAP={'tenant': 'two'}):
+            self.assertEqual(sharding.database('tenant'), 'two')
+            self.assertIn(sharding.database('approval-flow'), ('one', 'two'))
+            self.assertEqual(sharding.database('approval-flow'), sharding.database('approval-flow'))
+            self.assertEqual(set(sharding.database('key-%d' % index) for index in range(20)), {'one', 'two'})
+
+    def test_pinning(self):
+        self.assertIsNone(sharding.current())
+        with sharding.using('one') as database:
+            self.assertEqual(database, 'one')
+            with sharding.using('two'):
+                self.assertEqual(sharding.current(), 'two')
+            self.assertEqual(sharding.current(), 'one')
+        self.assertIsNone(sharding.current())
+
+    def test_fan_out(self):
+        self.assertEqual(sharding.fan_out(lambda alias: alias), [None])
+        self.assertEqual(sharding.fan_out(lambda alias: alias, ['default']), ['default'])
+        # Each alias runs in its own thread.
+        self.assertEqual(sharding.fan_out(lambda alias: sharding.current(), ['default', 'default']), [None, None])
+
+    @override_settings(OUROBOROS_SHARDS=['one', 'two'], OUROBOROS_SHARD_MAP={'tenant': 'two'},
+                       OUROBOROS_READ_DATABASE='replica')
+    def test_router(self):
+        router = OuroborosRouter()
+        self.assertEqual(router.db_for_read(models.CourseInstance), 'replica')
+        self.assertEqual(router.db_for_read(models.CourseInstance, instance=models.NodeInstance(shard_key='tenant')),
+                         'two')
+        self.assertEqual(router.db_for_write(models.CourseInstance), 'default')
+        with sharding.using('one'):
+            self.assertEqual(router.db_for_read(models.CourseInstance), 'one')
+            self.assertEqual(router.db_for_write(models.NodeTimer), 'one')
+            self.assertEqual(router.db_for_read(models.NodeSpec), 'replica')
+        self.assertIsNone(router.allow_migrate('two', 'ouroboros'))
+        self.assertFalse(router.allow_migrate('replica', 'ouroboros'))
+
+
+class ShardKeysTestCase(ApprovalWorkflowTestCase):
+
+    install_approval = False
+
+    def _run(self):
+        workflow = Workflow.Spec.install(approval_spec_data(), publish=True)
+        task = self._task()
+        instance = workflow.instantiate(self.user, task)
+        instance.start(self.user)
+        instance.execute(self.user, 'submit')
+        instance.execute(self.user, 'audit', 'audit')
+        return task
+
+    def _shard_keys(self):
+        return set(key for model in (models.WorkflowInstance, models.CourseInstance, models.NodeInstance,
+                                     models.CourseInstanceLog)
+                   for key in model.objects.values_list('shard_key', flat=True))
+
+    def test_shard_keys_are_denormalized(self):
+        self._run()
+        self.assertEqual(self._shard_keys(), {'approval-flow'})
+
+    @override_settings(OUROBOROS_SHARD_KEY='sample.test_sharding.area_shard_key')
+    def test_custom_shard_keys(self):
+        self._run()
+        self.assertEqual(self._shard_keys(), {'area-%s' % self.area.id})
+
+    @override_settings(OUROBOROS_SHARDS=['default'],
+                       DATABASE_ROUTERS=['arcanelab.ouroboros.routers.OuroborosRouter'])
+    def test_sharded_runs(self):
+        task = self._run()
+        workflow = Workflow.get(task)
+        self.assertEqual(workflow.instance._state.db, 'default')
+        self.assertEqual(workflow.get_workflow_status(), {
+            '': ('splitting', None), 'approval': ('waiting', 'pending-approval'), 'audit': ('ended', 103)
+        })
+        other = self._task()
+        self.assertEqual([found and found.instance for found in Workflow.get_many([task, other])],
+                         [workflow.instance, None])
+        workflow.execute(self.user, 'approve', 'approval')
+        self.assertEqual(Workflow.get(task).get_workflow_status(), {'': ('ended', 101)})
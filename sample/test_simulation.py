@@ -0,0 +1,83 @@
+from __future__ import unicode_literals
+from arcanelab.ouroboros import exceptions
+from arcanelab.ouroboros.executors import Workflow
+from arcanelab.ouroboros.simulation import Visit, Call, Write
+from .support import ApprovalWorkflowTestCase, wide_split_spec_data
+
+
+class SimulationTestCase(ApprovalWorkflowTestCase):
+
+    SCENARIOS = (
+        (('execute', 'submit', ''), ('execute', 'audit', 'audit'), ('execute', 'approve', 'approval')),
+        (('execute', 'submit', ''), ('execute', 'reject', 'approval')),
+        (('execute', 'submit', ''), ('cancel', None, 'audit'), ('execute', 'approve', 'approval')),
+        (('execute', 'submit', ''), ('cancel', None, '')),
+    )
+
+    def test_simulations_match_the_runner(self):
+        for scenario in self.SCENARIOS:
+            instance = self.workflow.instantiate(self.user, self._task())
+            instance.start(self.user)
+            simulation = self.workflow.simulate(object())
+            simulation.start()
+            self.assertEqual(simulation.get_workflow_status(), instance.get_workflow_status())
+            for operation, action_name, path in scenario:
+                if operation == 'execute':
+                    instance.execute(self.user, action_name, path)
+                    simulation.execute(action_name, path)
+                else:
+                    instance.cancel(self.user, path)
+                    simulation.cancel(path)
+                self.assertEqual(simulation.get_workflow_status(), instance.get_workflow_status())
+
+    def test_simulations_do_not_query(self):
+        self.workflow.compiled()
+        with self.assertNumQueries(0):
+            for index in range(200):
+                simulation = self.workflow.simulate(object())
+                simulation.start()
+                simulation.execute('submit')
+                simulation.execute('audit', 'audit')
+                simulation.execute('approve', 'approval')
+        self.assertEqual(simulation.get_workflow_status(), {'': ('ended', 101)})
+        self.assertEqual(simulation.visited[:4], [Visit('', 'origin'), Visit('', 'created'),
+                                                  Visit('', 'approve-audit'), Visit('approval', 'origin')])
+        self.assertEqual(simulation.visited[-1], Visit('', 'was-satisfied'))
+        self.assertEqual([call.result for call in simulation.calls], [None, 'satisfied'])
+        self.assertEqual(len([write for write in simulation.writes if write.model == 'CourseInstanceLog']), 7)
+        self.assertIn(Write('create', 'CourseInstance', 'audit', None), simulation.writes)
+
+    def test_overrides(self):
+        joiner = 'sample.support.approve_audit_joiner'
+        simulation = self.workflow.simulate(object(), overrides={joiner: lambda *args: 'rejected'})
+        simulation.start()
+        simulation.execute('submit')
+        simulation.execute('audit', 'audit')
+        self.assertEqual(simulation.get_workflow_status(), {'': ('ended', 100)})
+        self.assertEqual(simulation.calls, [Call('joiner', joiner, '', 'rejected')])
+        self.assertIn(Visit('approval', 'joined'), simulation.visited)
+        self.assertEqual(simulation.get_available_actions(), {})
+
+    def test_splits_without_joiner(self):
+        simulation = Workflow.Spec.install(wide_split_spec_data(3, joiner=False), publish=True).simulate(object())
+        simulation.start()
+        simulation.execute('submit')
+        self.assertEqual(sorted(simulation.get_available_actions()), ['r0', 'r1', 'r2'])
+        for index in range(3):
+            self.assertEqual(simulation.get_workflow_status()[''], ('splitting', None))
+            simulation.execute('approve', 'r%d' % index)
+        self.assertEqual(simulation.get_workflow_status(), {'': ('ended', 100)})
+
+    def test_simulation_errors(self):
+        simulation = self.workflow.simulate(object())
+        simulation.start()
+        with self.assertRaises(exceptions.WorkflowInstanceNotPending):
+            simulation.start()
+        with self.assertRaises(exceptions.WorkflowCourseNodeTransitionDoesNotExist) as context:
+            simulation.execute('approve')
+        self.assertIs(context.exception.raiser, simulation.compiled_spec)
+        with self.assertRaises(exceptions.WorkflowCourseInstanceDoesNotExist):
+            simulation.execute('approve', 'approval')
+        simulation.cancel()
+        with self.assertRaises(exceptions.WorkflowCourseInstanceAlreadyTerminated):
+            simulation.cancel()
@@ -0,0 +1,53 @@
+from __future__ import unicode_literals
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from arcanelab.ouroboros.executors import Workflow
+from arcanelab.ouroboros.models import NodeInstance
+from .support import ApprovalWorkflowTestCase, wide_split_spec_data
+
+
+class WideSplitTestCase(ApprovalWorkflowTestCase):
+
+    install_approval = False
+
+    def _start(self, width, joiner=True):
+        workflow = Workflow.Spec.install(wide_split_spec_data(width, 'review-%d' % width, joiner), publish=True)
+        instance = workflow.instantiate(self.user, self._task())
+        instance.start(self.user)
+        instance.execute(self.user, 'submit')
+        return instance
+
+    def _count_queries(self, instance, action_name, path):
+        with CaptureQueriesContext(connection) as context:
+            instance.execute(self.user, action_name, path)
+        return len(context.captured_queries)
+
+    def test_split_resolution_does_not_depend_on_width(self):
+        narrow, wide = self._start(3), self._start(20)
+        self.assertEqual(self._count_queries(narrow, 'approve', 'r0'), self._count_queries(wide, 'approve', 'r0'))
+        self.assertEqual(self._count_queries(narrow, 'reject', 'r1'), self._count_queries(wide, 'reject', 'r1'))
+        self.assertEqual(narrow.get_workflow_status(), {'': ('ended', 101)})
+        self.assertEqual(wide.get_workflow_status(), {'': ('ended', 101)})
+
+    def test_all_branches_approved(self):
+        instance = self._start(4)
+        for index in range(4):
+            instance.execute(self.user, 'approve', 'r%d' % index)
+        self.assertEqual(instance.get_workflow_status(), {'': ('ended', 100)})
+
+    def test_joinerless_split_counts_branches(self):
+        narrow, wide = self._start(3, False), self._start(20, False)
+        self.assertEqual(self._count_queries(narrow, 'approve', 'r0'), self._count_queries(wide, 'approve', 'r0'))
+        split = NodeInstance.objects.get(course_instance__workflow_instance=wide.instance,
+                                         course_instance__parent__isnull=True)
+        self.assertEqual((split.branch_count, split.terminated_count), (20, 1))
+        for index in range(1, 20):
+            wide.execute(self.user, 'reject', 'r%d' % index)
+        self.assertEqual(wide.get_workflow_status(), {'': ('ended', 100)})
+
+    def test_cancelled_branches_are_counted(self):
+        instance = self._start(2, False)
+        instance.cancel(self.user, 'r0')
+        self.assertEqual(instance.get_workflow_status()[''], ('splitting', None))
+        instance.execute(self.user, 'approve', 'r1')
+        self.assertEqual(instance.get_workflow_status(), {'': ('ended', 100)})
@@ -0,0 +1,79 @@
+from __future__ import unicode_literals
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import override_settings, CaptureQueriesContext
+from arcanelab.ouroboros.executors import Workflow
+from .support import ApprovalWorkflowTestCase
+from .models import Task
+
+
+@override_settings(OUROBOROS_STATUS_CACHE='default')
+class WorkflowStatusCacheTestCase(ApprovalWorkflowTestCase):
+
+    def setUp(self):
+        cache.clear()
+        super(WorkflowStatusCacheTestCase, self).setUp()
+        self.tasks = [self._task('Sample %d' % index) for index in range(3)]
+
+    def test_status_is_served_from_cache(self):
+        instance = self.workflow.instantiate(self.user, self.tasks[0])
+        instance.start(self.user)
+        self.assertEqual(instance.get_workflow_status(), {'': ('waiting', 'created')})
+        with self.assertNumQueries(0):
+            self.assertEqual(instance.get_workflow_status(), {'': ('waiting', 'created')})
+        # Other wrappers, even in other processes, see the same version.
+        other = Workflow.get(self.tasks[0])
+        with self.assertNumQueries(0):
+            self.assertEqual(other.get_workflow_status(), {'': ('waiting', 'created')})
+
+    def test_moving_invalidates_status(self):
+        instance = self.workflow.instantiate(self.user, self.tasks[0])
+        instance.start(self.user)
+        instance.get_workflow_status()
+        instance.execute(self.user, 'submit')
+        self.assertEqual(instance.get_workflow_status(), {
+            '': ('splitting', None), 'approval': ('waiting', 'pending-approval'), 'audit': ('waiting', 'pending-audit')
+        })
+        instance.execute(self.user, 'audit', 'audit')
+        instance.execute(self.user, 'approve', 'approval')
+        self.assertEqual(Workflow.get(self.tasks[0]).get_workflow_status(), {'': ('ended', 101)})
+
+    def test_many_statuses(self):
+        instances = [self.workflow.instantiate(self.user, task) for task in self.tasks]
+        for instance in instances:
+            instance.start(self.user)
+        instances[1].execute(self.user, 'submit')
+        expected = [{'': ('waiting', 'created')},
+                    {'': ('splitting', None), 'approval': ('waiting', 'pending-approval'),
+                     'audit': ('waiting', 'pending-audit')},
+                    {'': ('waiting', 'created')}]
+        self.assertEqual(instances[0].get_workflow_status(), expected[0])
+        self.assertEqual(Workflow.get_workflow_statuses(instances), expected)
+        with self.assertNumQueries(0):
+            self.assertEqual(Workflow.get_workflow_statuses(instances), expected)
+
+    @override_settings(OUROBOROS_STATUS_CACHE=None)
+    def test_status_cache_is_optional(self):
+        instance = self.workflow.instantiate(self.user, self.tasks[0])
+        instance.start(self.user)
+        instance.get_workflow_status()
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(instance.get_workflow_status(), {'': ('waiting', 'created')})
+        self.assertTrue(context.captured_queries)
+
+    def test_many_documents_lookup(self):
+        instances = [self.workflow.instantiate(self.user, task) for task in self.tasks[:2]]
+        for instance in instances:
+            instance.start(self.user)
+        documents = [self.tasks[1], self.tasks[2], self.user, self.tasks[0]]
+        # Content types are cached by Django, so they are not counted.
+        ContentType.objects.get_for_models(Task, type(self.user))
+        with self.assertNumQueries(2):
+            workflows = Workflow.get_many(documents)
+            self.assertEqual([workflow and workflow.instance.document for workflow in workflows],
+                             [self.tasks[1], None, None, self.tasks[0]])
+            self.assertEqual([workflow and workflow.instance for workflow in workflows],
+                             [instances[1].instance, None, None, instances[0].instance])
+        self.assertEqual(Workflow.get_workflow_statuses(workflows[::3]),
+                         [{'': ('waiting', 'created')}, {'': ('waiting', 'created')}])
@@ -0,0 +1,46 @@
+from __future__ import unicode_literals
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from arcanelab.ouroboros.models import NodeSpec, CourseInstance, CourseInstanceLog
+from .support import ApprovalWorkflowTestCase
+
+
+class WorkflowTerminationTestCase(ApprovalWorkflowTestCase):
+
+    def setUp(self):
+        super(WorkflowTerminationTestCase, self).setUp()
+        self.task = self._task()
+        self.instance = self.workflow.instantiate(self.user, self.task)
+        self.instance.start(self.user)
+        self.instance.execute(self.user, 'submit')
+
+    def test_cancel_split_subtree(self):
+        with CaptureQueriesContext(connection) as context:
+            self.instance.cancel(self.user)
+        self.assertEqual(self.instance.get_workflow_status(), {'': ('cancelled', -1)})
+        # The cancelled split is left, so its (cancelled) branches are removed.
+        course_instance = CourseInstance.objects.select_related('node_instance__node_spec').get()
+        self.assertEqual(course_instance.term_level, 0)
+        node_instance = course_instance.node_instance
+        self.assertEqual(node_instance.node_spec.type, NodeSpec.CANCEL)
+        self.assertEqual((node_instance.branch_count, node_instance.terminated_count), (0, 0))
+        node_instance.clean()
+        self.assertEqual(CourseInstanceLog.objects.filter(node_spec__type=NodeSpec.CANCEL).count(), 1)
+        # The subtree is written in bulk: there is one insert for all the logs.
+        inserts = [query for query in context.captured_queries
+                   if query['sql'].startswith('INSERT INTO "ouroboros_courseinstancelog"')]
+        self.assertEqual(len(inserts), 1)
+
+    def test_cancel_branch_keeps_siblings(self):
+        self.instance.cancel(self.user, 'audit')
+        self.assertEqual(self.instance.get_workflow_status(), {
+            '': ('splitting', None), 'approval': ('waiting', 'pending-approval'), 'audit': ('cancelled', -1)
+        })
+        self.instance.execute(self.user, 'approve', 'approval')
+        self.assertEqual(self.instance.get_workflow_status(), {'': ('ended', 101)})
+
+    def test_joiner_forces_join(self):
+        self.instance.execute(self.user, 'reject', 'approval')
+        self.assertEqual(self.instance.get_workflow_status(), {'': ('ended', 100)})
+        # Once the split node is left, its (joined) branches are removed.
+        self.assertEqual(CourseInstance.objects.count(), 1)
@@ -0,0 +1,123 @@
+from __future__ import unicode_literals
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.utils.six import StringIO
+from django.utils.timezone import now
+from arcanelab.ouroboros import exceptions
+from arcanelab.ouroboros.executors import Workflow
+from arcanelab.ouroboros.models import NodeTimer, TransitionSpec
+from .support import ApprovalWorkflowTestCase, approval_spec_data
+
+
+def timed_spec_data(timeout=172800, permission=None):
+    """
+    The approval spec, where the approval is rejected after waiting for 48 hours (by default).
+    """
+
+    data = approval_spec_data()
+    for transition in data['courses'][1]['transitions']:
+        if transition.get('action_name') == 'reject':
+            transition['timeout'] = timeout
+            transition['permission'] = permission
+    return data
+
+
+class TimersTestCase(ApprovalWorkflowTestCase):
+    install_approval = False
+
+    def _submitted(self, workflow):
+        instance = workflow.instantiate(self.user, self._task())
+        instance.start(self.user)
+        instance.execute(self.user, 'submit')
+        return instance
+
+    def _expire(self):
+        NodeTimer.objects.update(due_on=now() - timedelta(seconds=1))
+
+    def test_due_timers_fire(self):
+        workflow = Workflow.Spec.install(timed_spec_data(), publish=True)
+        instance = self._submitted(workflow)
+        timer = NodeTimer.objects.get()
+        self.assertEqual(timer.transition_spec.action_name, 'reject')
+        self.assertEqual(timer.due_on - timer.node_instance.created_on, timedelta(hours=48))
+        self.assertEqual(Workflow.fire_timers(self.user), (0, 0, 0, False))
+        self._expire()
+        self.assertEqual(Workflow.fire_timers(self.user), (1, 0, 0, False))
+        self.assertEqual(Workflow.get(instance.instance.document).get_workflow_status(), {'': ('ended', 100)})
+        self.assertFalse(NodeTimer.objects.exists())
+
+    def test_timers_leave_with_their_node(self):
+        workflow = Workflow.Spec.install(timed_spec_data(), publish=True)
+        self._submitted(workflow).execute(self.user, 'approve', 'approval')
+        self._submitted(workflow).cancel(self.user, 'approval')
+        self.assertFalse(NodeTimer.objects.exists())
+        # Migrated instances keep their timers, now tied to the target version.
+        self._submitted(workflow)
+        due_on = NodeTimer.objects.get().due_on
+        second = Workflow.Spec.install(timed_spec_data(), publish=True)
+        workflow.migrate_instances(second)
+        timer = NodeTimer.objects.get()
+        self.assertEqual(timer.due_on, due_on)
+        self.assertEqual(timer.transition_spec.origin.course_spec.workflow_spec, second.spec)
+
+    def test_failing_timers_are_postponed(self):
+        workflow = Workflow.Spec.install(timed_spec_data(permission='sample.reject_task'), publish=True)
+        instance = self._submitted(workflow)
+        self._expire()
+        # Timers run like execute() does, so the user must be allowed to reject.
+        other = get_user_model().objects.create_user('bar', 'bar@example.com', 'bar1')
+        self.assertEqual(Workflow.fire_timers(other), (0, 1, 0, False))
+        self.assertGreater(NodeTimer.objects.get().due_on, now())
+        self.assertEqual(instance.get_workflow_status()['approval'], ('waiting', 'pending-approval'))
+
+    def test_command(self):
+        workflow = Workflow.Spec.install(timed_spec_data(), publish=True)
+        for index in range(3):
+            self._submitted(workflow)
+        self._expire()
+        out = StringIO()
+        call_command('ouroboros_fire_timers', 'foo', batch_size=2, stdout=out)
+        self.assertIn('Fired 3 timers, postponed 0, discarded 0', out.getvalue())
+
+    def _due_with_stale(self, workflow):
+        for index in range(3):
+            self._submitted(workflow)
+        self._expire()
+        # The first two timers (by due date) are stale: their courses are not in their origin node anymore.
+        NodeTimer.objects.filter(id__in=list(NodeTimer.objects.order_by('id').values_list('id', flat=True)[:2])).update(
+            due_on=now() - timedelta(hours=1),
+            transition_spec=TransitionSpec.objects.get(origin__course_spec__workflow_spec=workflow.spec,
+                                                       action_name='submit')
+        )
+
+    def test_stale_timers_do_not_end_the_command(self):
+        workflow = Workflow.Spec.install(timed_spec_data(), publish=True)
+        self._due_with_stale(workflow)
+        self.assertEqual(Workflow.fire_timers(self.user, 2), (0, 0, 2, True))
+        self.assertEqual(Workflow.fire_timers(self.user, 2), (1, 0, 0, False))
+        self._due_with_stale(workflow)
+        out = StringIO()
+        call_command('ouroboros_fire_timers', 'foo', batch_size=2, stdout=out)
+        self.assertIn('Fired 1 timers, postponed 0, discarded 2', out.getvalue())
+
+    def test_timeouts_are_validated(self):
+        with self.assertRaises(exceptions.WorkflowInvalidState) as ar:
+            Workflow.Spec.install(timed_spec_data(timeout=0))
+        self.assertEqual(self.unwrapValidationError(ar.exception, 'timeout').messages,
+                         ['This field must be a positive duration.'])
+        data = approval_spec_data()
+        data['courses'][0]['transitions'][0]['timeout'] = 60
+        with self.assertRaises(exceptions.WorkflowInvalidState) as ar:
+            Workflow.Spec.install(data)
+        self.assertEqual(self.unwrapValidationError(ar.exception, 'timeout').messages, ['This field must be null.'])
+
+    def test_timeouts_are_serialized_and_compiled(self):
+        workflow = Workflow.Spec.install(timed_spec_data(), publish=True)
+        self.assertNotEqual(workflow.digest(), Workflow.Spec.install(approval_spec_data(), publish=True).digest())
+        self.assertEqual(Workflow.Spec.install(workflow.serialized(), publish=True).digest(), workflow.digest())
+        compiled_spec = workflow.compiled()
+        course = compiled_spec.find_course('approval')
+        (transition, timeout), = compiled_spec.timers(compiled_spec.find_node(course, 'pending-approval'))
+        self.assertEqual(timeout, 172800)
+        self.assertEqual(compiled_spec.string(compiled_spec.transition_action_names[transition]), 'reject')
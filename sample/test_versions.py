@@ -0,0 +1,148 @@
+from __future__ import unicode_literals
+from django.contrib.auth import get_user_model
+from django.core import serializers
+from django.db import transaction
+from arcanelab.ouroboros.executors import Workflow
+from arcanelab.ouroboros.models import WorkflowSpec, CourseSpec, NodeSpec, TransitionSpec, NodeInstance, \
+    CourseInstanceLog, SpecPart, Described
+from arcanelab.ouroboros import exceptions
+from .support import ValidationErrorWrappingTestCase, approval_spec_data
+from .models import Task, Area
+
+
+class WorkflowSpecVersionTestCase(ValidationErrorWrappingTestCase):
+
+    def _spec_data(self, input_code='created'):
+        return {'model': 'sample.Task', 'code': 'versioned', 'name': 'Versioned Spec',
+                'create_permission': '', 'cancel_permission': '',
+                'courses': [{
+                    'code': '', 'name': 'Main',
+                    'nodes': [{
+                        'type': NodeSpec.ENTER, 'code': 'origin', 'name': 'Origin',
+                    }, {
+                        'type': NodeSpec.INPUT, 'code': input_code, 'name': 'Created',
+                    }, {
+                        'type': NodeSpec.EXIT, 'code': 'finished', 'name': 'Finished', 'exit_value': 100,
+                    }, {
+                        'type': NodeSpec.CANCEL, 'code': 'cancel', 'name': 'Cancel',
+                    }],
+                    'transitions': [{
+                        'origin': 'origin', 'destination': input_code, 'name': 'Enter',
+                    }, {
+                        'origin': input_code, 'destination': 'finished', 'name': 'Finish', 'action_name': 'finish',
+                    }]
+                }]}
+
+    def _install_users_and_data(self):
+        User = get_user_model()
+        user = User.objects.create_user('foo', 'foo@example.com', 'foo1')
+        area = Area.objects.create(head=user)
+        tasks = [Task.objects.create(area=area, service_type=Task.SERVICE, title='Sample %d' % index,
+                                     content='Lorem ipsum dolor sit amet', performer=user, reviewer=user,
+                                     accountant=user, auditor=user, dispatcher=user, attendant=user)
+                 for index in range(3)]
+        return user, tasks
+
+    def test_install_same_code_creates_new_version(self):
+        first = Workflow.Spec.install(self._spec_data())
+        second = Workflow.Spec.install(self._spec_data())
+        self.assertEqual(first.spec.version, 1)
+        self.assertEqual(second.spec.version, 2)
+        self.assertIsNone(second.spec.published_on)
+
+    def test_same_data_has_same_digest(self):
+        first = Workflow.Spec.install(self._spec_data(), publish=True)
+        second = Workflow.Spec.install(self._spec_data(), publish=True)
+        third = Workflow.Spec.install(self._spec_data('pending'), publish=True)
+        self.assertEqual(first.spec.digest, second.spec.digest)
+        self.assertNotEqual(first.spec.digest, third.spec.digest)
+
+    def test_published_spec_cannot_be_changed(self):
+        workflow = Workflow.Spec.install(self._spec_data(), publish=True)
+        spec = workflow.spec
+        spec.name = 'Changed'
+        with self.assertRaises(exceptions.WorkflowSpecIsPublished):
+            spec.save()
+        node_spec = spec.course_specs.get(code='').node_specs.get(code='created')
+        node_spec.name = 'Changed'
+        with self.assertRaises(exceptions.WorkflowSpecIsPublished):
+            node_spec.save()
+        with self.assertRaises(exceptions.WorkflowSpecIsPublished):
+            node_spec.outbounds.get().delete()
+
+    def test_published_branches_cannot_be_changed(self):
+        spec = Workflow.Spec.install(approval_spec_data(), publish=True).spec
+        split = NodeSpec.objects.get(course_spec__workflow_spec=spec, type=NodeSpec.SPLIT)
+        audit = split.branches.get(code='audit')
+        for change in (lambda: split.branches.remove(audit), lambda: split.branches.clear(),
+                       lambda: audit.callers.remove(split), lambda: audit.callers.clear(),
+                       lambda: spec.course_specs.get(code='').callers.add(split)):
+            with self.assertRaises(exceptions.WorkflowSpecIsPublished), transaction.atomic():
+                change()
+        self.assertEqual(split.branches.count(), 2)
+        # Drafts can still be changed.
+        draft = Workflow.Spec.install(approval_spec_data()).spec
+        split = NodeSpec.objects.get(course_spec__workflow_spec=draft, type=NodeSpec.SPLIT)
+        split.branches.remove(split.branches.get(code='audit'))
+        self.assertEqual(split.branches.count(), 1)
+
+    def test_spec_parts_must_tell_their_spec(self):
+        for model in (WorkflowSpec, CourseSpec, NodeSpec, TransitionSpec):
+            self.assertEqual(model.check(), [])
+        # An (abstract, so it is not registered) spec part not overriding _part_of.
+        orphan = type(str('Orphan'), (SpecPart, Described), {
+            '__module__': __name__, 'Meta': type(str('Meta'), (), {'abstract': True})
+        })
+        self.assertIn('ouroboros.E001', [error.id for error in orphan.check()])
+
+    def test_course_natural_keys_include_the_version(self):
+        first = Workflow.Spec.install(self._spec_data(), publish=True)
+        second = Workflow.Spec.install(self._spec_data(), publish=True)
+        course_spec = second.spec.course_specs.get()
+        self.assertEqual(course_spec.natural_key(), ('versioned', 2, ''))
+        self.assertEqual(CourseSpec.objects.get_by_natural_key('versioned', 2, ''), course_spec)
+        self.assertEqual(CourseSpec.objects.get_by_natural_key('versioned', 1, ''), first.spec.course_specs.get())
+        # Fixtures referencing the courses by natural key resolve them in the right version.
+        data = serializers.serialize('json', NodeSpec.objects.filter(course_spec=course_spec),
+                                     use_natural_foreign_keys=True)
+        self.assertEqual({deserialized.object.course_spec_id for deserialized in serializers.deserialize('json', data)},
+                         {course_spec.pk})
+
+    def test_get_retrieves_latest_published_version(self):
+        first = Workflow.Spec.install(self._spec_data(), publish=True)
+        Workflow.Spec.install(self._spec_data())
+        self.assertEqual(Workflow.Spec.get('versioned').spec, first.spec)
+        with self.assertRaises(exceptions.WorkflowSpecDoesNotExist):
+            Workflow.Spec.get('versioned', 3)
+        user, tasks = self._install_users_and_data()
+        self.assertEqual(Workflow.create(user, 'versioned', tasks[0]).instance.workflow_spec, first.spec)
+
+    def test_migrate_running_instances(self):
+        first = Workflow.Spec.install(self._spec_data(), publish=True)
+        second = Workflow.Spec.install(self._spec_data('pending'), publish=True)
+        user, tasks = self._install_users_and_data()
+        instances = [first.instantiate(user, task) for task in tasks]
+        for instance in instances:
+            instance.start(user)
+        instances[0].execute(user, 'finish')
+        migrated = first.migrate_instances(second, {'': {'created': 'pending'}})
+        self.assertEqual(migrated, 2)
+        for instance in instances[1:]:
+            refreshed = Workflow.get(instance.instance.document)
+            self.assertEqual(refreshed.instance.workflow_spec, second.spec)
+            self.assertEqual(refreshed.get_workflow_status(), {'': ('waiting', 'pending')})
+            refreshed.execute(user, 'finish')
+            self.assertEqual(refreshed.get_workflow_status(), {'': ('ended', 100)})
+        finished = Workflow.get(tasks[0])
+        self.assertEqual(finished.instance.workflow_spec, first.spec)
+        self.assertEqual(finished.get_workflow_status(), {'': ('ended', 100)})
+        self.assertTrue(CourseInstanceLog.objects.filter(node_spec__code='created').exists())
+
+    def test_migrate_with_missing_node_is_bad(self):
+        first = Workflow.Spec.install(self._spec_data(), publish=True)
+        second = Workflow.Spec.install(self._spec_data('pending'), publish=True)
+        user, tasks = self._install_users_and_data()
+        first.instantiate(user, tasks[0]).start(user)
+        with self.assertRaises(exceptions.WorkflowCourseNodeDoesNotExist):
+            first.migrate_instances(second)
+        self.assertTrue(NodeInstance.objects.filter(node_spec__course_spec__workflow_spec=first.spec).exists())
@@ -0,0 +1,62 @@
+from __future__ import unicode_literals
+from datetime import timedelta
+from django.core.management import call_command
+from django.utils.six import StringIO
+from django.utils.timezone import now
+from arcanelab.ouroboros import workers
+from arcanelab.ouroboros.executors import Workflow
+from arcanelab.ouroboros.models import QueuedAction
+from .support import ApprovalWorkflowTestCase
+
+
+class WorkersTestCase(ApprovalWorkflowTestCase):
+
+    def _started(self, count):
+        instances = []
+        for index in range(count):
+            instance = self.workflow.instantiate(self.user, self._task())
+            instance.start(self.user)
+            instances.append(instance)
+        return instances
+
+    def test_claims_group_actions_by_instance(self):
+        first, second, third = self._started(3)
+        first.enqueue(self.user, 'submit')
+        second.enqueue(self.user, 'submit')
+        first.enqueue(self.user, 'approve', 'approval')
+        third.enqueue(self.user, 'submit')
+        batch = workers.claim('a', 2)
+        self.assertEqual([(workflow_instance.pk, [action.action_name for action in actions])
+                          for workflow_instance, actions in batch],
+                         [(first.instance.pk, ['submit', 'approve']), (second.instance.pk, ['submit'])])
+        # New actions of a claimed instance wait until the claim is released.
+        first.enqueue(self.user, 'audit', 'audit')
+        self.assertEqual([workflow_instance.pk for workflow_instance, actions in workers.claim('b', 5)],
+                         [third.instance.pk])
+        self.assertEqual(workers.claim('b', 5), [])
+        # Abandoned claims can be claimed again.
+        QueuedAction.objects.filter(worker='a').update(claimed_on=now() - timedelta(hours=1))
+        self.assertEqual([len(actions) for workflow_instance, actions in workers.claim('b', 5)], [3, 1])
+
+    def test_process_in_order(self):
+        instance, = self._started(1)
+        instance.enqueue(self.user, 'submit')
+        instance.enqueue(self.user, 'audit', 'audit')
+        instance.enqueue(self.user, 'missing')
+        instance.enqueue(self.user, 'approve', 'approval')
+        stats = workers.run('a')
+        self.assertEqual((stats['batches'], stats['instances'], stats['actions'], stats['failed']), (1, 1, 4, 1))
+        self.assertEqual(Workflow.get(instance.instance.document).get_workflow_status(), {'': ('ended', 101)})
+        failed = QueuedAction.objects.get(status=QueuedAction.FAILED)
+        self.assertEqual(failed.action_name, 'missing')
+        self.assertTrue(failed.error.startswith('WorkflowCourseInstanceNotWaiting'))
+        self.assertEqual(QueuedAction.objects.filter(status=QueuedAction.DONE).count(), 3)
+
+    def test_command(self):
+        for instance in self._started(3):
+            instance.enqueue(self.user, 'submit')
+            instance.enqueue(self.user, 'reject', 'approval')
+        out = StringIO()
+        call_command('ouroboros_run_workers', batch_size=2, stdout=out)
+        self.assertIn('6 actions (0 failed) on 3 instances', out.getvalue())
+        self.assertIn('Executed 6 actions (0 failed)', out.getvalue())